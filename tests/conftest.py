@@ -0,0 +1,58 @@
+import asyncio, os, sys
+
+import pytest
+
+# www/下的模块以顶层模块的方式互相导入(import orm),测试时同样把www加入sys.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'www'))
+
+import orm
+
+@pytest.fixture
+def run():
+    '''在新的事件循环中执行协程并返回结果'''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop.run_until_complete
+    loop.close()
+    asyncio.set_event_loop(None)
+
+# 不连接数据库的ORM:记录执行过的语句,结果由子类的query()/update()给出
+class FakeDB(object):
+
+    def __init__(self):
+        self.selects = []       # [(sql, args)]
+        self.executes = []
+
+    async def select(self, sql, args, size=None, primary=False):
+        args = list(args or ())
+        self.selects.append((sql, args))
+        return self.query(sql, args)
+
+    async def execute(self, sql, args, autocommit=True):
+        args = list(args or ())
+        self.executes.append((sql, args))
+        return self.update(sql, args)
+
+    def query(self, sql, args):
+        return []
+
+    def update(self, sql, args):
+        return 0
+
+class FakeTransaction(object):
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+@pytest.fixture
+def fake_orm(monkeypatch):
+    '''用FakeDB替换orm.select/execute/transaction: db = fake_orm(MyDB())'''
+    def install(db):
+        monkeypatch.setattr(orm, 'select', db.select)
+        monkeypatch.setattr(orm, 'execute', db.execute)
+        monkeypatch.setattr(orm, 'transaction', lambda batch=False: FakeTransaction())
+        return db
+    return install
@@ -0,0 +1,55 @@
+import time
+from datetime import datetime
+
+import pytest
+
+import app
+
+# 时区可以按进程切换的平台才能验证不同的UTC偏移
+@pytest.fixture(params=['UTC', 'Asia/Shanghai', 'America/New_York', 'Asia/Kathmandu'])
+def tz(request, monkeypatch):
+    if not hasattr(time, 'tzset'):
+        pytest.skip('time.tzset not available')
+    monkeypatch.setenv('TZ', request.param)
+    time.tzset()
+    app._absolute_date.cache_clear()
+    app._utc_offsets.clear()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+    app._absolute_date.cache_clear()
+    app._utc_offsets.clear()
+
+def expected(t):
+    dt = datetime.fromtimestamp(t)
+    return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
+
+def test_absolute_date_matches_local_calendar(tz):
+    # 每隔7分钟取一个时间,覆盖午夜前后与夏令时切换
+    start = time.mktime((2024, 3, 8, 0, 0, 0, 0, 0, -1))
+    for t in range(int(start), int(start) + 3 * 86400 * 7, 420):
+        assert app.format_datetime(t) == expected(t)
+
+def test_one_cache_entry_per_day(tz):
+    start = time.mktime((2024, 6, 1, 0, 0, 0, 0, 0, -1))
+    for t in range(int(start), int(start) + 10 * 86400, 60):
+        app.format_datetime(t)
+    assert app._absolute_date.cache_info().currsize == 10
+
+def test_utc_offset_cached_per_quarter_hour(tz, monkeypatch):
+    start = time.mktime((2024, 6, 1, 0, 0, 0, 0, 0, -1))
+    for t in range(int(start), int(start) + 86400, 60):
+        app.format_datetime(t)
+    assert len(app._utc_offsets) == 96
+    # 缓存命中时不再调用time.localtime()
+    def localtime(t=None):
+        raise AssertionError('time.localtime() called for a cached quarter hour')
+    monkeypatch.setattr(app.time, 'localtime', localtime)
+    assert app.format_datetime(start + 3600) == expected(start + 3600)
+
+def test_relative_times():
+    now = 1500000000
+    assert app.format_datetime(now - 30, now) == u'1分钟前'
+    assert app.format_datetime(now - 7200, now) == u'2小时前'
+    assert app.format_datetime(now - 86400 * 3, now) == u'3天前'
+    assert app.format_datetime(now - 86400 * 30, now) == app.format_datetime(now - 86400 * 30)
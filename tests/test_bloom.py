@@ -0,0 +1,23 @@
+import bloom
+
+def test_no_false_negatives():
+    f = bloom.BloomFilter(10000, 0.01)
+    emails = ['user%s@example.com' % i for i in range(10000)]
+    for e in emails:
+        f.add(e)
+    assert all(e in f for e in emails)
+    assert len(f) == 10000
+
+def test_false_positive_rate():
+    f = bloom.BloomFilter(10000, 0.01)
+    for i in range(10000):
+        f.add('user%s@example.com' % i)
+    false_positives = sum('other%s@example.com' % i in f for i in range(20000))
+    assert false_positives / 20000 < 0.02
+
+def test_size_follows_error_rate():
+    # 约9.6位/元素,7个哈希函数
+    f = bloom.BloomFilter(1000, 0.01)
+    assert 9000 < f.size < 10000
+    assert f.hashes == 7
+    assert len(f.bits) == (f.size + 7) // 8
@@ -0,0 +1,169 @@
+import asyncio
+
+import pytest
+
+import cache
+import coroweb
+
+def test_lru_evicts_least_recently_used():
+    b = cache.LRUBackend(2)
+    b.set('a', 1, 60)
+    b.set('b', 2, 60)
+    assert b.get('a') == (True, 1)
+    b.set('c', 3, 60)
+    assert b.get('b') == (False, None)
+    assert b.get('a') == (True, 1) and b.get('c') == (True, 3)
+
+def test_lru_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    b = cache.LRUBackend()
+    b.set('a', 1, 10, tags=['t'])
+    now[0] += 11
+    assert b.get('a') == (False, None)
+    assert b.stats()['size'] == 0 and b.stats()['tags'] == 0
+
+def test_invalidate_by_tag():
+    b = cache.LRUBackend()
+    b.set('list', 1, 60, tags=['blogs'])
+    b.set('blog:1', 2, 60, tags=['blogs', 'blog:1'])
+    b.set('blog:2', 3, 60, tags=['blog:2'])
+    assert b.invalidate(['blog:1']) == 1
+    assert b.get('list') == (True, 1)
+    assert b.invalidate(['blogs']) == 1
+    assert b.get('blog:2') == (True, 3)
+    assert b.stats()['size'] == 1
+
+@pytest.fixture
+def backend(monkeypatch):
+    b = cache.LRUBackend()
+    monkeypatch.setattr(cache, '_backend', b)
+    return b
+
+def test_get_or_compute_once(run, backend):
+    calls = []
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'value'
+    async def main():
+        return await asyncio.gather(*[cache.get_or_compute('k', compute, 60) for i in range(10)])
+    assert run(main()) == ['value'] * 10
+    assert run(cache.get_or_compute('k', compute, 60)) == 'value'
+    assert len(calls) == 1
+
+def test_get_or_compute_counts_one_miss(run, backend):
+    async def compute():
+        return 'value'
+    run(cache.get_or_compute('k', compute, 60))
+    assert (backend.hits, backend.misses) == (0, 1)
+    run(cache.get_or_compute('k', compute, 60))
+    assert (backend.hits, backend.misses) == (1, 1)
+
+def test_not_cached_when_invalidated_during_compute(run, backend):
+    async def compute():
+        cache.invalidate('blogs')   # 计算期间发生写操作
+        return 'stale'
+    assert run(cache.get_or_compute('k', compute, 60, ['blogs'])) == 'stale'
+    assert backend.get('k') == (False, None)
+
+# ---------------------------- @cached ----------------------------
+class Request(object):
+
+    def __init__(self, user=None):
+        self.__user__ = user
+
+class User(object):
+
+    def __init__(self, id):
+        self.id = id
+
+def test_cached_plain_function(run, backend):
+    calls = []
+    @coroweb.cached(ttl=60)
+    def handler(*, page='1'):
+        calls.append(page)
+        return dict(page=page)
+    assert run(handler(page='1')) == dict(page='1')
+    assert run(handler(page='1')) == dict(page='1')
+    assert run(handler(page='2')) == dict(page='2')
+    assert calls == ['1', '2']
+
+def test_cached_generator_and_async_function(run, backend):
+    calls = []
+    @coroweb.cached(ttl=60)
+    def gen(*, id):
+        yield from asyncio.sleep(0)
+        calls.append(id)
+        return id
+    @coroweb.cached(ttl=60)
+    async def coro(*, id):
+        calls.append(id)
+        return id
+    assert [run(gen(id='a')), run(gen(id='a')), run(coro(id='b')), run(coro(id='b'))] == ['a', 'a', 'b', 'b']
+    assert calls == ['a', 'b']
+
+def test_cached_tags_reference_arguments(run, backend):
+    calls = []
+    @coroweb.cached(ttl=60, tags=['blog:{id}'])
+    def handler(*, id):
+        calls.append(id)
+        return id
+    run(handler(id='1'))
+    run(handler(id='2'))
+    cache.invalidate('blog:1')
+    run(handler(id='1'))
+    run(handler(id='2'))
+    assert calls == ['1', '2', '1']
+
+def test_cached_vary_on_user(run, backend):
+    calls = []
+    @coroweb.cached(ttl=60, vary_on_user=True)
+    def handler(request, *, page='1'):
+        user = request.__user__
+        calls.append(user.id if user else None)
+        return calls[-1]
+    alice, bob = User('alice'), User('bob')
+    assert [run(handler(request=Request(alice), page='1')) for i in range(2)] == ['alice', 'alice']
+    assert run(handler(request=Request(bob), page='1')) == 'bob'
+    assert run(handler(request=Request(), page='1')) is None
+    assert calls == ['alice', 'bob', None]
+
+def test_vary_on_user_requires_request():
+    with pytest.raises(ValueError):
+        @coroweb.cached(vary_on_user=True)
+        def handler(*, page='1'):
+            return page
+
+def test_cached_under_get(run, backend):
+    calls = []
+    @coroweb.get('/api/things/{id}')
+    @coroweb.cached(ttl=60, tags=['thing:{id}'])
+    def handler(*, id):
+        calls.append(id)
+        return dict(id=id)
+    assert (handler.__method__, handler.__route__) == ('GET', '/api/things/{id}')
+    # 与add_route一样,通过RequestHandler调用
+    class R(object):
+        method, query_string = 'GET', ''
+        __match_info__ = match_info = dict(id='7')
+    h = coroweb.RequestHandler(None, handler)
+    assert run(h(R())) == dict(id='7')
+    assert run(h(R())) == dict(id='7')
+    assert calls == ['7']
+    cache.invalidate('thing:7')
+    run(h(R()))
+    assert calls == ['7', '7']
+
+def test_render_does_not_modify_cached_dict(run, backend):
+    import jinja2
+    import app
+    @coroweb.cached(ttl=60)
+    def index():
+        return {'__template__': 'now.html'}
+    env = jinja2.Environment(loader=jinja2.DictLoader({'now.html': '{{ __now__ }}'}))
+    async def main():
+        response = await app.response_factory(dict(__templating__=env), lambda request: index())
+        return await response(None)
+    assert float(run(main()).text) > 0
+    assert run(index()) == {'__template__': 'now.html'}
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import counter
+from conftest import FakeDB
+from models import Blog
+
+class FakeBlogs(FakeDB):
+
+    def query(self, sql, args):
+        return [dict(id='b%s' % i, name='blog %s' % i, views=100 - i) for i in range(args[-1])]
+
+    def update(self, sql, args):
+        return len(args) // 3
+
+class BrokenDB(FakeDB):
+
+    def update(self, sql, args):
+        raise RuntimeError('db down')
+
+@pytest.fixture(autouse=True)
+def state(monkeypatch):
+    monkeypatch.setattr(counter, '_pending', dict())
+    monkeypatch.setattr(counter, '_pending_total', 0)
+    monkeypatch.setattr(counter, '_totals', dict())
+    monkeypatch.setattr(counter, '_names', dict())
+    monkeypatch.setattr(counter, '_flush_lock', None)
+
+def test_load_popular_seeds_totals(run, fake_orm):
+    db = fake_orm(FakeBlogs())
+    run(counter.load_popular(3))
+    sql, args = db.selects[0]
+    assert sql.endswith('order by views desc limit ?') and args == [3]
+    assert counter.popular(2) == [dict(id='b0', name='blog 0', views=100), dict(id='b1', name='blog 1', views=99)]
+    # 之后的浏览在已知的总数上累加
+    counter.hit(Blog(id='b2', name='blog 2', views=98))
+    assert counter.popular(3)[1:] == [dict(id='b1', name='blog 1', views=99), dict(id='b2', name='blog 2', views=99)]
+
+def test_flush_batches_pending_views(run, fake_orm):
+    db = fake_orm(FakeBlogs())
+    async def main():
+        counter._flush_lock = asyncio.Lock()
+        for i in range(3):
+            counter.hit(Blog(id='a', name='a', views=0))
+        counter.hit(Blog(id='b', name='b', views=0))
+        await counter.flush()
+    run(main())
+    assert db.executes == [(counter._batch_update_sql(2), ['a', 3, 'b', 1, 'a', 'b'])]
+    assert counter._pending == dict() and counter._pending_total == 0
+
+def test_flush_keeps_counts_on_failure(run, fake_orm):
+    fake_orm(BrokenDB())
+    async def main():
+        counter._flush_lock = asyncio.Lock()
+        counter.hit(Blog(id='a', name='a', views=0))
+        await counter.flush()
+    run(main())
+    assert counter._pending == dict(a=1) and counter._pending_total == 1
+
+class SlowDB(FakeDB):
+
+    def __init__(self):
+        super().__init__()
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def execute(self, sql, args, autocommit=True):
+        self.started.set()
+        await self.release.wait()
+        return await super().execute(sql, args, autocommit)
+
+def test_close_waits_for_running_flush(run, fake_orm, monkeypatch):
+    async def main():
+        db = fake_orm(SlowDB())
+        counter.init(asyncio.get_event_loop(), interval=0.01)
+        counter.hit(Blog(id='a', name='a', views=0))
+        await db.started.wait()
+        closing = asyncio.ensure_future(counter.close())
+        await asyncio.sleep(0.05)
+        db.release.set()
+        await closing
+        return db
+    monkeypatch.setattr(counter, '_flush_task', None)
+    db = run(main())
+    assert db.executes == [(counter._batch_update_sql(1), ['a', 1, 'a'])]
+    assert counter._pending == dict() and counter._pending_total == 0
+    assert counter._flush_task.cancelled()
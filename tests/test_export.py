@@ -0,0 +1,68 @@
+import os, re
+
+import pytest
+
+import export
+from conftest import FakeDB
+
+# 两篇博客,第一篇有45条评论(超过一页)
+class FakeSite(FakeDB):
+
+    def __init__(self):
+        super().__init__()
+        self.blogs = [dict(id='b%s' % i, user_id='u', user_name='alice', user_image='about:blank', name='blog %s' % i,
+                           summary='summary %s' % i, content='# blog %s' % i, comment_count=45 if i == 1 else 0,
+                           views=0, created_at=1500000000.0 - i * 86400 * 40) for i in (1, 2)]
+        self.comments = [dict(id='%015d' % i, blog_id='b1', user_id='u', user_name='bob', user_image='about:blank',
+                              content='comment-%s' % i, html_content=None, created_at=1500000000.0 + i) for i in range(45)]
+
+    def query(self, sql, args):
+        if 'max(`id`) `latest`' in sql:
+            return [dict(blog_id=b, latest=max(c['id'] for c in self.comments if c['blog_id'] == b))
+                    for b in args if any(c['blog_id'] == b for c in self.comments)]
+        if ' from `blogs`' in sql:
+            rows = self.blogs
+        else:
+            rows = [c for c in self.comments if c['blog_id'] == args[0]]
+            if 'created_at<?' in sql:
+                created_at, cid = args[1], args[3]
+                rows = [c for c in rows if (c['created_at'], c['id']) < (created_at, cid)]
+            rows = sorted(rows, key=lambda c: (c['created_at'], c['id']), reverse=True)
+        if sql.endswith('limit ?, ?'):
+            return rows[args[-2]:args[-2] + args[-1]]
+        if sql.endswith('limit ?'):
+            return rows[:args[-1]]
+        return rows
+
+@pytest.fixture
+def db(fake_orm):
+    return fake_orm(FakeSite())
+
+def read(out_dir, *path):
+    with open(os.path.join(out_dir, *path), encoding='utf-8') as f:
+        return f.read()
+
+def test_export_all_comments_archive_and_feed(run, db, tmp_path):
+    out_dir = str(tmp_path)
+    run(export.export(out_dir, workers=1))
+    html = read(out_dir, 'blog', 'b1', 'index.html')
+    assert sorted(re.findall(r'comment-(\d+)', html), key=int) == [str(i) for i in range(45)]
+    assert 'id="more-comments"' not in html
+    # 导航中的/archive与/feed都有对应的文件
+    assert '/blog/b1' in read(out_dir, 'archive', 'index.html') and '/blog/b2' in read(out_dir, 'archive', 'index.html')
+    assert read(out_dir, 'feed').count('<entry>') == 2
+    # 没有变化时不再渲染;删除的归档会被补上
+    os.remove(os.path.join(out_dir, 'archive', 'index.html'))
+    run(export.export(out_dir, workers=1))
+    assert os.path.exists(os.path.join(out_dir, 'archive', 'index.html'))
+
+def test_comment_replaced_between_exports(run, db, tmp_path):
+    out_dir = str(tmp_path)
+    run(export.export(out_dir, workers=1))
+    # 删除一条评论并新增一条,评论数不变
+    del db.comments[0]
+    db.comments.append(dict(db.comments[-1], id='%015d' % 100, content='comment-new', created_at=1500000100.0))
+    run(export.export(out_dir, workers=1))
+    html = read(out_dir, 'blog', 'b1', 'index.html')
+    assert 'comment-new' in html
+    assert 'comment-0<' not in html
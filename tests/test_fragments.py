@@ -0,0 +1,28 @@
+import pytest
+from jinja2 import Environment
+
+import fragments
+
+@pytest.fixture
+def env(monkeypatch):
+    monkeypatch.setattr(fragments, '_backend', fragments.LRUBackend(16))
+    return Environment(extensions=[fragments.FragmentCacheExtension])
+
+def test_fragment_rendered_once(env):
+    t = env.from_string("{% cache 'k' %}{{ n }}{% endcache %}")
+    assert t.render(n=1) == '1'
+    assert t.render(n=2) == '1'
+    assert fragments.stats()['hits'] == 1
+
+def test_key_expression(env):
+    t = env.from_string("{% cache 'page:' ~ n %}{{ n }}{% endcache %}")
+    assert [t.render(n=i) for i in (1, 2, 1)] == ['1', '2', '1']
+    assert fragments.stats()['size'] == 2
+
+def test_invalidate_by_tag_and_key(env):
+    t = env.from_string("{% cache 'archive', 300, ['blogs'] %}{{ n }}{% endcache %}{% cache 'nav' %}{{ n }}{% endcache %}")
+    assert t.render(n=1) == '11'
+    fragments.invalidate('blogs')
+    assert t.render(n=2) == '21'
+    fragments.invalidate('nav')
+    assert t.render(n=3) == '23'
@@ -0,0 +1,98 @@
+import json, re
+
+import pytest
+
+import handlers
+import orm
+from apis import Page
+from conftest import FakeDB
+from models import Comment
+
+USER_COUNT = 100000
+
+# 10万个用户的假数据,select按SQL中的列与limit返回结果,并记录执行过的语句
+class FakeUsers(FakeDB):
+
+    def __init__(self, n):
+        super().__init__()
+        self.rows = [dict(id='%015d' % i, email='u%s@example.com' % i, passwd='%040x' % i, admin=False,
+                          name='user%s' % i, image='about:blank', created_at=1500000000.0 + i) for i in range(n)]
+        self.rows.reverse()     # created_at desc
+
+    def query(self, sql, args):
+        if 'count(id)' in sql:
+            return [dict(_num_=len(self.rows))]
+        m = re.match(r'select (.+) from `users`', sql)
+        columns = [c.strip().strip('`') for c in m.group(1).split(',')]
+        rows = self.rows
+        if sql.endswith('limit ?, ?'):
+            offset, limit = args[-2:]
+            rows = rows[offset:offset+limit]
+        elif sql.endswith('limit ?'):
+            rows = rows[:args[-1]]
+        return [dict((c, r[c]) for c in columns) for r in rows]
+
+@pytest.fixture
+def users(fake_orm):
+    return fake_orm(FakeUsers(USER_COUNT))
+
+@pytest.mark.parametrize('page', ['1', '2', '5000', '10000'])
+def test_api_get_users_pages_large_table(run, users, page):
+    r = run(handlers.api_get_users(page=page))
+    selects = [(sql, args) for sql, args in users.selects if 'count(id)' not in sql]
+    assert len(selects) == 1
+    sql, args = selects[0]
+    # 按页读取,不加载全部用户
+    assert sql.endswith('limit ?, ?')
+    assert args[-1] == Page(USER_COUNT).page_size
+    # 不查询passwd列
+    projection = sql[len('select '):sql.index(' from ')]
+    assert 'passwd' not in projection
+    assert all('passwd' not in u for u in r['users'])
+    # 响应大小与用户总数无关
+    assert 0 < len(r['users']) <= r['page'].page_size
+    body = json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8')
+    assert len(body) < 4096
+
+def test_api_get_users_out_of_range_page(run, users):
+    r = run(handlers.api_get_users(page='99999'))
+    assert len(r['users']) <= r['page'].page_size
+    assert all(sql.endswith('limit ?, ?') for sql, args in users.selects if 'count(id)' not in sql)
+
+class Admin(object):
+    __user__ = type('User', (), dict(admin=True))()
+
+@pytest.mark.parametrize('top, n', [('2', 2), ('abc', 3), ('-1', 3), ('0', 3), (None, 3)])
+def test_api_sql_stats_top(monkeypatch, top, n):
+    monkeypatch.setattr(orm, '_query_stats', dict(('q%s' % i, dict(sql='q%s' % i, count=1, total=float(i))) for i in range(5)))
+    monkeypatch.setitem(orm._slow_query, 'top', 3)
+    # top不是正整数时使用默认值,不返回500
+    r = handlers.api_sql_stats(Admin(), top=top)
+    assert [q['sql'] for q in r['queries']] == ['q4', 'q3', 'q2', 'q1', 'q0'][:n]
+
+# 一篇博客与其评论,delete与comment_count的增减作用在内存中的数据上
+class FakeComments(FakeDB):
+
+    def __init__(self, ids):
+        super().__init__()
+        self.ids = set(ids)
+        self.comment_count = len(self.ids)
+
+    def update(self, sql, args):
+        if sql.startswith('delete from `comments`'):
+            if args[0] in self.ids:
+                self.ids.remove(args[0])
+                return 1
+            return 0
+        if sql.startswith('update `blogs` set `comment_count`'):
+            self.comment_count += args[0]
+            return 1
+        return 0
+
+def test_remove_comment_twice_decrements_once(run, fake_orm):
+    db = fake_orm(FakeComments(['c1', 'c2']))
+    comment = Comment(id='c1', blog_id='b', user_id='u', user_name='bob', user_image='about:blank', content='hi')
+    run(handlers.remove_comment(comment))
+    run(handlers.remove_comment(comment))
+    assert db.ids == {'c2'}
+    assert db.comment_count == 1
@@ -0,0 +1,34 @@
+import jobs
+from conftest import FakeDB
+
+# 部分评论已经有html_content;记录每次select的参数与update的评论
+class FakeComments(FakeDB):
+
+    def __init__(self, n):
+        super().__init__()
+        self.rows = [dict(id='%015d' % i, content='comment %s' % i, html_content='<p>done</p>' if i % 3 == 0 else None) for i in range(n)]
+        self.updated = []
+
+    def query(self, sql, args):
+        assert sql.endswith('where id>? and html_content is null order by id limit ?')
+        last, limit = args
+        return [dict(id=r['id'], content=r['content']) for r in self.rows if r['id'] > last and r['html_content'] is None][:limit]
+
+    def update(self, sql, args):
+        html, cid = args
+        self.updated.append(cid)
+        for r in self.rows:
+            if r['id'] == cid:
+                r['html_content'] = html
+        return 1
+
+def test_backfill_pages_by_id(run, fake_orm):
+    fake = fake_orm(FakeComments(2000))
+    pending = [r['id'] for r in fake.rows if r['html_content'] is None]
+    assert run(jobs.backfill_comment_html()) == len(pending)
+    assert fake.updated == pending
+    assert all(r['html_content'] for r in fake.rows)
+    # 每一批从上一批最后的id之后开始
+    lasts = [args[0] for sql, args in fake.selects]
+    assert lasts[0] == ''
+    assert lasts[1:] == [pending[i * jobs.BATCH_SIZE - 1] for i in range(1, len(lasts))]
@@ -0,0 +1,108 @@
+import re
+
+import pytest
+
+import app
+import migrate
+import orm
+from conftest import FakeDB
+from models import User, Blog, Comment
+
+# 模拟information_schema与schema_migrations,记录执行过的DDL
+class FakeSchema(FakeDB):
+
+    def __init__(self, indexes=(), columns=None):
+        super().__init__()
+        self.indexes = set(indexes)         # (表, 索引名)
+        self.columns = dict(columns or {})  # (表, 列) ==> 类型
+        self.versions = set()
+        self.ddl = []
+
+    def query(self, sql, args):
+        if 'information_schema.statistics' in sql:
+            return [dict(_num_=1 if tuple(args) in self.indexes else 0)]
+        if 'select count(*) _num_ from information_schema.columns' in sql:
+            return [dict(_num_=1 if tuple(args) in self.columns else 0)]
+        if 'select column_type _type_ from information_schema.columns' in sql:
+            t = self.columns.get(tuple(args))
+            return [dict(_type_=t)] if t else []
+        if 'from `schema_migrations`' in sql:
+            return [dict(version=v) for v in self.versions]
+        if 'get_lock' in sql:
+            return [dict(_lock_=1)]
+        return [dict()]
+
+    def update(self, sql, args):
+        if sql.startswith('insert into `schema_migrations`'):
+            self.versions.add(args[0])
+        elif sql.startswith('alter table'):
+            self.ddl.append(sql)
+            m = re.match(r'alter table `(\w+)` add index `(\w+)`', sql)
+            if m:
+                self.indexes.add(m.groups())
+            m = re.match(r'alter table `(\w+)` (?:add|modify) column `(\w+)` ([\w()]+)', sql)
+            if m:
+                self.columns[m.group(1), m.group(2)] = m.group(3)
+        return 0
+
+# 迁移之前的数据库:没有新增的索引与列,passwd仍为varchar(50)
+def _old_schema():
+    columns = dict(((m.__table__, f), m.__mappings__[f].column_type) for m in (User, Blog, Comment) for f in m.__mappings__)
+    del columns['comments', 'html_content']
+    del columns['blogs', 'comment_count']
+    del columns['blogs', 'views']
+    columns['users', 'passwd'] = 'varchar(50)'
+    return FakeSchema(columns=columns)
+
+ALL_VERSIONS = [version for version, description, operations in migrate.MIGRATIONS]
+
+def test_versions_are_ordered_and_unique():
+    assert ALL_VERSIONS == sorted(set(ALL_VERSIONS))
+
+def test_migrate_applies_everything_once(run, fake_orm):
+    schema = fake_orm(_old_schema())
+    assert run(migrate.migrate()) == ALL_VERSIONS
+    n = len(schema.ddl)
+    assert n == sum(len(operations) for version, description, operations in migrate.MIGRATIONS)
+    assert ('comments', 'idx_blog_id_created_at') in schema.indexes
+    assert schema.columns['users', 'passwd'] == 'varchar(200)'
+    # 再次执行up不做任何修改
+    assert run(migrate.migrate()) == []
+    assert len(schema.ddl) == n
+
+def test_exists_short_circuits_on_current_schema(run, fake_orm):
+    # schema.sql新建的数据库已包含全部索引与列,迁移只登记版本号
+    schema = fake_orm(_old_schema())
+    run(migrate.migrate())
+    schema.versions.clear()
+    schema.ddl = []
+    assert run(migrate.migrate()) == ALL_VERSIONS
+    assert schema.ddl == []
+
+@pytest.mark.parametrize('op', [op for version, description, operations in migrate.MIGRATIONS for op in operations], ids=str)
+def test_each_operation_is_idempotent(run, fake_orm, op):
+    fake_orm(_old_schema())
+    assert not run(op.exists())
+    run(op.apply())
+    assert run(op.exists())
+
+# 与orm.execute()一样,写操作后将当前上下文固定到主库
+class PinningSchema(FakeSchema):
+
+    def update(self, sql, args):
+        orm.pin_primary()
+        return super().update(sql, args)
+
+def test_init_migration_does_not_pin_primary(run, fake_orm):
+    fake_orm(PinningSchema(columns=_old_schema().columns))
+    async def main():
+        await app.run_migrations()
+        return orm._primary_pinned.get()
+    assert run(main()) is False
+
+def test_direct_migration_pins_primary(run, fake_orm):
+    fake_orm(PinningSchema(columns=_old_schema().columns))
+    async def main():
+        await migrate.migrate()
+        return orm._primary_pinned.get()
+    assert run(main()) is True
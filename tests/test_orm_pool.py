@@ -0,0 +1,174 @@
+import asyncio
+
+import aiomysql
+import pytest
+
+import orm
+
+class FakeConn(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def get_transaction_status(self):
+        return False
+
+# release()需要在事件循环中调用
+def release(run, pool, conn):
+    async def do():
+        await pool.release(conn)
+    run(do())
+
+# 不连接数据库的aiomysql连接池,直接填入假连接
+@pytest.fixture
+def pool(run):
+    async def create():
+        return aiomysql.Pool(minsize=0, maxsize=4, echo=False, pool_recycle=-1, loop=asyncio.get_event_loop())
+    pool = run(create())
+    free, used = [FakeConn(), FakeConn()], [FakeConn(), FakeConn()]
+    pool._free.extend(free)
+    pool._used.update(used)
+    return pool, free, used
+
+@pytest.fixture
+def create(monkeypatch):
+    '''替换_create_pool,以新的maxsize创建不连接数据库的连接池'''
+    async def create_pool(loop, kw, maxsize):
+        return aiomysql.Pool(minsize=0, maxsize=maxsize, echo=False, pool_recycle=-1, loop=asyncio.get_event_loop())
+    monkeypatch.setattr(orm, '_create_pool', create_pool)
+    monkeypatch.setattr(orm, '_pool_options', dict())
+    monkeypatch.setattr(orm, '_pool_tasks', [])
+
+def test_resize_swaps_primary_pool(run, pool, create, monkeypatch):
+    pool, free, used = pool
+    monkeypatch.setattr(orm, '__pool', pool, raising=False)
+    _options(pool)
+    options = orm._pool_options[pool]
+    async def resize():
+        return await orm._resize_pool(pool, 6)
+    new = run(resize())
+    assert new is not pool and new.maxsize == 6
+    assert getattr(orm, '__pool') is new
+    assert orm._pool_options == {new: options}
+    # 原连接池的空闲连接被关闭,使用中的连接归还时关闭,全部归还后结束
+    assert all(c.closed for c in free)
+    assert not any(c.closed for c in used)
+    for conn in used:
+        release(run, pool, conn)
+    assert all(c.closed for c in used)
+    run(asyncio.gather(*orm._pool_tasks))
+    assert pool.closed
+
+def test_resize_swaps_replica_pool(run, pool, create, monkeypatch):
+    pool, free, used = pool
+    primary = object()
+    monkeypatch.setattr(orm, '__pool', primary, raising=False)
+    _options(pool)
+    replica = dict(name='replica', pool=pool, down_until=0.0, failures=0)
+    async def resize():
+        return await orm._resize_pool(pool, 3, replica)
+    new = run(resize())
+    assert replica['pool'] is new and new.maxsize == 3
+    assert getattr(orm, '__pool') is primary
+
+def test_resize_keeps_pool_on_failure(run, pool, monkeypatch):
+    pool, free, used = pool
+    async def create_pool(loop, kw, maxsize):
+        raise OSError('connection refused')
+    monkeypatch.setattr(orm, '_create_pool', create_pool)
+    monkeypatch.setattr(orm, '_pool_options', dict())
+    _options(pool)
+    async def resize():
+        return await orm._resize_pool(pool, 6)
+    assert run(resize()) is pool
+    assert pool in orm._pool_options and not any(c.closed for c in free)
+
+# 只支持_maintain_pool()需要的接口,acquire() n次之后取消维护任务
+class FakePool(object):
+
+    def __init__(self, maxsize, n=1, busy=False):
+        self.maxsize = maxsize
+        self.closed = False
+        self._n = n
+        self._busy = busy       # 为True时模拟连接已全部被占用,第一次acquire()一直等待
+
+    async def acquire(self):
+        if self._n == 0:
+            raise asyncio.CancelledError()
+        self._n -= 1
+        if self._busy:
+            self._busy = False
+            await asyncio.Event().wait()
+        return self
+
+    def release(self, conn):
+        pass
+
+    async def ping(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+# 扩缩容创建的连接池,第一次acquire()时结束维护任务
+async def _create_fake_pool(loop, kw, maxsize):
+    return FakePool(maxsize, n=0)
+
+def _options(pool, **window):
+    options = dict(loop=None, kw=dict(), maxsize=4, max_limit=8, ping_interval=0, ping_timeout=0.01, wait_threshold=0.01,
+                   window_acquired=0, window_waited=0, window_wait_total=0.0)
+    options.update(window)
+    orm._pool_options[pool] = options
+
+@pytest.fixture
+def maintain(monkeypatch):
+    monkeypatch.setattr(orm, '_create_pool', _create_fake_pool)
+    monkeypatch.setattr(orm, '_pool_options', dict())
+    monkeypatch.setattr(orm, '_pool_tasks', [])
+
+def test_replica_resized_from_its_own_window(run, maintain, monkeypatch):
+    primary, pool = FakePool(4), FakePool(4)
+    monkeypatch.setattr(orm, '__pool', primary, raising=False)
+    _options(primary)
+    _options(pool, window_acquired=10, window_waited=5, window_wait_total=1.0)
+    replica = dict(name='replica', pool=pool, down_until=0.0, failures=0)
+    with pytest.raises(asyncio.CancelledError):
+        run(orm._maintain_pool(pool, replica))
+    assert replica['pool'].maxsize == 5 and pool.closed
+    # 窗口按连接池各自清零,主库的窗口不受影响
+    assert orm._pool_options[replica['pool']]['window_acquired'] == 0
+    with pytest.raises(asyncio.CancelledError):
+        run(orm._maintain_pool(primary))
+    assert getattr(orm, '__pool') is primary and primary.maxsize == 4
+
+def test_shrink_to_configured_maxsize(run, maintain, monkeypatch):
+    pool = FakePool(8)
+    monkeypatch.setattr(orm, '__pool', pool, raising=False)
+    _options(pool, window_acquired=10)
+    with pytest.raises(asyncio.CancelledError):
+        run(orm._maintain_pool(pool))
+    assert getattr(orm, '__pool').maxsize == 4 and pool.closed
+
+def test_ping_not_counted_in_window(run, maintain, monkeypatch):
+    pool = FakePool(4)
+    monkeypatch.setitem(orm._pool_stats, 'acquired', 0)
+    _options(pool)
+    with pytest.raises(asyncio.CancelledError):
+        run(orm._maintain_pool(pool))
+    assert orm._pool_stats['acquired'] == 0
+
+def test_saturated_pool_skips_ping_and_grows(run, maintain, monkeypatch):
+    pool = FakePool(4, busy=True)
+    monkeypatch.setattr(orm, '__pool', pool, raising=False)
+    monkeypatch.setitem(orm._pool_stats, 'ping_failures', 0)
+    _options(pool, window_acquired=10, window_waited=5, window_wait_total=1.0)
+    with pytest.raises(asyncio.CancelledError):
+        run(orm._maintain_pool(pool))
+    assert getattr(orm, '__pool').maxsize == 5
+    assert orm._pool_stats['ping_failures'] == 0
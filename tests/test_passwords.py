@@ -0,0 +1,45 @@
+import hashlib
+
+import pytest
+
+import passwords
+from apis import APIError
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch):
+    monkeypatch.setattr(passwords, '_options', dict(iterations=1000, workers=2, max_waiting=100))
+    monkeypatch.setattr(passwords, '_executor', None)
+    monkeypatch.setattr(passwords, '_semaphore', None)
+    monkeypatch.setattr(passwords, '_waiting', 0)
+    yield
+    passwords.close()
+
+def test_hash_and_verify(run):
+    stored = run(passwords.hash_password('uid', 'secret'))
+    algorithm, iterations, salt, dk = stored.split('$')
+    assert (algorithm, iterations) == ('pbkdf2_sha256', '1000')
+    assert len(stored) <= 200   # users.passwd为varchar(200)
+    # 每次使用不同的salt
+    assert run(passwords.hash_password('uid', 'secret')) != stored
+    assert run(passwords.verify_password('uid', 'secret', stored)) == (True, False)
+    assert run(passwords.verify_password('uid', 'wrong', stored)) == (False, False)
+    assert run(passwords.verify_password('other', 'secret', stored)) == (False, False)
+
+def test_legacy_sha1_needs_rehash(run):
+    stored = hashlib.sha1(b'uid:secret').hexdigest()
+    assert run(passwords.verify_password('uid', 'secret', stored)) == (True, True)
+    assert run(passwords.verify_password('uid', 'wrong', stored)) == (False, True)
+
+def test_fewer_iterations_needs_rehash(run):
+    stored = run(passwords.hash_password('uid', 'secret'))
+    passwords._options['iterations'] = 2000
+    assert run(passwords.verify_password('uid', 'secret', stored)) == (True, True)
+
+@pytest.mark.parametrize('stored', ['pbkdf2_sha256$x$00$00', 'md5$1000$00$00', 'a$b'])
+def test_invalid_hash(run, stored):
+    assert run(passwords.verify_password('uid', 'secret', stored)) == (False, False)
+
+def test_reject_when_too_many_waiting(run, monkeypatch):
+    monkeypatch.setattr(passwords, '_waiting', 100)
+    with pytest.raises(APIError):
+        run(passwords.hash_password('uid', 'secret'))
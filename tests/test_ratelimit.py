@@ -0,0 +1,87 @@
+import pytest
+
+import app
+import ratelimit
+
+class Route(object):
+    method, path = 'POST', '/api/blogs'
+
+class Request(object):
+
+    def __init__(self, user=None, remote='10.0.0.1', cookies=None):
+        self.method, self.path = Route.method, Route.path
+        self.__route__ = Route()
+        self.headers = dict()
+        self.remote = remote
+        self.cookies = cookies or dict()
+        if user is not None:
+            self.__user__ = user
+
+class User(dict):
+
+    def __getattr__(self, key):
+        return self[key]
+
+def test_bucket_allows_burst_then_rate():
+    limiter = ratelimit.TokenBucketLimiter(3, 60)
+    assert [limiter.take('k', now=0) for i in range(3)] == [0, 0, 0]
+    assert limiter.take('k', now=0) == pytest.approx(20)
+    assert limiter.take('k', now=20) == 0
+    assert limiter.take('k', now=20) > 0
+
+def test_gc_removes_full_buckets():
+    limiter = ratelimit.TokenBucketLimiter(3, 60)
+    limiter.take('a', now=0)
+    limiter.take('b', now=50)
+    assert limiter.gc(now=30) == 1
+    assert len(limiter) == 1
+
+@pytest.fixture
+def rules(monkeypatch):
+    monkeypatch.setattr(ratelimit, '_rules', {'POST /api/blogs': dict(user=ratelimit.TokenBucketLimiter(1, 60))})
+
+def test_limit_by_user(rules):
+    alice, bob = User(id='alice'), User(id='bob')
+    assert ratelimit.check(Request(alice)) == 0
+    assert ratelimit.check(Request(alice, remote='10.0.0.2')) > 0
+    assert ratelimit.check(Request(bob)) == 0
+    # 没有登录用户时不按用户限流
+    assert ratelimit.check(Request()) == 0
+
+# 按app.MIDDLEWARES的顺序组装中间件,记录cookie2user的调用次数
+@pytest.fixture
+def chain(monkeypatch):
+    lookups = []
+    async def cookie2user(cookie_str):
+        lookups.append(cookie_str)
+        return User(id=cookie_str, email='%s@example.com' % cookie_str, admin=False)
+    monkeypatch.setattr(app, 'cookie2user', cookie2user)
+    async def handler(request):
+        return dict(ok=True)
+    async def build():
+        h = handler
+        for factory in reversed(app.MIDDLEWARES):
+            h = await factory(dict(), h)
+        return h
+    return build, lookups
+
+def test_middleware_order():
+    m = app.MIDDLEWARES
+    assert m.index(ratelimit.ip_ratelimit_factory) < m.index(app.auth_factory) < m.index(ratelimit.user_ratelimit_factory)
+
+def test_ip_limit_before_user_lookup(run, chain, monkeypatch):
+    monkeypatch.setattr(ratelimit, '_rules', {'POST /api/blogs': dict(ip=ratelimit.TokenBucketLimiter(1, 60))})
+    build, lookups = chain
+    async def main():
+        h = await build()
+        return [await h(Request(cookies={app.COOKIE_NAME: 'alice'})) for i in range(3)]
+    assert [r.status for r in run(main())] == [200, 429, 429]
+    # 被限流的请求不会解析cookie查询用户
+    assert lookups == ['alice']
+
+def test_user_limit_after_auth(run, chain, rules):
+    build, lookups = chain
+    async def main():
+        h = await build()
+        return [await h(Request(cookies={app.COOKIE_NAME: name})) for name in ('alice', 'alice', 'bob')]
+    assert [r.status for r in run(main())] == [200, 429, 200]
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import coroweb
+
+class Content(object):
+
+    def __init__(self, body, chunk):
+        self._chunks = [body[i:i+chunk] for i in range(0, len(body), chunk)]
+        self.reads = 0
+
+    async def read(self, n):
+        self.reads += 1
+        return self._chunks.pop(0) if self._chunks else b''
+
+class Request(object):
+
+    def __init__(self, body, charset='utf-8', content_type='application/json', length=True, chunk=coroweb.READ_CHUNK):
+        self.method, self.path = 'POST', '/api/test'
+        self.content_type = content_type
+        self.charset = charset
+        self.content_length = len(body) if length else None
+        self.content = Content(body, chunk)
+        self.match_info = dict()
+
+def test_decode_across_chunks(run):
+    body = json.dumps(dict(content=u'中文' * 1000), ensure_ascii=False).encode('utf-8')
+    # 每块7字节,多字节字符会被切开
+    assert run(coroweb.read_body(Request(body, chunk=7), 1 << 20, decode=True)) == body.decode('utf-8')
+
+def test_content_length_checked_before_reading(run):
+    request = Request(b'x' * 100)
+    with pytest.raises(coroweb.BodyTooLarge):
+        run(coroweb.read_body(request, 10))
+    assert request.content.reads == 0
+
+def test_chunked_body_stops_at_limit(run):
+    request = Request(b'x' * 100, length=False, chunk=8)
+    with pytest.raises(coroweb.BodyTooLarge):
+        run(coroweb.read_body(request, 20))
+    assert request.content.reads == 3
+
+def test_unknown_charset(run):
+    request = Request(b'{}', charset='x-no-such-charset')
+    with pytest.raises(coroweb.UnsupportedCharset):
+        run(coroweb.read_body(request, 1024, decode=True))
+    assert request.content.reads == 0
+
+def handler(*, name):
+    return name
+
+@pytest.mark.parametrize('request_, status', [
+    (Request(b'{"name": "x"}', charset='x-no-such-charset'), 415),
+    (Request(b'\xff\xfe', charset='utf-8'), 400),
+    (Request(b'name=x', charset='x-no-such-charset', content_type='application/x-www-form-urlencoded'), 415),
+    (Request(b'{"name": "x"}' + b' ' * 100), 413),
+], ids=['json-charset', 'json-invalid', 'form-charset', 'too-large'])
+def test_request_handler_status(run, request_, status):
+    h = coroweb.RequestHandler(None, handler, max_body=64)
+    r = run(h(request_))
+    assert r.status == status
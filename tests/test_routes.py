@@ -0,0 +1,52 @@
+import pytest
+
+import coroweb
+
+@pytest.fixture
+def table():
+    t = coroweb.RouteTable()
+    for method, path in [('GET', '/'), ('GET', '/api/blogs'), ('POST', '/api/blogs'), ('GET', '/api/blogs/{id}'),
+                         ('POST', '/api/blogs/{id}'), ('GET', '/api/blogs/{id}/comments'), ('POST', '/api/blogs/{id}/delete'),
+                         ('GET', '/api/blogs/popular')]:
+        t.add(method, path, '%s %s' % (method, path))
+    return t
+
+@pytest.mark.parametrize('method, path, handler, params', [
+    ('GET', '/', 'GET /', dict()),
+    ('GET', '/api/blogs', 'GET /api/blogs', dict()),
+    ('POST', '/api/blogs', 'POST /api/blogs', dict()),
+    ('GET', '/api/blogs/123', 'GET /api/blogs/{id}', dict(id='123')),
+    ('HEAD', '/api/blogs/123', 'GET /api/blogs/{id}', dict(id='123')),
+    ('GET', '/api/blogs/123/comments', 'GET /api/blogs/{id}/comments', dict(id='123')),
+    # 固定段优先于参数
+    ('GET', '/api/blogs/popular', 'GET /api/blogs/popular', dict()),
+    ('POST', '/api/blogs/delete/delete', 'POST /api/blogs/{id}/delete', dict(id='delete')),
+])
+def test_resolve(table, method, path, handler, params):
+    route, p, allowed = table.resolve(method, path)
+    assert route.handler == handler
+    assert p == params and allowed is None
+
+def test_method_not_allowed(table):
+    assert table.resolve('DELETE', '/api/blogs/1') == (None, None, {'GET', 'POST'})
+
+@pytest.mark.parametrize('path', ['/api', '/api/blogs/', '/api/blogs//comments', '/api/blogs/1/comments/2', '/nothing'])
+def test_not_found(table, path):
+    assert table.resolve('GET', path) == (None, None, None)
+
+@pytest.mark.parametrize('path', ['api/blogs', '/api/blogs/{id}x', '/api/blogs/{1d}', '/api/blogs/{name}/comments', '/api/blogs'])
+def test_invalid_routes(table, path):
+    with pytest.raises(ValueError):
+        table.add('GET', path, None)
+
+def test_routes_are_listed(table):
+    assert len(table) == 8
+    assert [(r.method, r.path) for r in table.routes()][:3] == [('GET', '/'), ('GET', '/api/blogs'), ('POST', '/api/blogs')]
+
+def test_route_exposes_handler_function():
+    async def handler(*, id):
+        return id
+    t = coroweb.RouteTable()
+    route = t.add('GET', '/api/things/{id}', coroweb.RequestHandler(None, handler))
+    assert route.func is handler
+    assert str(route) == 'GET /api/things/{id} => handler(*, id)'
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+import search
+from models import Blog
+
+def blog(id, name, summary='', content='', created_at=1500000000.0):
+    return Blog(id=id, name=name, summary=summary, content=content, created_at=created_at)
+
+@pytest.fixture
+def index():
+    idx = search.SearchIndex()
+    idx.add(blog('b1', '读书笔记', content='这本书讲的是一只猫。书中的猫很聪明。'))
+    idx.add(blog('b2', 'Python asyncio', content='事件循环与协程'))
+    idx.add(blog('b3', '旅行', content='一路向西'))
+    return idx
+
+def ids(result):
+    return [r['id'] for r in result[1]]
+
+def test_tokenize():
+    assert search.tokenize('读书 Python3') == ['读书', 'python3']
+    assert search.tokenize('读书笔记') == ['读书', '书笔', '笔记']
+    assert search.tokenize('读书笔记', unigrams=True) == ['读书', '书笔', '笔记', '读', '书', '笔', '记']
+    assert search.tokenize('书') == ['书']
+
+@pytest.mark.parametrize('q', ['书', '猫', '读书', '书中的猫'])
+def test_cjk_queries(index, q):
+    assert ids(index.search(q)) == ['b1']
+
+def test_single_character_not_matching(index):
+    assert index.search('狗') == (0, [])
+
+def test_words_and_removal(index):
+    assert ids(index.search('AsyncIO')) == ['b2']
+    index.remove('b2')
+    assert index.search('asyncio') == (0, [])
+
+def test_save_and_reload(index, tmp_path):
+    path = str(tmp_path / 'search.idx')
+    index.save(path)
+    loaded = search.SearchIndex(path)
+    assert len(loaded) == 3
+    assert ids(loaded.search('书')) == ['b1']
+    assert ids(loaded.search('协程')) == ['b2']
+    loaded.close()
+
+def test_changes_during_background_save_are_kept(run, index, tmp_path):
+    path = str(tmp_path / 'search.idx')
+    index.save(path)
+    index.add(blog('b4', '猫的故事'))
+    async def main():
+        task = asyncio.ensure_future(index.save_in_executor())
+        await asyncio.sleep(0)      # 已复制快照,合并与写入在线程中进行
+        index.add(blog('b5', '书店'))
+        index.remove('b1')
+        await task
+    run(main())
+    assert index.dirty
+    assert sorted(ids(index.search('书'))) == ['b5']
+    assert sorted(ids(index.search('猫'))) == ['b4']
+    index.save()
+    loaded = search.SearchIndex(path)
+    assert sorted(ids(loaded.search('书'))) == ['b5']
+    assert sorted(ids(loaded.search('猫'))) == ['b4']
+    assert len(loaded) == 4
+    loaded.close()
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+import singleflight
+
+def test_concurrent_calls_share_one_execution(run):
+    g = singleflight.SingleFlight('test')
+    n = 0
+    async def fn():
+        nonlocal n
+        n += 1
+        await asyncio.sleep(0.01)
+        return n
+    async def main():
+        return await asyncio.gather(*[g.do('k', fn) for i in range(100)])
+    assert run(main()) == [1] * 100
+    assert g.stats() == dict(calls=100, executions=1, coalesced=99, inflight=0)
+    # 执行结束后不保留结果
+    assert run(g.do('k', fn)) == 2
+
+def test_exception_is_shared(run):
+    g = singleflight.SingleFlight('test')
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+    async def main():
+        return await asyncio.gather(g.do('k', fn), g.do('k', fn), return_exceptions=True)
+    assert [type(e) for e in run(main())] == [ValueError, ValueError]
+    assert g.executions == 1
+
+def test_waiter_takes_over_when_executor_cancelled(run):
+    g = singleflight.SingleFlight('test')
+    async def fn():
+        await asyncio.sleep(0.01)
+        return 'ok'
+    async def main():
+        first = asyncio.ensure_future(g.do('k', fn))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(g.do('k', fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+    assert run(main()) == 'ok'
+    assert g.executions == 2
@@ -0,0 +1,162 @@
+import aiomysql
+import pytest
+
+import orm
+
+# 记录事务中执行的操作的假连接:log中依次为begin/commit/rollback与(方法, sql, args)
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, args):
+        self.conn.log.append(('execute', sql, args))
+        self.conn.check(sql, [args])
+        self.rowcount = 1
+
+    async def executemany(self, sql, args):
+        self.conn.log.append(('executemany', sql, args))
+        self.conn.check(sql, args)
+        self.rowcount = len(args)
+
+    async def fetchall(self):
+        return [dict(n=1)]
+
+class FakeConn(object):
+
+    def __init__(self, duplicate=None):
+        self.log = []
+        self.duplicate = duplicate      # 参数中出现该值时抛出违反唯一索引的错误
+
+    def check(self, sql, L):
+        if any(self.duplicate in args for args in L):
+            raise aiomysql.IntegrityError(1062, "Duplicate entry '%s' for key 'users.idx_email'" % self.duplicate)
+
+    def cursor(self, cls):
+        return FakeCursor(self)
+
+    async def begin(self):
+        self.log.append('begin')
+
+    async def commit(self):
+        self.log.append('commit')
+
+    async def rollback(self):
+        self.log.append('rollback')
+
+class FakePool(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.released = 0
+
+    async def acquire(self):
+        return self.conn
+
+    def release(self, conn):
+        self.released += 1
+
+@pytest.fixture
+def pool(monkeypatch):
+    '''事务使用的主库连接池: pool = pool(FakeConn())'''
+    def install(conn):
+        pool = FakePool(conn)
+        monkeypatch.setattr(orm, '_primary_pool', lambda: pool)
+        monkeypatch.setitem(orm._pool_options, pool, dict(window_acquired=0, window_waited=0, window_wait_total=0.0))
+        return pool
+    return install
+
+INSERT = 'insert into `users` (`email`) values (?)'
+UPDATE = 'update `blogs` set `views`=? where `id`=?'
+
+def test_commit_on_success(run, pool):
+    p = pool(FakeConn())
+    async def main():
+        async with orm.transaction():
+            assert (await orm.select('select 1 as n', None)) == [dict(n=1)]
+            assert (await orm.execute(INSERT, ['a@b.c'])) == 1
+    run(main())
+    assert p.conn.log == ['begin', ('execute', 'select 1 as n', ()), ('execute', orm._driver_sql(INSERT), ['a@b.c']), 'commit']
+    assert p.released == 1
+
+def test_rollback_on_exception(run, pool):
+    p = pool(FakeConn())
+    async def main():
+        async with orm.transaction():
+            await orm.execute(INSERT, ['a@b.c'])
+            raise ValueError('abort')
+    with pytest.raises(ValueError):
+        run(main())
+    assert p.conn.log == ['begin', ('execute', orm._driver_sql(INSERT), ['a@b.c']), 'rollback']
+    assert p.released == 1
+
+def test_nested_transaction_joins_outer(run, pool):
+    p = pool(FakeConn())
+    async def main():
+        async with orm.transaction() as outer:
+            async with orm.transaction() as inner:
+                assert inner is outer
+                await orm.execute(INSERT, ['a@b.c'])
+            # 内层退出时不提交
+            assert p.conn.log[-1] != 'commit'
+            await orm.execute(INSERT, ['d@e.f'])
+    run(main())
+    assert p.conn.log.count('begin') == 1 and p.conn.log.count('commit') == 1
+    assert p.conn.log[-1] == 'commit' and p.released == 1
+
+def test_nested_exception_rolls_back_outer(run, pool):
+    p = pool(FakeConn())
+    async def main():
+        async with orm.transaction():
+            await orm.execute(INSERT, ['a@b.c'])
+            async with orm.transaction():
+                raise ValueError('abort')
+    with pytest.raises(ValueError):
+        run(main())
+    assert p.conn.log[-1] == 'rollback' and 'commit' not in p.conn.log
+
+def test_batch_groups_consecutive_statements(run, pool):
+    p = pool(FakeConn())
+    async def main():
+        async with orm.transaction(batch=True):
+            for email in ('a@b.c', 'd@e.f', 'g@h.i'):
+                assert (await orm.execute(INSERT, [email])) is None
+            await orm.execute(UPDATE, [1, 'x'])
+            await orm.execute(INSERT, ['j@k.l'])
+            # 提交前不执行写语句
+            assert p.conn.log == ['begin']
+    run(main())
+    assert p.conn.log == ['begin',
+                          ('executemany', orm._driver_sql(INSERT), [['a@b.c'], ['d@e.f'], ['g@h.i']]),
+                          ('execute', orm._driver_sql(UPDATE), [1, 'x']),
+                          ('execute', orm._driver_sql(INSERT), ['j@k.l']),
+                          'commit']
+
+def test_batch_discarded_on_exception(run, pool):
+    p = pool(FakeConn())
+    async def main():
+        async with orm.transaction(batch=True):
+            await orm.execute(INSERT, ['a@b.c'])
+            raise ValueError('abort')
+    with pytest.raises(ValueError):
+        run(main())
+    assert p.conn.log == ['begin', 'rollback']
+
+def test_batch_duplicate_key(run, pool):
+    p = pool(FakeConn(duplicate='d@e.f'))
+    async def main():
+        async with orm.transaction(batch=True):
+            await orm.execute(INSERT, ['a@b.c'])
+            await orm.execute(INSERT, ['d@e.f'])
+    with pytest.raises(orm.DuplicateKeyError) as e:
+        run(main())
+    assert e.value.key == 'idx_email'
+    assert p.conn.log[-1] == 'rollback' and 'commit' not in p.conn.log
+    assert p.released == 1
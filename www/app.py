@@ -1,16 +1,30 @@
 'web app主框架'
 import logging; logging.basicConfig(level=logging.INFO)# 设置日志等级
 
-import asyncio, os, json, time
+import asyncio, functools, os, json, signal, time
 from datetime import datetime
 
 from aiohttp import web
 from jinja2 import Environment, FileSystemLoader
+try:
+    from jinja2 import pass_context
+except ImportError:     # Jinja2 < 3.0
+    from jinja2 import contextfilter as pass_context
 
 import orm
+import migrate
+import search
+import archive
+import counter
+import passwords
+import ratelimit
+import cache
+import fragments
+from fragments import FragmentCacheExtension
+from config import configs
 from coroweb import add_routes, add_static
 
-from handlers import cookie2user, COOKIE_NAME
+from handlers import cookie2user, load_known_emails, COOKIE_NAME
 
 # 选择jinja2作为模板, 初始化模板
 def init_jinja2(app, **kw):
@@ -21,7 +35,8 @@ def init_jinja2(app, **kw):
         block_end_string = kw.get('block_end_string', '%}'),            # 代码块结束标志
         variable_start_string = kw.get('variable_start_string', '{{'),  # 变量开始标志
         variable_end_string = kw.get('variable_end_string', '}}'),      # 变量结束标志
-        auto_reload = kw.get('auto_reload', True)                       # 每当对模板发起请求,检查模板是否发生改变.若是,则重载模板
+        auto_reload = kw.get('auto_reload', True),                      # 每当对模板发起请求,检查模板是否发生改变.若是,则重载模板
+        extensions = kw.get('extensions', [FragmentCacheExtension])     # {% cache %}片段缓存,见fragments.py
     )
     path = kw.get('path', None) # 指定path
     if path is None:
@@ -88,6 +103,32 @@ async def data_factory(app, handler):
         return (await handler(request))
     return parse_data
 
+# 流式渲染模板:用generate()逐段生成,累积到chunk_size个字符后写出一块(chunked编码)
+# 页面不会完整地以str与bytes各保存一份,第一块生成后即开始发送
+# 响应头发送后不能再修改状态码,渲染出错时记录日志并中断连接
+async def stream_template(request, template, r, chunk_size):
+    resp = web.StreamResponse()
+    resp.content_type = 'text/html'
+    resp.charset = 'utf-8'
+    await resp.prepare(request)
+    buf = []
+    size = 0
+    try:
+        for s in template.generate(**r):
+            buf.append(s)
+            size += len(s)
+            if size >= chunk_size:
+                await resp.write(''.join(buf).encode('utf-8'))
+                buf = []
+                size = 0
+        if buf:
+            await resp.write(''.join(buf).encode('utf-8'))
+    except Exception:
+        logging.exception('failed to render template %s' % template.name)
+        raise
+    await resp.write_eof()
+    return resp
+
 # 将request handler的返回值转换为web.Response对象
 async def response_factory(app, handler):
     async def response(request):
@@ -120,6 +161,11 @@ async def response_factory(app, handler):
             # 存在对应模板的,则将套用模板,用request handler的结果进行渲染
             else:
                 # r['__user__'] = request.__user__  # 增加__user__,前端页面将依次来决定是否显示评论框
+                # r可能是@cached缓存的对象,由所有请求共用,复制后再加入本次渲染的__now__
+                r = dict(r, __now__=time.time())
+                # 返回值中__stream__为True时流式渲染,用于内容较长的页面
+                if r.get('__stream__'):
+                    return (await stream_template(request, app['__templating__'].get_template(template), r, configs.template.chunk_size))
                 resp = web.Response(body=app['__templating__'].get_template(template).render(**r).encode('utf-8'))
                 resp.content_type = 'text/html;charset=utf-8'
                 return resp
@@ -139,35 +185,106 @@ async def response_factory(app, handler):
         return resp
     return response
 
-# 时间过滤器
-def datetime_filter(t):
-    # 定义时间差
-    delta = int(time.time() - t)
-    # 针对时间分类
-    if delta < 60:
-        return u'1分钟前'
-    if delta < 3600:
-        return u'%s分钟前' % (delta // 60)
-    if delta < 86400:
-        return u'%s小时前' % (delta // 3600)
-    if delta < 604800:
-        return u'%s天前' % (delta // 86400)
-    dt = datetime.fromtimestamp(t)
+# 绝对日期按本地日期缓存,day为加上当时的UTC偏移(含夏令时)后的天数,同一天的时间共用一项
+@functools.lru_cache(maxsize=4096)
+def _absolute_date(day):
+    dt = datetime.utcfromtimestamp(int(day) * 86400)
     return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
 
+# 各时区的UTC偏移(含夏令时)都是15分钟的整数倍,切换发生在本地的整点或半点,即UTC的15分钟整点上,
+# 因此同一个15分钟内偏移不变.按15分钟分桶缓存偏移,格式化时不再对每个时间调用time.localtime()
+_utc_offsets = dict()
+_MAX_UTC_OFFSETS = 65536
+
+def _utc_offset(bucket):
+    if len(_utc_offsets) >= _MAX_UTC_OFFSETS:
+        _utc_offsets.clear()
+    offset = _utc_offsets[bucket] = time.localtime(bucket * 900).tm_gmtoff
+    return offset
+
+# now为None时只返回绝对日期
+def format_datetime(t, now=None):
+    if now is not None:
+        # 定义时间差
+        delta = int(now - t)
+        # 针对时间分类
+        if delta < 60:
+            return u'1分钟前'
+        if delta < 3600:
+            return u'%s分钟前' % (delta // 60)
+        if delta < 86400:
+            return u'%s小时前' % (delta // 3600)
+        if delta < 604800:
+            return u'%s天前' % (delta // 86400)
+    # 绝对日期:一次查找偏移,一次查找日期,都命中缓存时不调用time.localtime()
+    bucket = t // 900
+    offset = _utc_offsets.get(bucket)
+    if offset is None:
+        offset = _utc_offset(bucket)
+    return _absolute_date((t + offset) // 86400)
+
+# 时间过滤器,"现在"取模板变量__now__,由response_factory在渲染前设置,同一页面中只取一次时间
+# 没有__now__时(如export.py导出的静态页面)显示绝对日期
+@pass_context
+def datetime_filter(context, t):
+    return format_datetime(t, context.get('__now__'))
+
+# 一次格式化列表中所有元素的时间属性,用于列表页面:
+#   {% set dates = blogs|datetimes %} ... {{ dates[loop.index0] }}
+@pass_context
+def datetimes_filter(context, items, attribute='created_at'):
+    now = context.get('__now__')
+    return [format_datetime(item[attribute], now) for item in items]
+
+# 中间件按顺序执行:按IP限流在auth_factory之前,被限流的请求不会查询用户;按用户限流在其后,才能取得__user__
+MIDDLEWARES = [
+    logger_factory, ratelimit.ip_ratelimit_factory, auth_factory, ratelimit.user_ratelimit_factory, response_factory
+]
+
+# 在单独的任务(复制的上下文)中执行迁移:迁移中的写操作会把当前上下文固定到主库,
+# 直接await时init之后创建的服务器与所有请求都会继承该上下文,读请求不再分流到副本
+async def run_migrations():
+    return (await asyncio.ensure_future(migrate.migrate()))
+
 # 初始化
 async def init(loop):
-    await orm.create_pool(loop=loop, host='127.0.0.1', port=3306, user='www', password='www', db='awesome')
-    app = web.Application(loop=loop, middlewares=[
-        logger_factory, response_factory
-    ])
-    init_jinja2(app, filters=dict(datetime=datetime_filter))
+    await orm.create_pool(loop=loop, **configs.db)
+    if configs.db.migrate:
+        await run_migrations()
+    await search.init_index(loop, os.path.join(os.path.dirname(os.path.abspath(__file__)), configs.search.path), configs.search.save_interval)
+    await archive.init_index()
+    if configs.signup.bloom:
+        await load_known_emails(configs.signup.capacity, configs.signup.error_rate)
+    await counter.load_popular(configs.counter.popular)
+    counter.init(loop, configs.counter.interval, configs.counter.max_pending)
+    passwords.init(configs.password.iterations, configs.password.workers, configs.password.max_waiting)
+    cache.set_backend(cache.LRUBackend(configs.cache.maxsize))
+    fragments.set_maxsize(configs.template.fragment_cache)
+    ratelimit.init(loop, configs.ratelimit.routes, configs.ratelimit.trust_proxy, configs.ratelimit.gc_interval)
+    app = web.Application(loop=loop, middlewares=MIDDLEWARES)
+    app['__body_limits__'] = configs.body
+    init_jinja2(app, filters=dict(datetime=datetime_filter, datetimes=datetimes_filter))
+    add_static(app)     # 静态文件需要在路由表之前注册
     add_routes(app, 'handlers')
-    add_static(app)
     srv = await loop.create_server(app.make_handler(), '127.0.0.1', 9000)
     logging.info('server started at http://127.0.0.1:9000...')
     return srv
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(init(loop))
-loop.run_forever()
\ No newline at end of file
+# 关闭服务器:停止接受新连接,写入内存中的浏览数与搜索索引,最后关闭连接池
+async def shutdown(srv):
+    srv.close()
+    await srv.wait_closed()
+    await counter.close()
+    await search.save_index()
+    await orm.close_pool()
+    passwords.close()
+    logging.info('server stopped.')
+
+# 被export.py等导入时不启动服务器
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    srv = loop.run_until_complete(init(loop))
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+    loop.run_forever()
+    loop.run_until_complete(shutdown(srv))
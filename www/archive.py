@@ -0,0 +1,82 @@
+'博客归档与sitemap'
+
+# 启动时读取所有博客的(id, name, created_at)保存在内存中,按created_at排序
+# 博客被创建/修改/删除时增量更新,/sitemap.xml与/archive都由它生成,不再查询数据库
+# 生成的sitemap与按月分组的结果也会缓存,直到下一次博客有变化
+
+import bisect, logging
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from models import Blog
+
+_entries = []       # [(created_at, id, name)],按created_at升序
+_ids = dict()       # 博客id ==> entry
+_sitemap = None
+_months = None
+
+async def init_index():
+    global _entries
+    blogs = await Blog.findAll(orderBy='created_at', fields=('id', 'name', 'created_at'))
+    _entries = [(b.created_at, b.id, b.name) for b in blogs]
+    _ids.clear()
+    for e in _entries:
+        _ids[e[1]] = e
+    _invalidate()
+    logging.info('archive index loaded: %s blogs' % len(_entries))
+
+def _invalidate():
+    global _sitemap, _months
+    _sitemap = None
+    _months = None
+
+def _remove(blog_id):
+    e = _ids.pop(blog_id, None)
+    if e is not None:
+        i = bisect.bisect_left(_entries, e)
+        if i < len(_entries) and _entries[i] == e:
+            del _entries[i]
+
+def blog_saved(blog):
+    _remove(blog.id)
+    e = (blog.created_at, blog.id, blog.name)
+    bisect.insort(_entries, e)
+    _ids[blog.id] = e
+    _invalidate()
+
+def blog_removed(blog_id):
+    _remove(blog_id)
+    _invalidate()
+
+def sitemap(site_url):
+    '''返回sitemap.xml的内容(bytes)'''
+    global _sitemap
+    if _sitemap is None:
+        url = site_url.rstrip('/')
+        L = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+             '<url><loc>%s/</loc></url>' % escape(url),
+             '<url><loc>%s/archive</loc></url>' % escape(url)]
+        for created_at, blog_id, name in reversed(_entries):
+            day = datetime.fromtimestamp(created_at, timezone.utc).strftime('%Y-%m-%d')
+            L.append('<url><loc>%s/blog/%s</loc><lastmod>%s</lastmod></url>' % (escape(url), blog_id, day))
+        L.append('</urlset>')
+        _sitemap = '\n'.join(L).encode('utf-8')
+    return _sitemap
+
+def group_by_month(entries):
+    '''将按created_at降序排列的[(created_at, id, name)]按月分组'''
+    L = []
+    for created_at, blog_id, name in entries:
+        dt = datetime.fromtimestamp(created_at)
+        if not L or L[-1]['year'] != dt.year or L[-1]['month'] != dt.month:
+            L.append(dict(year=dt.year, month=dt.month, blogs=[]))
+        L[-1]['blogs'].append(dict(id=blog_id, name=name, created_at=created_at))
+    return L
+
+def months():
+    '''按月分组,最新的月份在前: [dict(year, month, blogs=[dict(id, name, created_at)])]'''
+    global _months
+    if _months is None:
+        _months = group_by_month(reversed(_entries))
+    return _months
@@ -0,0 +1,66 @@
+'Atom feed与首页的渲染耗时对比'
+
+# 用法:
+#   python3 bench_feed.py [博客数] [每篇博客的字数]
+# orm.select替换为内存中的假数据,只测量Python部分(查询之后的Markdown转换、模板渲染与feed生成)的耗时,不包含数据库与网络
+# 首页分别测量响应缓存未命中(查询+渲染)与命中(只渲染模板);feed分别测量重新生成与直接返回内存中的结果
+
+import asyncio, sys, time
+
+import cache
+import feed
+import fragments
+import handlers
+import orm
+from app import init_jinja2, datetime_filter, datetimes_filter
+from config import configs
+
+def _fake_select(n, length):
+    content = ('## 标题\n\n' + '这是一段用于测试的**Markdown**正文,包含[链接](http://example.com)。\n\n' * (length // 40))[:length]
+    rows = [dict(id='%015d%s000' % (i, 'x' * 32), user_id='u', user_name='alice', user_image='about:blank', name='博客 %s' % i,
+                 summary='摘要 %s' % i, content=content, comment_count=0, views=0, created_at=1500000000.0 + i) for i in range(n)]
+    rows.reverse()
+    async def select(sql, args, size=None, primary=False):
+        if 'count(id)' in sql:
+            return [dict(_num_=len(rows))]
+        if sql.endswith('limit ?, ?'):
+            return rows[args[-2]:args[-2] + args[-1]]
+        if sql.endswith('limit ?'):
+            return rows[:args[-1]]
+        return rows
+    return select
+
+async def _measure(fn, number):
+    start = time.perf_counter()
+    for i in range(number):
+        await fn()
+    return (time.perf_counter() - start) / number * 1e3
+
+async def benchmark(n=100, length=3000, number=200):
+    orm.select = _fake_select(n, length)
+    d = dict()
+    init_jinja2(d, filters=dict(datetime=datetime_filter, datetimes=datetimes_filter), auto_reload=False)
+    env = d['__templating__']
+    def render(r):
+        r['__now__'] = time.time()
+        return env.get_template(r['__template__']).render(**r).encode('utf-8')
+    async def index_miss():
+        cache.get_backend().clear()
+        fragments.clear()
+        render(await handlers.index(page='1'))
+    async def index_hit():
+        render(await handlers.index(page='1'))
+    async def feed_miss():
+        feed.invalidate()
+        await feed.get_feed()
+    async def feed_hit():
+        await feed.get_feed()
+    print('%s blogs, %s characters each, feed size %s' % (n, length, configs.feed.size))
+    print('%-24s %10s' % ('', 'ms/request'))
+    for name, fn in (('/ (cache miss)', index_miss), ('/ (cache hit)', index_hit), ('/feed (regenerate)', feed_miss), ('/feed (in memory)', feed_hit)):
+        await fn()  # 预热
+        print('%-24s %10.3f' % (name, await _measure(fn, number)))
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.get_event_loop().run_until_complete(benchmark(*args))
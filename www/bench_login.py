@@ -0,0 +1,69 @@
+'登录高峰时读请求延迟的负载测试'
+
+# 用法:
+#   python3 bench_login.py [同时登录数] [迭代次数]
+# 同时发起一批登录(每个登录校验一次PBKDF2密码),期间读请求每隔INTERVAL到达一次,
+# 读请求的延迟为到达时刻到事件循环执行它的时间,分别测量:
+#   idle      没有登录
+#   inline    在事件循环中直接计算哈希(线程池之前的做法)
+#   executor  passwords.verify_password,在线程池中计算
+# 不连接数据库,只比较哈希计算对事件循环的影响
+
+import asyncio, json, os, sys, time
+
+import passwords
+from config import configs
+
+INTERVAL = 0.005
+
+async def _inline(uid, passwd, stored):
+    algorithm, iterations, salt, expected = stored.split('$')
+    return passwords._pbkdf2(uid, passwd, bytes.fromhex(salt), int(iterations)).hex() == expected
+
+def _percentile(L, p):
+    L = sorted(L)
+    return L[min(len(L) - 1, int(len(L) * p))]
+
+# 读请求按固定的时间表到达,事件循环被阻塞期间到达的请求都计入延迟(而不是只记录一次)
+async def _reader(latencies, done):
+    loop = asyncio.get_event_loop()
+    arrival = loop.time()
+    while not done.is_set():
+        arrival += INTERVAL
+        await asyncio.sleep(max(0, arrival - loop.time()))
+        while True:
+            json.dumps(dict(blogs=[dict(id=i, name='blog %s' % i) for i in range(10)]))
+            latencies.append(loop.time() - arrival)
+            if arrival + INTERVAL > loop.time():
+                break
+            arrival += INTERVAL
+
+async def _burst(verify, logins, stored):
+    latencies = []
+    done = asyncio.Event()
+    reader = asyncio.ensure_future(_reader(latencies, done))
+    await asyncio.sleep(INTERVAL * 10)
+    start = time.perf_counter()
+    if verify is None:
+        await asyncio.sleep(0.5)
+    else:
+        results = await asyncio.gather(*[verify('u%s' % i, 'passwd', stored[i]) for i in range(logins)])
+        assert all(r is True or r[0] for r in results)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await reader
+    return elapsed, latencies
+
+async def benchmark(logins=20, iterations=configs.password.iterations):
+    passwords.init(iterations, configs.password.workers, configs.password.max_waiting)
+    stored = [await passwords.hash_password('u%s' % i, 'passwd') for i in range(logins)]
+    print('%s logins, %s iterations, %s workers, %s CPUs' % (logins, iterations, configs.password.workers, os.cpu_count()))
+    print('%-10s %10s %10s %10s %10s' % ('', 'burst(s)', 'p50(ms)', 'p99(ms)', 'max(ms)'))
+    for name, verify in (('idle', None), ('inline', _inline), ('executor', passwords.verify_password)):
+        elapsed, latencies = await _burst(verify, logins, stored)
+        print('%-10s %10.3f %10.2f %10.2f %10.2f' % (name, elapsed, _percentile(latencies, 0.5) * 1e3, _percentile(latencies, 0.99) * 1e3, max(latencies) * 1e3))
+    passwords.close()
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.get_event_loop().run_until_complete(benchmark(*args))
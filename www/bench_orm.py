@@ -0,0 +1,47 @@
+'ORM语句缓存的基准测试'
+
+# 用法:
+#   python3 bench_orm.py [迭代次数]
+# 每次迭代执行一次分页查询(findAll带where/orderBy/limit)与一次计数(findNumber),对比:
+#   uncached   每次迭代前清空语句缓存与_driver_sql/normalize_sql的lru_cache,即每次都拼接与转换SQL
+#   cached     语句缓存命中
+# orm.select替换为不连接数据库的版本,只做_select中除I/O以外的工作(占位符转换与按语句形状统计),
+# 测量的是ORM在一次查询上的Python开销
+
+import asyncio, sys, time
+
+import orm
+from models import Blog
+
+async def _select(sql, args, size=None, primary=False):
+    orm._driver_sql(sql)
+    orm._record(sql, 0.0)
+    return [dict(_num_=0)] if size == 1 else []
+
+async def _query():
+    await Blog.findAll('user_name=?', ['alice'], orderBy='created_at desc', limit=(0, 10))
+    await Blog.findNumber('count(id)', 'user_name=?', ['alice'])
+
+def _clear():
+    orm._statements.clear()
+    orm._driver_sql.cache_clear()
+    orm.normalize_sql.cache_clear()
+
+async def _measure(number, clear):
+    start = time.perf_counter()
+    for i in range(number):
+        if clear:
+            _clear()
+        await _query()
+    return (time.perf_counter() - start) / number * 1e6
+
+async def benchmark(number=50000):
+    orm.select = _select
+    print('%s iterations of findAll + findNumber' % number)
+    print('%-10s %10s' % ('', 'us/iter'))
+    for name, clear in (('uncached', True), ('cached', False)):
+        await _query()  # 预热
+        print('%-10s %10.2f' % (name, await _measure(number, clear)))
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(benchmark(*[int(a) for a in sys.argv[1:2]]))
@@ -0,0 +1,27 @@
+'路由匹配的基准测试'
+
+# 用法:
+#   python3 bench_routes.py [路由数 ...]
+# 对比coroweb.RouteTable与按注册顺序逐个正则匹配(aiohttp路由器的方式)的平均耗时,
+# 每次都匹配最后注册的路由,即线性匹配的最坏情况
+
+import re, sys, timeit
+
+from coroweb import RouteTable
+
+def benchmark(counts=(10, 100, 1000, 10000), number=20000):
+    print('%8s %14s %14s' % ('routes', 'table (us)', 'linear (us)'))
+    for n in counts:
+        table = RouteTable()
+        patterns = []
+        for i in range(n):
+            path = '/api/r%s' % i if i % 2 == 0 else '/api/r%s/{id}/items' % i
+            table.add('GET', path, None)
+            patterns.append(re.compile('^%s$' % re.sub(r'\{(\w+)\}', r'(?P<\1>[^/]+)', path)))
+        last = '/api/r%s/0015084468/items' % (n - 1 if n % 2 == 0 else n - 2)
+        t1 = timeit.timeit(lambda: table.resolve('GET', last), number=number)
+        t2 = timeit.timeit(lambda: next(p for p in patterns if p.match(last)), number=number // 10 or 1)
+        print('%8s %14.2f %14.2f' % (n, t1 / number * 1e6, t2 / (number // 10 or 1) * 1e6))
+
+if __name__ == '__main__':
+    benchmark([int(n) for n in sys.argv[1:]] or (10, 100, 1000, 10000))
@@ -0,0 +1,36 @@
+'Bloom filter'
+
+# 判断元素"一定不存在"或"可能存在",不存在时不会误判,存在时有error_rate的概率误判
+# 用于注册时在内存中快速排除大部分新邮箱,只有可能存在的邮箱才查询数据库
+# 元素只能添加不能删除;添加的元素超过capacity后误判率会上升,但结果仍然可靠(只是多查询数据库)
+
+import hashlib, math
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # 最优的位数m = -n*ln(p)/(ln2)^2,哈希函数个数k = m/n*ln2
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    # 由一次blake2b得到两个64位哈希值h1, h2,第i个哈希函数为h1 + i*h2
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for p in self._positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def __len__(self):
+        return self.count
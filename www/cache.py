@@ -0,0 +1,103 @@
+'响应缓存'
+
+# 由coroweb.cached装饰器使用,缓存处理函数的返回值
+# 后端可以替换(set_backend),需要实现get/set/invalidate/clear/stats,get(key, count=False)只查看不计入命中率,默认为进程内的LRU
+# 每个缓存项带有若干标签,写操作后按标签删除相关的缓存项,如博客被修改后invalidate('blogs', 'blog:<id>')
+# 同一个key同时只计算一次(single-flight),其余请求等待同一个结果,缓存过期时不会有大量请求同时查询数据库
+
+import collections, logging, time
+
+import singleflight
+
+class LRUBackend(object):
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()     # key ==> (value, 过期时间, tags)
+        self._tags = dict()                         # tag ==> set(key)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, count=True):
+        '''返回(True, value),不存在或已过期时返回(False, None);count=False时不计入hits/misses'''
+        item = self._items.get(key)
+        if item is None or item[1] <= time.monotonic():
+            if item is not None:
+                self._remove(key)
+            if count:
+                self.misses += 1
+            return False, None
+        self._items.move_to_end(key)
+        if count:
+            self.hits += 1
+        return True, item[0]
+
+    def set(self, key, value, ttl, tags=()):
+        if key in self._items:
+            self._remove(key)
+        self._items[key] = (value, time.monotonic() + ttl, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._items) > self.maxsize:
+            self._remove(next(iter(self._items)))
+
+    def _remove(self, key):
+        value, expires, tags = self._items.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tags):
+        n = 0
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                n += 1
+        return n
+
+    def clear(self):
+        self._items.clear()
+        self._tags.clear()
+
+    def stats(self):
+        return dict(size=len(self._items), maxsize=self.maxsize, tags=len(self._tags), hits=self.hits, misses=self.misses)
+
+_backend = LRUBackend()
+_flight = singleflight.group('cache')
+_version = 0        # 每次invalidate()加1,计算期间有写操作时,结果不再缓存
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+def get_backend():
+    return _backend
+
+def invalidate(*tags):
+    global _version
+    _version += 1
+    n = _backend.invalidate(tags)
+    if n:
+        logging.info('cache: invalidate %s items by tags %s' % (n, ', '.join(tags)))
+
+def stats():
+    return dict(_backend.stats(), **_flight.stats())
+
+async def get_or_compute(key, compute, ttl, tags=()):
+    '''返回key对应的缓存值,不存在时调用compute()计算并缓存;并发的相同请求只计算一次'''
+    found, value = _backend.get(key)
+    if found:
+        return value
+    async def load():
+        found, value = _backend.get(key, count=False)   # 等待期间可能已被其他请求缓存
+        if found:
+            return value
+        version = _version
+        value = await compute()
+        if version == _version:
+            _backend.set(key, value, ttl, tags)
+        return value
+    return (await _flight.do(key, load))
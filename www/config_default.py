@@ -7,9 +7,75 @@ configs = {
         "port": 3306,
         "user": "www-data",
         "password": "www-data",
-        "database": "awesome"
+        "database": "awesome",
+        "minsize": 2,           # 连接池最小连接数
+        "maxsize": 10,          # 连接池最大连接数
+        "max_limit": 20,        # 持续排队时连接池自动扩容的上限
+        "warmup": 5,            # 启动时预先建立的连接数
+        "pool_recycle": 3600,   # 连接的最长存活时间(秒),应小于MySQL的wait_timeout
+        "ping_interval": 30,    # 健康检查与扩缩容的周期(秒)
+        "ping_timeout": 1,      # 健康检查等待空闲连接的时间(秒),超时则跳过本次检查
+        "wait_threshold": 0.01, # 平均等待连接超过该值(秒)视为压力过大
+        "migrate": False,       # 启动时自动执行migrate.py中未执行的迁移(需要alter/index权限)
+        "replicas": [],         # 只读副本,每项只需写出与主库不同的配置,如{"host": "10.0.0.2"}
+        "replica_retry": 30,    # 副本出错后暂停使用的时间(秒),期间读请求回落到主库
+        "coalesce_reads": True, # 同时执行的相同查询只执行一次,共享结果
+        "slow_query": {  # 慢查询统计,超过threshold秒的语句记录警告,explain为True时保存其执行计划
+            "threshold": 0.2,
+            "explain": False,
+            "top": 20
+            }
         },
     "session": { # 定义会话信息
         "secret": "AwEsOmE"
+        },
+    "password": { # 密码哈希(PBKDF2)
+        "iterations": 100000,   # 迭代次数,提高后旧的密码在下一次登录时重新计算
+        "workers": 2,           # 计算哈希的线程数,也是同时计算的最大数量
+        "max_waiting": 100      # 排队等待的请求超过该值时直接拒绝
+        },
+    "signup": { # 注册
+        "bloom": True,          # 启动时将已注册的邮箱加载到Bloom filter,注册新邮箱时不查询数据库
+        "capacity": 100000,     # Bloom filter预计容纳的邮箱数
+        "error_rate": 0.01      # 误判率,误判时回落到查询数据库
+        },
+    "body": { # 请求体大小限制(字节),读取时超出即返回413
+        "max_size": 65536,
+        "routes": {             # "方法 路由": 限制,博客内容可能较长
+            "POST /api/blogs": 1048576,
+            "POST /api/blogs/{id}": 1048576
+            }
+        },
+    "ratelimit": { # 限流,格式见ratelimit.py
+        "trust_proxy": False,   # 位于nginx等反向代理之后时,从X-Forwarded-For取客户端IP
+        "gc_interval": 60,      # 每隔多少秒删除空闲的令牌桶
+        "routes": {             # "方法 路由": {"ip"/"user": [n, seconds]},每seconds秒最多n次请求
+            "POST /api/authenticate": {"ip": [10, 60]},
+            "POST /api/users": {"ip": [5, 600]},
+            "POST /api/blogs/{id}/comments": {"ip": [20, 60], "user": [10, 60]}
+            }
+        },
+    "site": { # 站点信息,用于生成feed等需要绝对地址的内容
+        "url": "http://127.0.0.1:9000",
+        "title": "Awesome Python Webapp"
+        },
+    "feed": { # Atom订阅
+        "size": 20  # feed中包含的最新博客数
+        },
+    "counter": { # 浏览计数
+        "interval": 10,         # 每隔多少秒将浏览数写入数据库
+        "max_pending": 1000,    # 未写入的浏览数达到该值时立即写入
+        "popular": 100          # 启动时读入浏览数最多的博客数,应不小于/api/popular_blogs的n的上限
+        },
+    "template": { # 模板渲染
+        "chunk_size": 16384,    # 流式渲染时每次写出的字符数
+        "fragment_cache": 256   # {% cache %}最多缓存的片段数
+        },
+    "cache": { # 响应缓存(coroweb.cached)
+        "maxsize": 1024         # 最多缓存的响应数,超出时淘汰最久未使用的
+        },
+    "search": { # 全文搜索索引
+        "path": "search.idx",   # 索引文件,相对于www目录
+        "save_interval": 300    # 索引有修改时,每隔多少秒写回磁盘
         }
     }
\ No newline at end of file
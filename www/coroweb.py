@@ -1,10 +1,11 @@
 
 'Web 框架'
 
-import asyncio, os, inspect, logging, functools
+import asyncio, codecs, json, os, inspect, logging, functools
 from urllib import parse
 from aiohttp import web
 from apis import APIError
+import cache
 
 # 将一个函数映射为一个URL处理函数
 def get(path):
@@ -12,6 +13,9 @@ def get(path):
     Define decorator @get('/path')
     '''
     def decorator(func):
+        # 用yield from编写的处理函数要标记为基于生成器的协程,才能yield from以async def定义的协程
+        if inspect.isgeneratorfunction(func):
+            func = asyncio.coroutine(func)
         @functools.wraps(func)
         def wrapper(*args, **kw):
             return func(*args, **kw)
@@ -26,6 +30,9 @@ def post(path):
     Define decorator @post('/path')
     '''
     def decorator(func):
+        # 用yield from编写的处理函数要标记为基于生成器的协程,才能yield from以async def定义的协程
+        if inspect.isgeneratorfunction(func):
+            func = asyncio.coroutine(func)
         @functools.wraps(func)
         def wrapper(*args, **kw):
             return func(*args, **kw)
@@ -34,6 +41,35 @@ def post(path):
         return wrapper
     return decorator
 
+# 缓存处理函数的返回值,与@get组合使用,写在@get之下:
+#   @get('/api/blogs')
+#   @cached(ttl=60, tags=['blogs'])
+# key          由处理函数的参数计算缓存key的函数,默认使用函数名与除request外的全部参数
+# vary_on_user 为True时不同的登录用户分别缓存,处理函数需要有request参数
+# tags         缓存项的标签,可以引用参数,如'blog:{id}',写操作后由cache.invalidate(标签)删除
+# 抛出异常(如APIError)时不缓存,同一个key同时只计算一次
+# 响应对象不能重复发送,返回web.Response等的处理函数不能使用
+def cached(ttl=60, key=None, vary_on_user=False, tags=()):
+    def decorator(func):
+        if vary_on_user and not has_request_arg(func):
+            raise ValueError('vary_on_user requires a request parameter in function: %s' % func.__name__)
+        # 与add_route相同,普通函数与生成器函数都转为协程,才能await其结果
+        if not asyncio.iscoroutinefunction(func):
+            func = asyncio.coroutine(func)
+        name = '%s.%s' % (func.__module__, func.__name__)
+        @functools.wraps(func)
+        async def wrapper(*args, **kw):
+            params = dict((k, v) for k, v in kw.items() if k != 'request')
+            k = key(**params) if key is not None else tuple(sorted(params.items()))
+            if vary_on_user:
+                user = getattr(kw['request'], '__user__', None)
+                k = (k, user.id if user is not None else None)
+            async def compute():
+                return (await func(*args, **kw))
+            return (await cache.get_or_compute((name, k), compute, ttl, [tag.format(**params) for tag in tags]))
+        return wrapper
+    return decorator
+
 # ---------------------------- 使用inspect模块中的signature方法来获取函数的参数，实现一些复用功能--
 # 关于inspect.Parameter 的  kind 类型有5种：
 # POSITIONAL_ONLY       只能是位置参数
@@ -91,13 +127,56 @@ def has_request_arg(fn):
             raise ValueError('request parameter must be the last named parameter in function: %s%s' % (fn.__name__, str(sig)))
     return found
 
+# ---------------------------- 请求体 ----------------------------
+# 请求体大小限制(字节),由app['__body_limits__']配置: {'max_size': 默认限制, 'routes': {'POST /api/blogs': 限制}}
+DEFAULT_MAX_BODY = 64 * 1024
+READ_CHUNK = 16 * 1024
+
+class BodyTooLarge(Exception):
+    pass
+
+class UnsupportedCharset(Exception):
+    pass
+
+def body_limit(app, method, path):
+    limits = app.get('__body_limits__') or dict()
+    return limits.get('routes', dict()).get('%s %s' % (method, path), limits.get('max_size', DEFAULT_MAX_BODY))
+
+# 分块读取请求体,Content-Length超过limit时不读取,读取的字节数超过limit时立即停止,抛出BodyTooLarge
+# decode为True时每读到一块就增量解码为str,不在内存中同时保留完整的bytes与str;无法识别的charset在读取前抛出UnsupportedCharset
+async def read_body(request, limit, decode=False):
+    length = request.content_length
+    if length is not None and length > limit:
+        raise BodyTooLarge(length)
+    decoder = None
+    if decode:
+        try:
+            decoder = codecs.getincrementaldecoder(request.charset or 'utf-8')()
+        except LookupError:
+            raise UnsupportedCharset(request.charset)
+    chunks = []
+    size = 0
+    while True:
+        chunk = await request.content.read(READ_CHUNK)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge(size)
+        chunks.append(decoder.decode(chunk) if decoder else chunk)
+    if decoder:
+        chunks.append(decoder.decode(b'', True))
+        return ''.join(chunks)
+    return b''.join(chunks)
+
 # RequestHandler目的就是从URL处理函数（如handlers.index）中分析其需要接收的参数，从web.request对象中获取必要的参数，
 # 调用URL处理函数，然后把结果转换为web.Response对象,以此保证符合aiohttp框架的要求
 class RequestHandler(object):
 
-    def __init__(self, app, fn):
+    def __init__(self, app, fn, max_body=DEFAULT_MAX_BODY):
         self._app = app
         self._func = fn
+        self._max_body = max_body
         self._has_request_arg = has_request_arg(fn)
         self._has_var_kw_arg = has_var_kw_arg(fn)
         self._has_named_kw_args = has_named_kw_args(fn)
@@ -118,21 +197,37 @@ class RequestHandler(object):
             if request.method == 'POST':
                 # request的content_type为空, 返回丢失信息
                 if not request.content_type:
-                    return web.HTTPBadRequest('Missing Content-Type.')
+                    return web.HTTPBadRequest(text='Missing Content-Type.')
                 ct = request.content_type.lower()   # 获取contnet_type小写字段
-                # application/json：消息主体是序列化后的json字符串
-                if ct.startswith('application/json'):
-                    params = await request.json()   # 以json格式解码
-                    # 解码得到的参数不是字典类型, 返回提示信息
-                    if not isinstance(params, dict):
-                        return web.HTTPBadRequest('JSON body must be object.')
-                    kw = params
-                elif ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
-                    # request.post方法从request读取POST参数,即表单信息,并包装成字典赋给kw变量
-                    params = await request.post()
-                    kw = dict(**params)
-                else:
-                    return web.HTTPBadRequest('Unsupported Content-Type: %s' % request.content_type)
+                try:
+                    # application/json：消息主体是序列化后的json字符串
+                    if ct.startswith('application/json'):
+                        params = json.loads(await read_body(request, self._max_body, decode=True))   # 以json格式解码
+                        # 解码得到的参数不是字典类型, 返回提示信息
+                        if not isinstance(params, dict):
+                            return web.HTTPBadRequest(text='JSON body must be object.')
+                        kw = params
+                    elif ct.startswith('application/x-www-form-urlencoded'):
+                        body = await read_body(request, self._max_body, decode=True)
+                        kw = dict((k, v[0]) for k, v in parse.parse_qs(body, True).items())
+                    elif ct.startswith('multipart/form-data'):
+                        # 由request.post()读取,只能事先按Content-Length检查大小,不接受分块传输
+                        if request.content_length is None:
+                            return web.Response(status=411, text='Content-Length required.')
+                        if request.content_length > self._max_body:
+                            raise BodyTooLarge(request.content_length)
+                        # request.post方法从request读取POST参数,即表单信息,并包装成字典赋给kw变量
+                        params = await request.post()
+                        kw = dict(**params)
+                    else:
+                        return web.HTTPBadRequest(text='Unsupported Content-Type: %s' % request.content_type)
+                except BodyTooLarge as e:
+                    logging.warning('request body too large: %s %s, %s > %s bytes' % (request.method, request.path, e.args[0], self._max_body))
+                    return web.Response(status=413, text='Request body too large.')
+                except UnsupportedCharset as e:
+                    return web.Response(status=415, text='Unsupported charset: %s' % e.args[0])
+                except ValueError:  # 包括UnicodeDecodeError与json解析错误
+                    return web.HTTPBadRequest(text='Invalid request body.')
             # http method 为 get的处理
             if request.method == 'GET':
                 qs = request.query_string   # request.query_string表示url中的查询字符串
@@ -142,8 +237,9 @@ class RequestHandler(object):
                     for k, v in parse.parse_qs(qs, True).items():
                         kw[k] = v[0]
         # 以上全部不匹配,则获取请求的abstract math_info(抽象数学信息),并以字典形式存入kw
+        match_info = getattr(request, '__match_info__', request.match_info)
         if kw is None:
-            kw = dict(**request.match_info)
+            kw = dict(**match_info)
         else:
             if not self._has_var_kw_arg and self._named_kw_args:    # not的优先级比and的优先级要高
                 # remove all unamed kw:
@@ -153,7 +249,7 @@ class RequestHandler(object):
                         copy[name] = kw[name]
                 kw = copy
             # check named arg:遍历request.match_info, 若其key又存在于kw中,发出重复参数警告
-            for k, v in request.match_info.items():
+            for k, v in match_info.items():
                 if k in kw:
                     logging.warning('Duplicate arg name in named arg and kw args: %s' % k)
                 kw[k] = v
@@ -164,7 +260,7 @@ class RequestHandler(object):
         if self._required_kw_args:
             for name in self._required_kw_args:
                 if not name in kw:
-                    return web.HTTPBadRequest('Missing argument: %s' % name)
+                    return web.HTTPBadRequest(text='Missing argument: %s' % name)
         logging.info('call with args: %s' % str(kw))
         try:
             r = await self._func(**kw)
@@ -172,17 +268,160 @@ class RequestHandler(object):
         except APIError as e:
             return dict(error=e.error, data=e.data, message=e.message)
 
+# ---------------------------- 路由表 ----------------------------
+# 所有处理函数在启动时编译为一个路由表,aiohttp的路由器上只注册一个匹配所有路径的路由,由路由表分发:
+#   不含参数的路径      放在dict中,一次哈希查找
+#   含{name}参数的路径  按'/'分段建立前缀树,每个节点的子节点分为固定段(dict)与参数段(最多一个)
+# 匹配时固定段优先于参数段,固定段之后匹配失败时回退到参数段
+# 注册时检查冲突:同一方法与路径重复注册,或同一位置的参数名不同(如/blog/{id}与/blog/{name}/x)
+# 路由表只接管add_static之后注册的路径,静态文件目录需要在add_routes之前注册
+
+class Route(object):
+
+    def __init__(self, method, path, handler):
+        self.method = method
+        self.path = path
+        self.handler = handler      # RequestHandler
+
+    @property
+    def func(self):
+        '''处理函数'''
+        return self.handler._func
+
+    def __str__(self):
+        return '%s %s => %s%s' % (self.method, self.path, self.func.__name__, inspect.signature(self.func))
+
+    __repr__ = __str__
+
+class _Node(object):
+
+    __slots__ = ('children', 'param', 'param_child', 'routes')
+
+    def __init__(self):
+        self.children = dict()      # 固定段 ==> _Node
+        self.param = None           # 参数名
+        self.param_child = None
+        self.routes = None          # 方法 ==> Route,以该节点结尾的路径才有
+
+def _segments(path):
+    return path[1:].split('/')
+
+def _param_name(segment):
+    if segment.startswith('{') and segment.endswith('}'):
+        name = segment[1:-1]
+        if not name.isidentifier():
+            raise ValueError('Invalid route parameter: %s' % segment)
+        return name
+    if '{' in segment or '}' in segment:
+        raise ValueError('Route parameter must be a whole segment: %s' % segment)
+    return None
+
+class RouteTable(object):
+
+    def __init__(self):
+        self._static = dict()       # 路径 ==> {方法: Route}
+        self._root = _Node()
+        self._routes = []
+
+    def __len__(self):
+        return len(self._routes)
+
+    def add(self, method, path, handler):
+        if not path.startswith('/'):
+            raise ValueError('Route must start with /: %s' % path)
+        segments = _segments(path)
+        names = [_param_name(seg) for seg in segments]
+        if not any(names):
+            routes = self._static.setdefault(path, dict())
+        else:
+            node = self._root
+            for seg, name in zip(segments, names):
+                if name is None:
+                    node = node.children.setdefault(seg, _Node())
+                    continue
+                if node.param_child is None:
+                    node.param, node.param_child = name, _Node()
+                elif node.param != name:
+                    raise ValueError('Route %s conflicts with another route: parameter {%s} vs {%s}' % (path, name, node.param))
+                node = node.param_child
+            if node.routes is None:
+                node.routes = dict()
+            routes = node.routes
+        if method in routes:
+            raise ValueError('Duplicate route: %s %s' % (method, path))
+        route = Route(method, path, handler)
+        routes[method] = route
+        self._routes.append(route)
+        return route
+
+    def _match(self, node, segments, i, params):
+        if i == len(segments):
+            return node.routes
+        child = node.children.get(segments[i])
+        if child is not None:
+            routes = self._match(child, segments, i + 1, params)
+            if routes:
+                return routes
+        if node.param_child is not None and segments[i]:
+            routes = self._match(node.param_child, segments, i + 1, params)
+            if routes:
+                params[node.param] = segments[i]
+                return routes
+        return None
+
+    def resolve(self, method, path):
+        '''返回(Route, 参数dict, None);路径存在但方法不匹配时返回(None, None, 允许的方法);路径不存在时返回(None, None, None)'''
+        params = dict()
+        routes = self._static.get(path)
+        if routes is None:
+            routes = self._match(self._root, _segments(path), 0, params)
+            if routes is None:
+                return None, None, None
+        route = routes.get(method)
+        if route is None and method == 'HEAD':
+            route = routes.get('GET')
+        if route is None:
+            return None, None, set(routes)
+        return route, params, None
+
+    def routes(self):
+        return sorted(self._routes, key=lambda r: (r.path, r.method))
+
+def route_table(app):
+    return app.get('__route_table__')
+
+# 为请求查找路由,结果保存在request上,供中间件与处理函数共用,每个请求只匹配一次
+# 返回Route,未找到时返回None
+def match_route(request):
+    if not hasattr(request, '__route__'):
+        table = route_table(request.app)
+        route, params, allowed = table.resolve(request.method, request.path) if table is not None else (None, None, None)
+        request.__route__ = route
+        request.__match_info__ = params if params is not None else dict()
+        request.__allowed_methods__ = allowed
+    return request.__route__
+
+async def _dispatch(request):
+    route = match_route(request)
+    if route is None:
+        if request.__allowed_methods__:
+            return web.HTTPMethodNotAllowed(request.method, request.__allowed_methods__)
+        return web.HTTPNotFound()
+    return (await route.handler(request))
+
 # os.path.abspath(__file__), 返回当前脚本的绝对路径(包括文件名)
 # os.path.dirname(), 去掉文件名,返回目录路径
 # os.path.join(), 将分离的各部分组合成一个路径名
 # 将本文件同目录下的static目录(即www/static/)加入到应用的路由管理器中
+# 必须在add_routes之前调用,否则会被路由表的通配路由覆盖
 def add_static(app):
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
     app.router.add_static('/static/', path)
     logging.info('add static %s => %s' % ('/static/', path))
 
-# 将处理函数注册到app上
+# 将处理函数注册到app的路由表上
 # 处理将针对http method 和path进行
+# 第一次注册时创建路由表,并在aiohttp的路由器上注册分发所有路径的通配路由
 def add_route(app, fn):
     method = getattr(fn, '__method__', None)
     path = getattr(fn, '__route__', None)
@@ -195,7 +434,11 @@ def add_route(app, fn):
     # 最后一个参数是形参列表
     logging.info('add route %s %s => %s(%s)' % (method, path, fn.__name__, ', '.join(inspect.signature(fn).parameters.keys())))  
     # 注册request handler
-    app.router.add_route(method, path, RequestHandler(app, fn))
+    table = route_table(app)
+    if table is None:
+        table = app['__route_table__'] = RouteTable()
+        app.router.add_route('*', '/{tail:.*}', _dispatch)
+    table.add(method, path, RequestHandler(app, fn, body_limit(app, method, path)))
 
 # 自动注册所有请求处理函数    
 def add_routes(app, module_name):
@@ -219,4 +462,4 @@ def add_routes(app, module_name):
             method = getattr(fn, '__method__', None)
             path = getattr(fn, '__route__', None)
             if method and path:
-                add_route(app, fn)
\ No newline at end of file
+                add_route(app, fn)
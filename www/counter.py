@@ -0,0 +1,104 @@
+'博客浏览计数'
+
+# 浏览数先在内存中累加,每隔interval秒,或未写入的浏览数达到max_pending时,
+# 用一条多行update语句批量写入blogs.views,避免每次浏览都执行一次写操作
+# 关闭服务器时由app.py调用flush()写入剩余的计数
+# 内存中同时保存各博客已知的总浏览数,用于获取热门博客;启动时由load_popular()读入浏览数最多的博客,重启后热门博客不会为空
+
+import asyncio, heapq, logging
+
+import orm
+from models import Blog
+
+_pending = dict()   # 博客id ==> 未写入数据库的浏览数
+_pending_total = 0
+_totals = dict()    # 博客id ==> 总浏览数(数据库中的值 + 未写入的)
+_names = dict()     # 博客id ==> 博客标题
+_options = dict(interval=10, max_pending=1000, batch=500)
+_flush_lock = None
+_flush_task = None
+
+def init(loop, interval=10, max_pending=1000):
+    global _flush_lock, _flush_task
+    _options.update(interval=interval, max_pending=max_pending)
+    _flush_lock = asyncio.Lock()
+    _flush_task = asyncio.ensure_future(_flush_periodically(), loop=loop)
+
+async def load_popular(n=100):
+    '''从数据库读取浏览数最多的n篇博客,作为内存中总浏览数的初始值'''
+    blogs = await Blog.findAll(orderBy='views desc', limit=n, fields=('id', 'name', 'views'))
+    for blog in blogs:
+        _totals[blog.id] = max(_totals.get(blog.id, 0), blog.views or 0)
+        _names.setdefault(blog.id, blog.name)
+    logging.info('load view counts of %s popular blogs' % len(blogs))
+
+def hit(blog):
+    '''记录一次浏览,并将blog.views更新为包含未写入部分的浏览数'''
+    global _pending_total
+    n = _pending.get(blog.id, 0) + 1
+    _pending[blog.id] = n
+    _pending_total += 1
+    # 从数据库(可能是有延迟的副本)读到的views可能还不包含已写入的部分,取两者较大的值
+    total = max(_totals.get(blog.id, 0) + 1, (blog.views or 0) + n)
+    _totals[blog.id] = total
+    _names[blog.id] = blog.name
+    blog.views = total
+    if _pending_total >= _options['max_pending'] and _flush_lock is not None and not _flush_lock.locked():
+        asyncio.ensure_future(flush())
+
+def forget(blog_id):
+    '''博客被删除后清除其计数'''
+    global _pending_total
+    _pending_total -= _pending.pop(blog_id, 0)
+    _totals.pop(blog_id, None)
+    _names.pop(blog_id, None)
+
+def popular(n=10):
+    '''返回浏览数最多的n篇博客: [dict(id, name, views)]'''
+    return [dict(id=blog_id, name=_names[blog_id], views=views) for blog_id, views in heapq.nlargest(n, _totals.items(), key=lambda x: x[1])]
+
+# update `blogs` set `views`=`views`+case `id` when ? then ? ... end where `id` in (?, ...)
+def _batch_update_sql(n):
+    return 'update `blogs` set `views`=`views`+case `id` %s end where `id` in (%s)' % (' '.join(['when ? then ?'] * n), orm.create_args_string(n))
+
+async def flush():
+    '''将未写入的浏览数批量写入数据库,失败时计数保留到下一次'''
+    global _pending, _pending_total
+    async with _flush_lock:
+        if not _pending:
+            return
+        pending, total = _pending, _pending_total
+        _pending, _pending_total = dict(), 0
+        items = list(pending.items())
+        try:
+            for i in range(0, len(items), _options['batch']):
+                chunk = items[i:i+_options['batch']]
+                args = []
+                for blog_id, n in chunk:
+                    args.extend((blog_id, n))
+                args.extend(blog_id for blog_id, n in chunk)
+                await orm.execute(_batch_update_sql(len(chunk)), args)
+                for blog_id, n in chunk:
+                    pending.pop(blog_id)
+                    total -= n
+        except Exception as e:
+            logging.warning('failed to flush view counts: %s' % e)
+            # 未写入的部分合并回去
+            for blog_id, n in pending.items():
+                _pending[blog_id] = _pending.get(blog_id, 0) + n
+            _pending_total += total
+            return
+        logging.info('flush view counts of %s blogs' % len(items))
+
+async def _flush_periodically():
+    while True:
+        await asyncio.sleep(_options['interval'])
+        await flush()
+
+async def close():
+    if _flush_task is not None:
+        # 持有_flush_lock时再停止定时写入,正在进行的写入不会被中断,已取出的计数不会丢失
+        async with _flush_lock:
+            _flush_task.cancel()
+    if _flush_lock is not None:
+        await flush()
@@ -0,0 +1,181 @@
+'静态站点导出'
+
+# 用法:
+#   python3 export.py <目录> [--full] [--workers N]
+# 将所有博客通过blogs.html, blog.html模板导出为静态html,可以由nginx等静态服务器直接提供:
+#   /                   => index.html
+#   /page/{n}           => page/{n}/index.html
+#   /blog/{id}          => blog/{id}/index.html
+#   /archive            => archive/index.html
+#   /feed               => feed (Atom,静态服务器需要以application/atom+xml返回)
+#   /static/...         => static/...
+# 渲染(Markdown转换与模板)在进程池中并行执行
+# 每篇博客的指纹保存在目录下的.manifest.json中,再次导出时只渲染有变化的博客,并删除已删除的博客
+
+import argparse, asyncio, hashlib, json, logging, os, shutil, time
+from concurrent.futures import ProcessPoolExecutor
+
+import markdown2
+import archive
+import feed
+import orm
+from apis import Page
+from app import init_jinja2, datetime_filter, datetimes_filter
+from config import configs
+from handlers import find_comments_page
+from models import Blog
+
+MANIFEST = '.manifest.json'
+PAGE_SIZE = 10
+BATCH_SIZE = 100
+
+# ---------------------------- 子进程 ----------------------------
+_env = None
+
+def _init_worker():
+    global _env
+    d = dict()
+    # 静态页面不会随时间更新,渲染时不传入__now__,时间过滤器只显示绝对日期,不使用"x天前"这样的相对时间
+    init_jinja2(d, filters=dict(datetime=datetime_filter, datetimes=datetimes_filter), auto_reload=False)
+    _env = d['__templating__']
+
+def _write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)   # 替换是原子的,静态服务器不会读到写了一半的文件
+
+def _write(out_dir, rel_dir, html):
+    _write_file(os.path.join(out_dir, rel_dir, 'index.html'), html)
+    return rel_dir
+
+def _render_blog(out_dir, blog, comments):
+    blog['html_content'] = markdown2.markdown(blog['content'])
+    html = _env.get_template('blog.html').render(blog=blog, comments=comments, next_cursor=None)
+    return _write(out_dir, os.path.join('blog', blog['id']), html)
+
+def _render_index(out_dir, rel_dirs, blogs, page):
+    html = _env.get_template('blogs.html').render(blogs=blogs, page=page, page_url='/page/')
+    for rel_dir in rel_dirs:
+        _write(out_dir, rel_dir, html)
+    return rel_dirs[0]
+
+def _render_archive(out_dir, months):
+    html = _env.get_template('archive.html').render(months=months)
+    return _write(out_dir, 'archive', html)
+
+# ---------------------------- 主进程 ----------------------------
+# 博客页面的内容由这些属性与评论决定:评论数变化说明评论有增删,
+# 删除一条同时新增一条时评论数不变,但最新评论的id(id以创建时间开头)一定会变
+def _fingerprint(blog, latest_comment):
+    s = '\n'.join(str(blog[k]) for k in ('name', 'summary', 'content', 'user_name', 'user_image', 'comment_count', 'created_at'))
+    s += '\n' + (latest_comment or '')
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+# 一次查询一批博客各自最新评论的id: 博客id ==> 评论id
+async def _latest_comments(blog_ids):
+    if not blog_ids:
+        return dict()
+    rs = await orm.select('select `blog_id`, max(`id`) `latest` from `comments` where `blog_id` in (%s) group by `blog_id`' % orm.create_args_string(len(blog_ids)), list(blog_ids))
+    return dict((r['blog_id'], r['latest']) for r in rs)
+
+def _load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+# 按游标读取一篇博客的全部评论,静态页面没有"加载更多评论"
+async def _find_all_comments(blog_id):
+    comments, cursor = await find_comments_page(blog_id)
+    while cursor:
+        more, cursor = await find_comments_page(blog_id, cursor)
+        comments.extend(more)
+    return comments
+
+async def _export_feed(out_dir):
+    blogs = await Blog.findAll(orderBy='created_at desc', limit=configs.feed.size)
+    _write_file(os.path.join(out_dir, 'feed'), feed.render(blogs, configs.site.url, configs.site.title))
+
+def _save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+async def export(out_dir, full=False, workers=None):
+    start = time.time()
+    loop = asyncio.get_event_loop()
+    os.makedirs(out_dir, exist_ok=True)
+    old = dict() if full else _load_manifest(out_dir)
+    manifest = dict()
+    listing = []        # 首页需要的属性,不包含content
+    pending = set()
+    rendered = 0
+    max_pending = (workers or os.cpu_count() or 1) * 4
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        # 按页读取所有博客,有变化的提交到进程池渲染;进程池积压过多时等待,避免把所有博客都读入内存
+        offset = 0
+        while True:
+            blogs = await Blog.findAll(orderBy='created_at desc', limit=(offset, BATCH_SIZE))
+            latest = await _latest_comments([b.id for b in blogs if b.comment_count])
+            for blog in blogs:
+                fp = _fingerprint(blog, latest.get(blog.id))
+                manifest[blog.id] = fp
+                listing.append(dict(id=blog.id, name=blog.name, summary=blog.summary, created_at=blog.created_at, comment_count=blog.comment_count))
+                if old.get(blog.id) == fp:
+                    continue
+                comments = await _find_all_comments(blog.id)
+                pending.add(loop.run_in_executor(pool, _render_blog, out_dir, dict(blog), [dict(c) for c in comments]))
+                rendered += 1
+                if len(pending) >= max_pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for f in done:
+                        f.result()
+            if len(blogs) < BATCH_SIZE:
+                break
+            offset += BATCH_SIZE
+        removed = set(old) - set(manifest)
+        for blog_id in removed:
+            shutil.rmtree(os.path.join(out_dir, 'blog', blog_id), ignore_errors=True)
+        # 任何博客有变化时重新生成所有分页、归档与feed;首页与第1页内容相同
+        if rendered or removed or not all(os.path.exists(os.path.join(out_dir, f)) for f in ('index.html', 'archive/index.html', 'feed')):
+            entries = [(b['created_at'], b['id'], b['name']) for b in listing]
+            pending.add(loop.run_in_executor(pool, _render_archive, out_dir, archive.group_by_month(entries)))
+            await _export_feed(out_dir)
+            page_count = max(1, (len(listing) + PAGE_SIZE - 1) // PAGE_SIZE)
+            for i in range(1, page_count + 1):
+                page = Page(len(listing), i, PAGE_SIZE)
+                rel_dirs = ['page/%s' % i] + ([''] if i == 1 else [])
+                pending.add(loop.run_in_executor(pool, _render_index, out_dir, rel_dirs, listing[page.offset:page.offset+page.limit], page))
+            # 删除多出来的分页
+            i = page_count + 1
+            while os.path.isdir(os.path.join(out_dir, 'page', str(i))):
+                shutil.rmtree(os.path.join(out_dir, 'page', str(i)))
+                i += 1
+        if pending:
+            for f in (await asyncio.wait(pending))[0]:
+                f.result()
+    static = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    shutil.copytree(static, os.path.join(out_dir, 'static'), dirs_exist_ok=True)
+    _save_manifest(out_dir, manifest)
+    logging.info('export %s blogs to %s in %.1fs: %s rendered, %s removed' % (len(manifest), out_dir, time.time() - start, rendered, len(removed)))
+
+async def main(loop, args):
+    await orm.create_pool(loop=loop, **configs.db)
+    try:
+        await export(args.dir, args.full, args.workers)
+    finally:
+        await orm.close_pool()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Export all public pages as static html.')
+    parser.add_argument('dir', help='output directory')
+    parser.add_argument('--full', action='store_true', help='render all blogs, ignore the manifest of the last export')
+    parser.add_argument('--workers', type=int, default=None, help='number of render processes')
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop, args))
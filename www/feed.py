@@ -0,0 +1,73 @@
+'Atom订阅'
+
+# 最新的configs.feed.size篇博客生成的Atom feed,生成后保存在内存中
+# 只有博客被创建/修改/删除时(invalidate())才会在下一次请求时重新生成
+# 客户端带If-None-Match请求时,内容未变化则返回304
+
+import asyncio, hashlib, logging, time
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+import markdown2
+from models import Blog
+from config import configs
+
+_feed = None        # (body, etag)
+_version = 0        # 每次invalidate()加1,生成期间博客被修改时,生成的结果不再缓存
+_lock = None        # 第一次生成时创建,绑定到当时运行的事件循环
+
+def invalidate():
+    global _feed, _version
+    _feed = None
+    _version += 1
+
+def _rfc3339(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def render(blogs, site_url, title):
+    '''生成Atom feed的xml'''
+    url = site_url.rstrip('/')
+    updated = blogs[0].created_at if blogs else time.time()
+    L = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<feed xmlns="http://www.w3.org/2005/Atom">',
+        '<title>%s</title>' % escape(title),
+        '<link href="%s/feed" rel="self"/>' % url,
+        '<link href="%s/"/>' % url,
+        '<id>%s/</id>' % url,
+        '<updated>%s</updated>' % _rfc3339(updated)
+    ]
+    for blog in blogs:
+        link = '%s/blog/%s' % (url, blog.id)
+        L.append('<entry>')
+        L.append('<title>%s</title>' % escape(blog.name))
+        L.append('<link href="%s"/>' % link)
+        L.append('<id>%s</id>' % link)
+        L.append('<published>%s</published>' % _rfc3339(blog.created_at))
+        L.append('<updated>%s</updated>' % _rfc3339(blog.created_at))
+        L.append('<author><name>%s</name></author>' % escape(blog.user_name))
+        L.append('<summary>%s</summary>' % escape(blog.summary))
+        L.append('<content type="html">%s</content>' % escape(markdown2.markdown(blog.content)))
+        L.append('</entry>')
+    L.append('</feed>')
+    return '\n'.join(L)
+
+async def get_feed():
+    '''返回(body, etag),内存中没有时重新生成,并发的请求只生成一次'''
+    global _feed, _lock
+    if _feed is not None:
+        return _feed
+    if _lock is None:
+        _lock = asyncio.Lock()
+    async with _lock:
+        if _feed is not None:
+            return _feed
+        version = _version
+        start = time.time()
+        blogs = await Blog.findAll(orderBy='created_at desc', limit=configs.feed.size)
+        body = render(blogs, configs.site.url, configs.site.title).encode('utf-8')
+        feed = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+        logging.info('render feed in %.3fs: %s blogs, %s bytes' % (time.time() - start, len(blogs), len(body)))
+        if version == _version:
+            _feed = feed
+        return feed
@@ -0,0 +1,52 @@
+'模板片段缓存'
+
+# Jinja2扩展,缓存模板中不随请求变化的片段:
+#   {% cache 'sidebar' %}...{% endcache %}                  永不过期
+#   {% cache 'archive', 300, ['blogs'] %}...{% endcache %}  300秒后过期,或invalidate('blogs')时删除
+# key可以是表达式,片段内容依赖的变量都应包含在key中,如'pagination:' ~ page.page_index
+# key本身也是一个标签,可以用invalidate(key)单独删除
+# 缓存保存在本进程的LRU(cache.LRUBackend)中,与响应缓存相互独立
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from cache import LRUBackend
+
+_backend = LRUBackend(256)
+
+def set_maxsize(maxsize):
+    global _backend
+    _backend = LRUBackend(maxsize)
+
+def invalidate(*tags):
+    return _backend.invalidate(tags)
+
+def clear():
+    _backend.clear()
+
+def stats():
+    return _backend.stats()
+
+class FragmentCacheExtension(Extension):
+
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        # 可选的ttl与标签列表
+        for i in range(2):
+            if parser.stream.skip_if('comma'):
+                args.append(parser.parse_expression())
+            else:
+                args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, ttl, tags, caller):
+        found, value = _backend.get(key)
+        if found:
+            return value
+        value = caller()
+        _backend.set(key, value, ttl if ttl is not None else float('inf'), [key] + list(tags or ()))
+        return value
@@ -4,17 +4,28 @@ import re
 import json
 import logging
 import hashlib
+import inspect
 import base64
 import asyncio
 import markdown2
+import orm
+import search
+import feed
+import archive
+import counter
+import cache
+import fragments
+import singleflight
+import passwords
+from bloom import BloomFilter
 from aiohttp import web
-from coroweb import get, post # 导入装饰器,这样就能很方便的生成request handler
+from coroweb import get, post, cached, route_table # 导入装饰器,这样就能很方便的生成request handler
 from models import User, Comment, Blog, next_id
 from apis import APIResourceNotFoundError, APIValueError, APIError, APIPermissionError, Page
 from config import configs
 
 
-# 所有的handler都会在app.py中通过add_routes自动注册到app.router
+# 所有的handler都会在app.py中通过add_routes自动注册到路由表(见coroweb.py)
 
 COOKIE_NAME = 'awesession'             # cookie名,用于设置cookie
 _COOKIE_KEY = configs.session.secret   # cookie密钥,作为加密cookie的原始字符串的一部分
@@ -23,6 +34,32 @@ _COOKIE_KEY = configs.session.secret   # cookie密钥,作为加密cookie的原
 _RE_EMAIL = re.compile(r'^[a-z0-9\.\-\_]+\@[a-z0-9\-\_]+(\.[a-z0-9\-\_]+){1,4}$')
 _RE_SHA1 = re.compile(r'[0-9a-f]{40}$')
 
+COMMENTS_PAGE_SIZE = 20     # 博客详情页每次加载的评论数
+
+# 用户列表中可以公开的属性
+_USER_FIELDS = ('id', 'email', 'admin', 'name', 'image', 'created_at')
+
+# 已注册邮箱的Bloom filter,由load_known_emails()在启动时加载,为None时注册总是查询数据库
+# 其他进程注册的邮箱不在其中,这种情况由插入时的唯一索引idx_email兜底
+_known_emails = None
+
+async def load_known_emails(capacity, error_rate=0.01, batch=1000):
+    global _known_emails
+    emails = BloomFilter(capacity, error_rate)
+    last = ''
+    # 按email翻页,使用idx_email索引
+    while True:
+        users = await User.findAll('email>?', [last], orderBy='email', limit=batch, fields=('email',))
+        for u in users:
+            emails.add(u.email)
+        if len(users) < batch:
+            break
+        last = users[-1].email
+    _known_emails = emails
+    logging.info('load %s known emails' % len(emails))
+    if len(emails) > capacity:
+        logging.warning('known emails exceed the capacity of the bloom filter: %s > %s' % (len(emails), capacity))
+
 # 验证用户身份
 def check_admin(request):
     # 检查用户是否管理员
@@ -93,6 +130,7 @@ def cookie2user(cookie_str):
 
 # 对于首页的get请求的处理
 @get('/')
+@cached(ttl=60, tags=['blogs'])
 def index(*, page="1"):
     page_index = get_page_index(page)  
     num = yield from Blog.findNumber("count(id)")
@@ -137,21 +175,59 @@ def signout(request):
     logging.info("user signed out.")
     return r
 
+# 按游标分页读取一篇博客的评论,最新的排在最前
+# 游标为上一页最后一条评论的"created_at,id",翻页走comments表的(blog_id, created_at)索引,不使用offset
+# 返回(评论列表, 下一页的游标),没有下一页时游标为None
+@asyncio.coroutine
+def find_comments_page(blog_id, cursor=None, size=COMMENTS_PAGE_SIZE):
+    where, args = 'blog_id=?', [blog_id]
+    if cursor:
+        try:
+            created_at, cid = cursor.split(',', 1)
+            created_at = float(created_at)
+        except ValueError:
+            raise APIValueError('cursor', 'Invalid cursor')
+        where = 'blog_id=? and (created_at<? or (created_at=? and id<?))'
+        args.extend([created_at, created_at, cid])
+    # 多取一条,用于判断是否还有下一页
+    comments = yield from Comment.findAll(where, args, orderBy='created_at desc, id desc', limit=size + 1)
+    next_cursor = None
+    if len(comments) > size:
+        comments = comments[:size]
+        next_cursor = '%r,%s' % (comments[-1].created_at, comments[-1].id)
+    # html_content在发表评论时已经生成,只有尚未回填的旧评论需要在这里转换
+    for c in comments:
+        if c.html_content is None:
+            c.html_content = text2html(c.content)
+    return comments, next_cursor
+
+# 读取博客详情页需要的数据,同时到达的同一博客的请求共享一次查询与Markdown转换
+_blog_page_flight = singleflight.group('blog_page')
+
+async def load_blog_page(id):
+    blog = await Blog.find(id) # 通过id从数据库拉取博客信息
+    if blog is None:
+        return None, (), None
+    comments, next_cursor = await find_comments_page(id)
+    blog.html_content = markdown2.markdown(blog.content) # blog是markdown格式,将其转换为html格式
+    return blog, comments, next_cursor
+
 # 博客详情页
+# 只渲染第一页评论,其余评论由页面通过/api/blogs/{id}/comments按需加载
 @get('/blog/{id}')
 def get_blog(id):
-    blog = yield from Blog.find(id) # 通过id从数据库拉取博客信息
-    # 从数据库拉取指定blog的全部评论,按时间降序排序,即最新的排在最前
-    comments = yield from Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
-    # 将每条评论都转化为html格式(根据text2html代码可知,实际为html的<p>)
-    for c in comments:
-        c.html_content = text2html(c.content)
-    blog.html_content = markdown2.markdown(blog.content) # blog是markdown格式,将其转换为html格式
+    blog, comments, next_cursor = yield from _blog_page_flight.do(id, lambda: load_blog_page(id))
+    if blog is None:
+        raise APIResourceNotFoundError('Blog', 'No such a blog.')
+    blog = Blog(**blog) # 共享的结果不能修改,复制后再累加浏览数
+    counter.hit(blog)   # 浏览数在内存中累加,定期批量写入数据库
     return {
         # 返回的参数将在jinja2模板中被解析
         "__template__": "blog.html",
+        "__stream__": True,     # 博客内容可能很长,流式渲染
         "blog": blog,
-        "comments": comments
+        "comments": comments,
+        "next_cursor": next_cursor
     }
 
 # 写博客的页面
@@ -206,6 +282,7 @@ def manage_users(*, page='1'):  # 管理页面默认从"1"开始
     }
 
 # API: 获取用户信息
+# 与其他列表一样按created_at分页(使用idx_created_at索引),并且只查询公开的属性,passwd不会被读出
 @get('/api/users')
 def api_get_users(*, page="1"):
     page_index = get_page_index(page)
@@ -213,9 +290,7 @@ def api_get_users(*, page="1"):
     p = Page(num, page_index)
     if num == 0:
         return dict(page=p, users=())
-    users = yield from User.findAll(orderBy="created_at desc")
-    for u in users:
-        u.passwd = "*****"
+    users = yield from User.findAll(orderBy="created_at desc", limit=(p.offset, p.limit), fields=_USER_FIELDS)
     # 以dict形式返回,并且未指定__template__,将被app.py的response factory处理为json
     return dict(page=p, users=users)
 
@@ -229,22 +304,28 @@ def api_register_user(*,name, email, passwd): # 注册信息包括用户名,邮
         raise APIValueError("email")
     if not passwd or not _RE_SHA1.match(passwd):
         raise APIValueError("passwd")
-    # 在数据库里查看是否已存在该email
-    users = yield from User.findAll('email=?', [email]) # mysql parameters are listed in list
-    if len(users) > 0: # findAll的结果不为0,说明数据库已存在同名email,抛出异常报错
-        raise APIError('register:failed', 'email', 'Email is already in use.')
+    # 在数据库里查看是否已存在该email,Bloom filter判断一定不存在时跳过查询
+    # 这只是为了在计算密码哈希之前尽早报错,并发注册同一邮箱时由insert的唯一索引冲突保证
+    if _known_emails is None or email in _known_emails:
+        if (yield from User.exists('email=?', [email])): # 已存在同名email,抛出异常报错
+            raise APIError('register:failed', 'email', 'Email is already in use.')
 
     # 数据库内无相应的email信息,说明是第一次注册
     uid = next_id() # 利用当前时间与随机生成的uuid生成user id
-    sha1_passwd = '%s:%s' % (uid, passwd) # 将user id与密码的组合赋给sha1_passwd变量
     # 创建用户对象, 其中密码并不是用户输入的密码,而是经过复杂处理后的保密字符串
-    # unicode对象在进行哈希运算之前必须先编码
-    # sha1(secure hash algorithm),是一种不可逆的安全算法.这在一定程度上保证了安全性,因为用户密码只有用户一个人知道
-    # hexdigest()函数将hash对象转换成16进制表示的字符串
+    # 密码由passwords.py对user id与密码的组合加salt做PBKDF2得到,在线程池中计算,不阻塞事件循环
     # md5是另一种安全算法
     # Gravatar(Globally Recognized Avatar)是一项用于提供在全球范围内使用的头像服务。只要在Gravatar的服务器上上传了你自己的头像，便可以在其他任何支持Gravatar的博客、论坛等地方使用它。此处image就是一个根据用户email生成的头像
-    user = User(id=uid, name=name.strip(), email=email, passwd=hashlib.sha1(sha1_passwd.encode('utf-8')).hexdigest(), image="http://www.gravatar.com/avatar/%s?d=mm&s=120" % hashlib.md5(email.encode('utf-8')).hexdigest())
-    yield from user.save() # 将用户信息储存到数据库中,save()方法封装的实际是数据库的insert操作
+    hashed = yield from passwords.hash_password(uid, passwd)
+    user = User(id=uid, name=name.strip(), email=email, passwd=hashed, image="http://www.gravatar.com/avatar/%s?d=mm&s=120" % hashlib.md5(email.encode('utf-8')).hexdigest())
+    try:
+        yield from user.save() # 将用户信息储存到数据库中,save()方法封装的实际是数据库的insert操作
+    except orm.DuplicateKeyError as e:
+        if e.key != 'idx_email':
+            raise
+        raise APIError('register:failed', 'email', 'Email is already in use.')
+    if _known_emails is not None:
+        _known_emails.add(email)
 
     # 这其实还是一个handler,因此需要返回response. 此时返回的response是带有cookie的响应
     r = web.Response()
@@ -277,14 +358,14 @@ def authenticate(*, email, passwd): # 通过邮箱与密码验证登录
     # 验证密码
     # 数据库中存储的并非原始的用户密码,而是加密的字符串
     # 我们对此时用户输入的密码做相同的加密操作,将结果与数据库中储存的密码比较,来验证密码的正确性
-    # 以下步骤合成为一步就是:sha1 = hashlib.sha1((user.id+":"+passwd).encode("utf-8"))
     # 对照用户时对原始密码的操作(见api_register_user),操作完全一样
-    sha1 = hashlib.sha1()
-    sha1.update(user.id.encode("utf-8"))
-    sha1.update(b":")
-    sha1.update(passwd.encode("utf-8"))
-    if user.passwd != sha1.hexdigest():
+    ok, rehash = yield from passwords.verify_password(user.id, passwd, user.passwd)
+    if not ok:
         raise APIValueError("passwd", "Invalid password")
+    # 旧的sha1密码或迭代次数低于当前配置的密码,登录成功时重新计算并保存
+    if rehash:
+        user.passwd = yield from passwords.hash_password(user.id, passwd)
+        yield from user.update(fields=('passwd',))
     # 用户登录之后,同样的设置一个cookie,与注册用户部分的代码完全一样
     r = web.Response()
     r.set_cookie(COOKIE_NAME, user2cookie(user, 600), max_age=600, httponly=True)
@@ -295,8 +376,74 @@ def authenticate(*, email, passwd): # 通过邮箱与密码验证登录
     r.body = json.dumps(user, ensure_ascii=False).encode("utf-8")
     return r
 
+# 博客被创建/修改/删除后,更新依赖博客内容的内存数据
+def on_blog_saved(blog):
+    search.index_blog(blog)
+    feed.invalidate()
+    archive.blog_saved(blog)
+    cache.invalidate('blogs', 'blog:%s' % blog.id)
+    fragments.invalidate('blogs')
+
+def on_blog_removed(blog_id):
+    search.remove_blog(blog_id)
+    feed.invalidate()
+    archive.blog_removed(blog_id)
+    counter.forget(blog_id)
+    cache.invalidate('blogs', 'blog:%s' % blog_id, 'comments:%s' % blog_id)
+    fragments.invalidate('blogs')
+
+# API: 浏览数最多的博客,来自内存中的计数
+@get('/api/popular_blogs')
+def api_popular_blogs(*, n='10'):
+    try:
+        n = min(max(int(n), 1), 100)
+    except ValueError:
+        raise APIValueError('n', 'n must be an integer')
+    return dict(blogs=counter.popular(n))
+
+# sitemap,由内存中的博客索引生成
+@get('/sitemap.xml')
+def sitemap():
+    r = web.Response(body=archive.sitemap(configs.site.url))
+    r.content_type = 'application/xml'
+    r.charset = 'utf-8'
+    return r
+
+# 按月归档页面
+@get('/archive')
+def archive_page():
+    return {
+        "__template__": "archive.html",
+        "months": archive.months()
+    }
+
+# Atom订阅,内容在内存中缓存,未变化时返回304
+@get('/feed')
+def atom_feed(request):
+    body, etag = yield from feed.get_feed()
+    if request.headers.get('If-None-Match') == etag:
+        return web.HTTPNotModified(headers={'ETag': etag})
+    r = web.Response(body=body)
+    r.content_type = 'application/atom+xml'
+    r.charset = 'utf-8'
+    r.headers['ETag'] = etag
+    r.headers['Cache-Control'] = 'public, max-age=60'
+    return r
+
+# API: 搜索博客,按BM25相关度排序
+@get('/api/search')
+def api_search(*, q='', page='1'):
+    page_index = get_page_index(page)
+    page_size = 10
+    num, blogs = search.search(q, page_size * (page_index - 1), page_size)
+    p = Page(num, page_index, page_size)
+    if p.limit == 0:  # 没有结果,或页码超出范围
+        return dict(page=p, blogs=())
+    return dict(page=p, blogs=blogs)
+
 # API: 获取blog
 @get('/api/blogs')
+@cached(ttl=60, tags=['blogs'])
 def api_blogs(*, page='1'):
     page_index = get_page_index(page)
     num = yield from Blog.findNumber('count(id)')  # num为博客总数
@@ -310,6 +457,7 @@ def api_blogs(*, page='1'):
 
 # API: 获取单条日志
 @get('/api/blogs/{id}')
+@cached(ttl=300, tags=['blog:{id}'])
 def api_get_blog(*, id):
     blog = yield from Blog.find(id)
     return blog
@@ -328,6 +476,7 @@ def api_create_blog(request, *, name, summary, content):
     # 创建博客对象
     blog = Blog(user_id=request.__user__.id, user_name=request.__user__.name, user_image=request.__user__.image, name=name.strip(),summary=summary.strip(), content=content.strip())
     yield from blog.save() # 储存博客入数据库
+    on_blog_saved(blog)
     return blog # 返回博客信息
 
 # API: 修改博客
@@ -345,7 +494,8 @@ def api_update_blog(id, request, *, name, summary, content):
     blog.name = name.strip()
     blog.summary = summary.strip()
     blog.content = content.strip()
-    yield from blog.update() # 更新博客
+    yield from blog.update(fields=('name', 'summary', 'content')) # 更新博客,只写入修改的属性,避免覆盖评论数与浏览数
+    on_blog_saved(blog)
     return blog # 返回博客信息
 
 # API: 删除博客
@@ -356,6 +506,7 @@ def api_delete_blog(request, *, id):
     # 因此需要先创建对象,再删除
     blog = yield from Blog.find(id)  # 取出博客
     yield from blog.remove()  # 删除博客
+    on_blog_removed(id)
     return dict(id=id)  # 返回被删博客的id
 
 # API: 获取评论
@@ -371,6 +522,31 @@ def api_comments(*, page="1"):
     comments = yield from Comment.findAll(orderBy="created_at desc", limit=(p.offset, p.limit))
     return dict(page=p, comments=comments)  # 返回字典,以供response中间件处理
 
+# 评论与博客的评论数(blogs.comment_count)在同一个事务中修改,偏差由jobs.py reconcile_comment_count修正
+# 博客列表与博客中显示评论数,一并删除其缓存
+async def save_comment(comment):
+    async with orm.transaction():
+        await comment.save()
+        await Blog.increase(comment.blog_id, 'comment_count', 1)
+    on_comments_changed(comment.blog_id)
+
+async def remove_comment(comment):
+    async with orm.transaction():
+        # 同时或重复删除同一条评论时,只有真正删除了记录的一次减少评论数
+        if (await comment.remove()) == 1:
+            await Blog.increase(comment.blog_id, 'comment_count', -1)
+    on_comments_changed(comment.blog_id)
+
+def on_comments_changed(blog_id):
+    cache.invalidate('blogs', 'blog:%s' % blog_id, 'comments:%s' % blog_id)
+
+# API: 按游标分页获取一篇博客的评论
+@get('/api/blogs/{id}/comments')
+@cached(ttl=60, tags=['comments:{id}'])
+def api_blog_comments(id, *, cursor=None):
+    comments, next_cursor = yield from find_comments_page(id, cursor)
+    return dict(comments=comments, next_cursor=next_cursor)
+
 # API: 创建评论
 @post('/api/blogs/{id}/comments')
 def api_create_comment(id, request,  *, content):
@@ -385,8 +561,10 @@ def api_create_comment(id, request,  *, content):
     if blog is None:
         raise APIResourceNotFoundError("Blog", "No such a blog.")
     # 创建评论对象
-    comment = Comment(user_id=user.id, user_name=user.name, user_image=user.image, blog_id = blog.id, content=content.strip())
-    yield from comment.save() # 储存评论入数据库
+    # 评论在发表时就转化为html格式(根据text2html代码可知,实际为html的<p>)并保存,读取时不再转换
+    content = content.strip()
+    comment = Comment(user_id=user.id, user_name=user.name, user_image=user.image, blog_id = blog.id, content=content, html_content=text2html(content))
+    yield from save_comment(comment) # 储存评论入数据库,并更新博客的评论数
     return comment # 返回评论
 
 # API: 删除评论
@@ -396,5 +574,57 @@ def api_delete_comment(id, request):
     comment = yield from Comment.find(id)  # 从数据库中取出评论
     if comment is None:
         raise APIResourceNotFoundError("Comment", "No such a Comment.")
-    yield from comment.remove()  # 删除评论
-    return dict(id=id)  # 返回被删评论的ID
\ No newline at end of file
+    yield from remove_comment(comment)  # 删除评论,并更新博客的评论数
+    return dict(id=id)  # 返回被删评论的ID
+
+# API: 获取SQL耗时统计(按总耗时排序的语句形状,慢查询附带EXPLAIN执行计划)
+@get('/api/admin/sql_stats')
+def api_sql_stats(request, *, top=None):
+    check_admin(request)
+    # top不是正整数时使用默认值
+    try:
+        top = int(top)
+    except (TypeError, ValueError):
+        top = None
+    if top is not None and top < 1:
+        top = None
+    return dict(queries=orm.query_stats(top))
+
+# API: 清空SQL耗时统计
+@post('/api/admin/sql_stats/reset')
+def api_reset_sql_stats(request):
+    check_admin(request)
+    orm.reset_query_stats()
+    return dict(reset=True)
+
+# API: 获取数据库连接池状态与获取连接的等待统计
+@get('/api/admin/pool_stats')
+def api_pool_stats(request):
+    check_admin(request)
+    return orm.pool_stats()
+
+# API: 获取响应缓存与模板片段缓存的命中统计
+@get('/api/admin/cache_stats')
+def api_cache_stats(request):
+    check_admin(request)
+    return dict(responses=cache.stats(), fragments=fragments.stats())
+
+# API: 清空模板片段缓存,修改模板后使用
+@post('/api/admin/fragments/reset')
+def api_reset_fragments(request):
+    check_admin(request)
+    fragments.clear()
+    return dict(reset=True)
+
+# API: 获取请求合并(single-flight)的统计,coalesced为共享其他调用结果的次数
+@get('/api/admin/singleflight_stats')
+def api_singleflight_stats(request):
+    check_admin(request)
+    return singleflight.stats()
+
+# API: 列出路由表中注册的所有路由与处理函数的参数
+@get('/api/admin/routes')
+def api_routes(request):
+    check_admin(request)
+    routes = [dict(method=r.method, path=r.path, handler=r.func.__name__, signature=str(inspect.signature(r.func))) for r in route_table(request.app).routes()]
+    return dict(routes=routes)
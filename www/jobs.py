@@ -0,0 +1,61 @@
+'后台维护任务'
+
+# 用法:
+#   python3 jobs.py backfill_comment_html     为旧评论生成html_content
+#   python3 jobs.py reconcile_comment_count   修正博客的评论数
+
+import asyncio, logging, sys
+
+import orm
+from models import Comment
+from handlers import text2html
+
+BATCH_SIZE = 500
+
+# 为html_content为null的评论(html_content列加入之前发表的)生成html
+# 每批读取BATCH_SIZE条,在一个批量事务中通过executemany一次性更新
+# 按主键翻页(id>上一批最后的id),每批只从上次的位置向后扫描,不会反复跳过已经回填的评论
+async def backfill_comment_html():
+    total = 0
+    last = ''
+    while True:
+        comments = await Comment.findAll('id>? and html_content is null', [last], orderBy='id', limit=BATCH_SIZE, fields=('id', 'content'), primary=True)
+        if not comments:
+            break
+        last = comments[-1].id
+        async with orm.transaction(batch=True):
+            for c in comments:
+                await orm.execute('update `comments` set `html_content`=? where `id`=?', [text2html(c.content), c.id])
+        total += len(comments)
+        logging.info('backfill comment html: %s comments done' % total)
+        if len(comments) < BATCH_SIZE:
+            break
+    return total
+
+# 修正blogs.comment_count与comments表实际数目的偏差,只更新有偏差的博客,返回修正的博客数
+async def reconcile_comment_count():
+    rows = await orm.execute('''update `blogs` b left join (select `blog_id`, count(`id`) n from `comments` group by `blog_id`) c on c.`blog_id`=b.`id`
+        set b.`comment_count`=ifnull(c.n, 0) where b.`comment_count`<>ifnull(c.n, 0)''', [])
+    logging.info('reconcile comment count: %s blogs fixed' % rows)
+    return rows
+
+JOBS = {
+    'backfill_comment_html': backfill_comment_html,
+    'reconcile_comment_count': reconcile_comment_count
+}
+
+async def main(loop, name):
+    from config import configs
+    await orm.create_pool(loop=loop, **configs.db)
+    try:
+        await JOBS[name]()
+    finally:
+        await orm.close_pool()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2 or sys.argv[1] not in JOBS:
+        print('Usage: python3 jobs.py [%s]' % '|'.join(sorted(JOBS)))
+        sys.exit(1)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop, sys.argv[1]))
@@ -0,0 +1,172 @@
+'数据库迁移'
+
+# 用法:
+#   python3 migrate.py            执行所有未执行的迁移
+#   python3 migrate.py status     查看各迁移的执行情况
+# 也可以在configs.db中设置"migrate": True,在app.py启动时自动执行
+# 注意: schema.sql中的www-data用户没有alter/index权限,可以在config_override.py中为迁移配置有权限的用户
+
+import asyncio, logging, sys, time
+
+import orm
+from models import User, Blog, Comment
+
+# 迁移操作都是幂等的: 执行前先查询information_schema,已存在的索引/列直接跳过
+# 因此由schema.sql新建的数据库(已包含全部索引)执行迁移时只会登记版本号
+
+# 添加在Model.__indexes__中声明的索引
+class AddIndex(object):
+
+    def __init__(self, model, name):
+        if name not in model.__indexes__:
+            raise ValueError('Index %s is not declared in %s.__indexes__' % (name, model.__name__))
+        self.model = model
+        self.name = name
+        self.columns = model.__indexes__[name]
+
+    def __str__(self):
+        return 'add index %s.%s (%s)' % (self.model.__table__, self.name, ', '.join(self.columns))
+
+    async def exists(self):
+        rs = await orm.select('select count(*) _num_ from information_schema.statistics where table_schema=database() and table_name=? and index_name=?', [self.model.__table__, self.name], 1)
+        return rs[0]['_num_'] > 0
+
+    async def apply(self):
+        await orm.execute('alter table `%s` add index `%s` (%s)' % (self.model.__table__, self.name, ', '.join(map(lambda c: '`%s`' % c, self.columns))), [])
+
+# 添加Model中新增的属性对应的列,列类型取自ModelMetaclass建立的映射
+class AddColumn(object):
+
+    def __init__(self, model, name):
+        if name not in model.__mappings__:
+            raise ValueError('Field %s is not defined in %s' % (name, model.__name__))
+        self.model = model
+        self.name = name
+        self.field = model.__mappings__[name]
+
+    def __str__(self):
+        return 'add column %s.%s %s' % (self.model.__table__, self.name, self.ddl())
+
+    # 有固定默认值的列为not null,已有的行会填入默认值;否则允许为null,由程序或回填任务补全
+    def ddl(self):
+        default = self.field.default
+        if default is None or callable(default) or self.field.column_type in ('text', 'mediumtext'):
+            return '%s null' % self.field.column_type
+        if isinstance(default, bool):
+            default = int(default)
+        if isinstance(default, str):
+            default = "'%s'" % default.replace("'", "''")
+        return '%s not null default %s' % (self.field.column_type, default)
+
+    async def exists(self):
+        rs = await orm.select('select count(*) _num_ from information_schema.columns where table_schema=database() and table_name=? and column_name=?', [self.model.__table__, self.name], 1)
+        return rs[0]['_num_'] > 0
+
+    async def apply(self):
+        await orm.execute('alter table `%s` add column `%s` %s' % (self.model.__table__, self.name, self.ddl()), [])
+
+# 修改已有列的类型为模型中定义的类型,用于加长varchar等;schema.sql中原有的列都是not null
+class ModifyColumn(object):
+
+    def __init__(self, model, name):
+        if name not in model.__mappings__:
+            raise ValueError('Field %s is not defined in %s' % (name, model.__name__))
+        self.model = model
+        self.name = name
+        self.field = model.__mappings__[name]
+
+    def __str__(self):
+        return 'modify column %s.%s %s' % (self.model.__table__, self.name, self.field.column_type)
+
+    async def exists(self):
+        # MySQL 8.0中information_schema的列名为大写(COLUMN_TYPE),与其他查询一样使用别名
+        rs = await orm.select('select column_type _type_ from information_schema.columns where table_schema=database() and table_name=? and column_name=?', [self.model.__table__, self.name], 1)
+        return len(rs) > 0 and rs[0]['_type_'].lower() == self.field.column_type.lower()
+
+    async def apply(self):
+        await orm.execute('alter table `%s` modify column `%s` %s not null' % (self.model.__table__, self.name, self.field.column_type), [])
+
+# 按版本号顺序排列的迁移: (版本号, 说明, 操作列表)
+# 已发布的迁移不能修改,只能在末尾追加
+MIGRATIONS = [
+    (1, 'index comments by blog for the blog detail page', [
+        AddIndex(Comment, 'idx_blog_id_created_at')
+    ]),
+    (2, 'store rendered html of comments, filled by: python3 jobs.py backfill_comment_html', [
+        AddColumn(Comment, 'html_content')
+    ]),
+    (3, 'denormalized comment count of blogs, filled by: python3 jobs.py reconcile_comment_count', [
+        AddColumn(Blog, 'comment_count')
+    ]),
+    (4, 'view count of blogs', [
+        AddColumn(Blog, 'views')
+    ]),
+    (5, 'longer passwd of users for salted pbkdf2 hashes, see passwords.py', [
+        ModifyColumn(User, 'passwd')
+    ]),
+]
+
+_CREATE_MIGRATIONS_TABLE = '''create table if not exists `schema_migrations` (
+    `version` bigint not null,
+    `description` varchar(200) not null,
+    `applied_at` real not null,
+    primary key (`version`)
+) engine=innodb default charset=utf8'''
+
+async def applied_versions():
+    await orm.execute(_CREATE_MIGRATIONS_TABLE, [])
+    rs = await orm.select('select `version` from `schema_migrations`', [], primary=True)
+    return set(r['version'] for r in rs)
+
+# 执行所有未执行的迁移,返回本次执行的版本号
+# 多个进程同时启动时,由MySQL的get_lock保证只有一个进程在执行迁移
+# 借用transaction()把所有语句绑定到同一个连接上(DDL会隐式提交,这里并不需要事务语义)
+async def migrate():
+    done = []
+    async with orm.transaction():
+        rs = await orm.select("select get_lock('schema_migrations', 60) _lock_", [], 1)
+        if not rs or rs[0]['_lock_'] != 1:
+            raise RuntimeError('Timeout when waiting for the migration lock.')
+        try:
+            applied = await applied_versions()
+            for version, description, operations in MIGRATIONS:
+                if version in applied:
+                    continue
+                logging.info('migrate %s: %s' % (version, description))
+                for op in operations:
+                    if await op.exists():
+                        logging.info('  skip %s' % op)
+                        continue
+                    logging.info('  %s' % op)
+                    await op.apply()
+                await orm.execute('insert into `schema_migrations` (`version`, `description`, `applied_at`) values (?, ?, ?)', [version, description, time.time()])
+                done.append(version)
+        finally:
+            await orm.select("select release_lock('schema_migrations')", [], 1)
+    logging.info('database is up to date, %s migrations applied.' % len(done))
+    return done
+
+async def status():
+    applied = await applied_versions()
+    return [(version, description, version in applied) for version, description, operations in MIGRATIONS]
+
+async def main(loop, command):
+    from config import configs
+    await orm.create_pool(loop=loop, **configs.db)
+    try:
+        if command == 'status':
+            for version, description, applied in await status():
+                print('%4s  %-8s %s' % (version, 'applied' if applied else 'pending', description))
+        else:
+            await migrate()
+    finally:
+        await orm.close_pool()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'up'
+    if command not in ('up', 'status'):
+        print('Usage: python3 migrate.py [up|status]')
+        sys.exit(1)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop, command))
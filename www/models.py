@@ -1,6 +1,6 @@
 import time, uuid
 
-from orm import Model, StringField, BooleanField, FloatField, TextField
+from orm import Model, StringField, BooleanField, IntegerField, FloatField, TextField
 
 # 用当前时间与随机生成的uuid合成作为id
 def next_id():
@@ -8,12 +8,16 @@ def next_id():
     return "%015d%s000" % (int(time.time() * 1000), uuid.uuid4().hex)
 
 
+# __indexes__声明表上的(非唯一)索引: 索引名 ==> 列名,新增的索引通过migrate.py中的迁移创建
 class User(Model):
     __table__ = 'users'
+    __indexes__ = {
+        'idx_created_at': ('created_at',)
+    }
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     email = StringField(ddl='varchar(50)')
-    passwd = StringField(ddl='varchar(50)')
+    passwd = StringField(ddl='varchar(200)')  # 格式见passwords.py
     admin = BooleanField()
     name = StringField(ddl='varchar(50)')
     image = StringField(ddl='varchar(500)')
@@ -21,6 +25,9 @@ class User(Model):
 
 class Blog(Model):
     __table__ = 'blogs'
+    __indexes__ = {
+        'idx_created_at': ('created_at',)
+    }
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     user_id = StringField(ddl='varchar(50)')
@@ -29,10 +36,16 @@ class Blog(Model):
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
     content = TextField()
+    comment_count = IntegerField()      # 冗余的评论数,随评论的发表与删除在同一事务中更新
+    views = IntegerField()              # 浏览数,由counter.py在内存中累加后批量写入
     created_at = FloatField(default=time.time)
 
 class Comment(Model):
     __table__ = 'comments'
+    __indexes__ = {
+        'idx_created_at': ('created_at',),
+        'idx_blog_id_created_at': ('blog_id', 'created_at')
+    }
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     blog_id = StringField(ddl='varchar(50)')
@@ -40,4 +53,5 @@ class Comment(Model):
     user_name = StringField(ddl='varchar(50)')
     user_image = StringField(ddl='varchar(500)')
     content = TextField()
-    created_at = FloatField(default=time.time)
\ No newline at end of file
+    html_content = TextField(ddl='mediumtext')     # 发表时由content转换得到的html,读取时不再转换
+    created_at = FloatField(default=time.time)
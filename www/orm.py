@@ -1,54 +1,362 @@
 
 import asyncio
+import contextvars
+import functools
+import itertools
 import logging
+import re
+import time
 import aiomysql
 
+import singleflight
+
 def log(sql, args=()):
     logging.info('SQL: %s' % sql)
 
-# 创建连接池
+# ---------------------------- 慢查询统计 ----------------------------
+# 每条SQL执行后都会记录耗时,按"归一化"后的语句形状(去掉字面量)聚合
+# threshold - 超过该耗时(秒)的语句视为慢查询,记录警告日志
+# explain   - 为True时,对慢查询执行EXPLAIN并保存执行计划
+# top       - query_stats()默认返回总耗时最高的前top个语句形状
+# max_shapes- 最多保留的语句形状数目,超出时淘汰总耗时最少的一个
+_slow_query = dict(threshold=0.2, explain=False, top=20, max_shapes=500)
+_query_stats = dict()
+
+_RE_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_RE_SQL_NUMBER = re.compile(r'\b\d+(\.\d+)?\b')
+_RE_SQL_IN_LIST = re.compile(r'\(\s*\?(\s*,\s*\?)+\s*\)')
+_RE_SQL_SPACE = re.compile(r'\s+')
+
+def set_slow_query(**kw):
+    '''修改慢查询统计的配置,参数同_slow_query'''
+    for k, v in kw.items():
+        if k not in _slow_query:
+            raise ValueError('Invalid slow query option: %s' % k)
+        _slow_query[k] = v
+
+# 将SQL归一化为语句形状:字面量替换为?,in (?, ?, ...)折叠,空白压缩
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    shape = _RE_SQL_STRING.sub('?', sql)
+    shape = _RE_SQL_NUMBER.sub('?', shape)
+    shape = _RE_SQL_IN_LIST.sub('(...)', shape)
+    return _RE_SQL_SPACE.sub(' ', shape).strip()
+
+# 记录一次执行耗时,返回该语句形状是否需要EXPLAIN
+def _record(sql, elapsed):
+    shape = normalize_sql(sql)
+    st = _query_stats.get(shape)
+    if st is None:
+        if len(_query_stats) >= _slow_query['max_shapes']:
+            # 淘汰总耗时最少的语句形状,保留真正的热点
+            del _query_stats[min(_query_stats, key=lambda k: _query_stats[k]['total'])]
+        st = _query_stats[shape] = dict(sql=shape, count=0, total=0.0, max=0.0, slow=0, explain=None)
+    st['count'] += 1
+    st['total'] += elapsed
+    if elapsed > st['max']:
+        st['max'] = elapsed
+    if elapsed < _slow_query['threshold']:
+        return False
+    st['slow'] += 1
+    logging.warning('SLOW SQL (%.3fs): %s' % (elapsed, sql))
+    # 同一形状只需EXPLAIN一次,insert语句没有可分析的执行计划
+    return _slow_query['explain'] and st['explain'] is None and not shape.lower().startswith('insert')
+
+# 在同一个连接上对慢查询执行EXPLAIN,失败不影响原语句的结果
+async def _explain(conn, sql, args):
+    try:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute('explain ' + _driver_sql(sql), args or ())
+            plan = await cur.fetchall()
+        _query_stats[normalize_sql(sql)]['explain'] = plan
+    except Exception as e:
+        logging.warning('failed to explain sql: %s' % e)
+
+def query_stats(top=None):
+    '''返回总耗时最高的top个语句形状的统计信息'''
+    top = top or _slow_query['top']
+    L = sorted(_query_stats.values(), key=lambda st: st['total'], reverse=True)[:top]
+    return [dict(st, avg=st['total'] / st['count']) for st in L]
+
+def reset_query_stats():
+    _query_stats.clear()
+
+# ---------------------------- 连接池 ----------------------------
+# 连接池的获取等待统计,用于观察请求是否在排队等待数据库连接
+_pool_stats = dict(acquired=0, waited=0, wait_total=0.0, wait_max=0.0, pings=0, ping_failures=0, resized=0)
+# 每个连接池的扩缩容参数,以连接池对象为key
+# 其中window_* 为该连接池当前统计窗口内的数据,由各自的_maintain_pool()定期读取并清零,主库与副本分别扩缩容
+_pool_options = dict()
+_pool_tasks = []        # 各连接池的维护任务
+_WAIT_EPSILON = 0.001   # 获取连接耗时超过1ms视为发生了排队
+
+# 只读副本,每项为dict(name, pool, down_until, failures)
+# down_until - 副本出错后在该时间之前不再接收读请求,全部读请求回落到主库
+_replicas = []
+_replica_options = dict(retry_interval=30)
+_replica_rr = itertools.count()     # 轮询各个副本
+
+# 当前请求(任务)执行过写操作后,后续读操作固定走主库,保证能读到自己刚写入的数据
+_primary_pinned = contextvars.ContextVar('primary_pinned', default=False)
+
+# 创建连接池:主库一个,configs.db.replicas中每项一个只读副本
+# 副本的配置项只需写出与主库不同的部分,比如host
 async def create_pool(loop, **kw):
     logging.info('create database connection pool...')
     global __pool                               #连接池由全局变量__pool存储
-    __pool = await aiomysql.create_pool(        
+    replicas = kw.pop('replicas', None) or []
+    __pool = await _open_pool(loop, kw)
+    for i, r in enumerate(replicas):
+        options = dict(kw, **r)
+        name = options.get('name') or '%s:%s' % (options.get('host', 'localhost'), options.get('port', 3306))
+        logging.info('create replica connection pool %s...' % name)
+        replica = dict(name=name, pool=None, down_until=0.0, failures=0)
+        try:
+            replica['pool'] = await _open_pool(loop, options, replica)
+        except Exception as e:
+            # 副本不可用时不影响启动,全部读请求由主库承担
+            logging.warning('failed to create replica pool %s: %s' % (name, e))
+            continue
+        _replicas.append(replica)
+    _replica_options['retry_interval'] = kw.get('replica_retry', 30)
+    if 'slow_query' in kw:
+        set_slow_query(**kw['slow_query'])
+    set_coalesce_reads(kw.get('coalesce_reads', True))
+
+async def _open_pool(loop, kw, replica=None):
+    minsize = kw.get('minsize', 1)
+    maxsize = kw.get('maxsize', 10)
+    pool = await _create_pool(loop, kw, maxsize)
+    # 自动扩容的上限,不小于maxsize;缩容时不会低于配置的maxsize
+    max_limit = max(kw.get('max_limit', maxsize), maxsize)
+    # loop与kw用于扩缩容时以新的maxsize重新创建连接池
+    _pool_options[pool] = dict(loop=loop, kw=kw, maxsize=maxsize, max_limit=max_limit,
+                               ping_interval=kw.get('ping_interval', 30), ping_timeout=kw.get('ping_timeout', 1),
+                               wait_threshold=kw.get('wait_threshold', 0.01),
+                               window_acquired=0, window_waited=0, window_wait_total=0.0)
+    await _warmup(pool, min(kw.get('warmup', minsize), maxsize))
+    _pool_tasks.append(asyncio.ensure_future(_maintain_pool(pool, replica), loop=loop))
+    return pool
+
+async def _create_pool(loop, kw, maxsize):
+    minsize = kw.get('minsize', 1)              # 最小连接池大小,保证了任何时候都有minsize个数据库连接
+    return await aiomysql.create_pool(
         host=kw.get('host', 'localhost'),       # 数据库服务器的位置
         port=kw.get('port', 3306),              # mysql端口
         user=kw['user'],
         password=kw['password'],
-        db=kw['db'],                            # 当前数据库名
+        db=kw.get('db') or kw['database'],      # 当前数据库名,兼容配置文件中的database
         charset=kw.get('charset', 'utf8'),      # 连接使用的编码格式为utf-8
         autocommit=kw.get('autocommit', True),  # 自动提交模式,此处默认是False
-        maxsize=kw.get('maxsize', 10),          # 最大连接池大小,默认是10,此处设为10
-        minsize=kw.get('minsize', 1),           # 最小连接池大小,默认是10,此处设为1,保证了任何时候都有一个数据库连接
+        maxsize=maxsize,                        # 最大连接池大小
+        minsize=minsize,
+        pool_recycle=kw.get('pool_recycle', -1),# 连接存活超过pool_recycle秒后重建,避免被MySQL的wait_timeout断开
         loop=loop                               # 传递消息循环对象loop用于异步执行
     )
 
+# 关闭连接池
+async def close_pool():
+    global __pool
+    for task in _pool_tasks:
+        task.cancel()
+    del _pool_tasks[:]
+    pools = [__pool] + [r['pool'] for r in _replicas]
+    del _replicas[:]
+    for pool in pools:
+        _pool_options.pop(pool, None)
+        pool.close()
+        await pool.wait_closed()
+    logging.info('database connection pool closed.')
+
+# 预热:启动时一次性建立n个连接并放回连接池,避免第一波请求承担建连开销
+async def _warmup(pool, n):
+    if n <= pool.size:
+        return
+    conns = await asyncio.gather(*[pool.acquire() for i in range(n)])
+    for conn in conns:
+        pool.release(conn)
+    logging.info('database connection pool warmed up: %s connections' % pool.size)
+
+# 从连接池获取连接,并统计等待时间
+class _Connection(object):
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    async def __aenter__(self):
+        # 等待期间连接池可能被替换(_resize_pool),先取出其参数,替换后仍是同一个dict
+        window = _pool_options[self._pool]
+        start = time.perf_counter()
+        self._conn = await self._pool.acquire()
+        wait = time.perf_counter() - start
+        _pool_stats['acquired'] += 1
+        window['window_acquired'] += 1
+        if wait > _WAIT_EPSILON:
+            _pool_stats['waited'] += 1
+            window['window_waited'] += 1
+            _pool_stats['wait_total'] += wait
+            window['window_wait_total'] += wait
+            if wait > _pool_stats['wait_max']:
+                _pool_stats['wait_max'] = wait
+            logging.info('waited %.3fs for a database connection' % wait)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._pool.release(self._conn)
+        self._conn = None
+
+# 修改连接池的最大连接数.aiomysql没有公开该接口,以新的maxsize创建一个连接池替换原来的,返回当前使用的连接池:
+# 之后的请求从新连接池获取连接;原连接池close()后使用中的连接归还时关闭,全部归还后由后台任务结束,
+# 正在原连接池上排队的请求仍由原连接池分配连接.创建失败时继续使用原连接池
+async def _resize_pool(pool, maxsize, replica=None):
+    global __pool
+    options = _pool_options[pool]
+    logging.info('resize database connection pool: %s => %s' % (pool.maxsize, maxsize))
+    try:
+        new = await _create_pool(options['loop'], options['kw'], maxsize)
+    except Exception as e:
+        logging.warning('failed to resize database connection pool: %s' % e)
+        return pool
+    _pool_options[new] = _pool_options.pop(pool)
+    if replica is None:
+        __pool = new
+    else:
+        replica['pool'] = new
+    _pool_stats['resized'] += 1
+    pool.close()
+    _pool_tasks[:] = [task for task in _pool_tasks if not task.done()]
+    _pool_tasks.append(asyncio.ensure_future(pool.wait_closed()))
+    return new
+
+# 定期维护连接池:
+# 1.健康检查,取出一个连接执行ping,断开的连接会被重连;副本ping成功后恢复接收读请求
+# 2.根据该连接池上一个窗口的排队情况在[maxsize, max_limit]之间扩缩容,副本与主库各自独立
+async def _maintain_pool(pool, replica=None):
+    options = _pool_options[pool]
+    while True:
+        await asyncio.sleep(options['ping_interval'])
+        try:
+            # 直接从连接池取连接,不计入等待统计;连接池已满时不排在请求之后,超时即跳过本次检查
+            conn = await asyncio.wait_for(pool.acquire(), options['ping_timeout'])
+            try:
+                await conn.ping()
+            finally:
+                pool.release(conn)
+            _pool_stats['pings'] += 1
+            if replica is not None and replica['down_until']:
+                logging.info('replica %s is back' % replica['name'])
+                replica['down_until'] = 0.0
+        except asyncio.TimeoutError:
+            logging.info('database health ping skipped: no free connection')
+        except Exception as e:
+            _pool_stats['ping_failures'] += 1
+            logging.warning('database health ping failed: %s' % e)
+            if replica is not None:
+                _mark_replica_down(replica, e)
+        acquired, waited = options['window_acquired'], options['window_waited']
+        avg_wait = options['window_wait_total'] / waited if waited else 0.0
+        options.update(window_acquired=0, window_waited=0, window_wait_total=0.0)
+        # 持续压力:超过1/4的请求在排队且平均等待超过阈值,每次扩容25%
+        if acquired and waited * 4 > acquired and avg_wait > options['wait_threshold']:
+            if pool.maxsize < options['max_limit']:
+                pool = await _resize_pool(pool, min(options['max_limit'], pool.maxsize + max(1, pool.maxsize // 4)), replica)
+        # 整个窗口都没有排队,缩回配置的maxsize;每次替换连接池都要重新建立连接,所以一次缩到位
+        elif waited == 0 and pool.maxsize > options['maxsize']:
+            pool = await _resize_pool(pool, options['maxsize'], replica)
+
+def pool_stats():
+    '''返回连接池当前状态与获取连接的等待统计'''
+    global __pool
+    d = dict(_pool_stats)
+    d.update(size=__pool.size, freesize=__pool.freesize, minsize=__pool.minsize, maxsize=__pool.maxsize,
+             max_limit=_pool_options[__pool]['max_limit'], wait_avg=d['wait_total'] / d['waited'] if d['waited'] else 0.0)
+    d['replicas'] = [dict(name=r['name'], size=r['pool'].size, freesize=r['pool'].freesize, maxsize=r['pool'].maxsize,
+                          max_limit=_pool_options[r['pool']]['max_limit'], failures=r['failures'],
+                          healthy=r['down_until'] <= time.time()) for r in _replicas]
+    return d
+
+# ---------------------------- 读写分离 ----------------------------
+def _mark_replica_down(replica, e):
+    replica['failures'] += 1
+    replica['down_until'] = time.time() + _replica_options['retry_interval']
+    logging.warning('replica %s marked down for %ss: %s' % (replica['name'], _replica_options['retry_interval'], e))
+
+# 选择一个健康的副本,当前请求已固定到主库或没有可用副本时返回None
+def _choose_replica():
+    if not _replicas or _primary_pinned.get():
+        return None
+    now = time.time()
+    healthy = [r for r in _replicas if r['down_until'] <= now]
+    if not healthy:
+        return None
+    return healthy[next(_replica_rr) % len(healthy)]
+
+def pin_primary():
+    '''将当前请求后续的读操作固定到主库'''
+    _primary_pinned.set(True)
+
+# 同时执行的相同查询(语句、参数与size都相同)只执行一次,结果由所有调用者共享,调用者不能修改返回的行
+# 事务中的查询、指定primary或当前请求写过数据时不合并,保证能读到自己的写入
+_select_flight = singleflight.group('select')
+_coalesce_reads = True
+
+def set_coalesce_reads(enabled):
+    global _coalesce_reads
+    _coalesce_reads = enabled
+
 # 用于SQL的SELECT语句,sql形参为sql语句,args为填入sql的选项值
 # 传入size参数，fetchmany()获取最多指定数量的记录，否则通过fetchall()获取所有记录。
-async def select(sql, args, size=None): 
+# 默认由只读副本执行,primary为True或当前请求写过数据时由主库执行;副本连接失败时回落到主库
+async def select(sql, args, size=None, primary=False):
     log(sql, args)
+    tx = _transaction.get()
+    if tx is not None:
+        return await tx.select(sql, args, size)
+    if primary or not _coalesce_reads or _primary_pinned.get():
+        return await _route_select(sql, args, size, primary)
+    key = (sql, tuple(args or ()), size)
+    return await _select_flight.do(key, lambda: _route_select(sql, args, size, False))
+
+async def _route_select(sql, args, size, primary):
     global __pool
-    async with __pool.get() as conn:                                # 从连接池中获取一个数据库连接
+    replica = None if primary else _choose_replica()
+    if replica is not None:
+        try:
+            return await _select(replica['pool'], sql, args, size)
+        except (aiomysql.OperationalError, OSError) as e:
+            _mark_replica_down(replica, e)
+    return await _select(__pool, sql, args, size)
+
+async def _select(pool, sql, args, size):
+    async with _Connection(pool) as conn:                           # 从连接池中获取一个数据库连接
+        start = time.perf_counter()
         async with conn.cursor(aiomysql.DictCursor) as cur:         # 打开一个DictCursor,以dict形式返回结果
-            await cur.execute(sql.replace('?', '%s'), args or ())   # SQL语句的占位符是?，MySQL的占位符是%s
+            await cur.execute(_driver_sql(sql), args or ())          # SQL语句的占位符是?，MySQL的占位符是%s
             if size:
                 rs = await cur.fetchmany(size)
             else:
                 rs = await cur.fetchall()
+        if _record(sql, time.perf_counter() - start):
+            await _explain(conn, sql, args)
         logging.info('rows returned: %s' % len(rs))
         return rs
 
 # 用于SQL的INSERT INTO，UPDATE，DELETE语句
+# 写操作总是由主库执行,并将当前请求后续的读操作固定到主库
+# 处于transaction()中时使用事务绑定的连接;批量模式下只记录语句,提交时统一执行,返回None
 async def execute(sql, args, autocommit=True):
     log(sql)
-    async with __pool.get() as conn:
+    _primary_pinned.set(True)
+    tx = _transaction.get()
+    if tx is not None:
+        return await tx.execute(sql, args)
+    async with _Connection(__pool) as conn:
         # 若数据库的事务为非自动提交的,则调用协程启动连接
         if not autocommit:
             await conn.begin()
         try:
-            async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(sql.replace('?', '%s'), args)
-                affected = cur.rowcount
+            affected = await _execute(conn, sql, args)
             if not autocommit:
                 await conn.commit()
         except BaseException as e:
@@ -57,6 +365,162 @@ async def execute(sql, args, autocommit=True):
             raise
         return affected
 
+# 违反唯一索引(MySQL错误1062)时抛出,key为索引名,调用者可以据此把插入冲突转换为业务错误
+class DuplicateKeyError(Exception):
+
+    def __init__(self, key, message):
+        super().__init__(message)
+        self.key = key
+
+_ER_DUP_ENTRY = 1062
+# Duplicate entry 'a@b.c' for key 'idx_email',MySQL 8.0中为'users.idx_email'
+_RE_DUPLICATE_KEY = re.compile(r"for key '(?:[^'.]*\.)?([^']*)'")
+
+def _check_duplicate_key(e):
+    if e.args and e.args[0] == _ER_DUP_ENTRY:
+        message = str(e.args[1]) if len(e.args) > 1 else ''
+        m = _RE_DUPLICATE_KEY.search(message)
+        raise DuplicateKeyError(m.group(1) if m else None, message) from e
+
+async def _execute(conn, sql, args):
+    start = time.perf_counter()
+    async with conn.cursor(aiomysql.DictCursor) as cur:
+        try:
+            await cur.execute(_driver_sql(sql), args)
+        except aiomysql.IntegrityError as e:
+            _check_duplicate_key(e)
+            raise
+        affected = cur.rowcount
+    if _record(sql, time.perf_counter() - start):
+        await _explain(conn, sql, args)
+    return affected
+
+# ---------------------------- 事务 ----------------------------
+# 当前任务所处的事务,事务内的select/execute都使用事务绑定的同一个连接
+_transaction = contextvars.ContextVar('transaction', default=None)
+
+def _primary_pool():
+    global __pool
+    return __pool
+
+class _Transaction(object):
+    '''
+    由transaction()创建,在async with块内绑定一个主库连接:
+    正常退出时提交,抛出异常时回滚.嵌套的transaction()并入最外层事务.
+    batch为True时为批量模式(unit of work):写语句先排队,提交时按顺序一次性执行,
+    连续的相同语句合并为executemany,多条insert会被驱动合并为一条多行insert.
+    '''
+
+    def __init__(self, batch=False):
+        self.batch = batch
+        self.conn = None
+        self._ctx = None
+        self._token = None
+        self._pending = []
+        self._lock = asyncio.Lock()     # 同一连接上的语句不能并发执行
+
+    async def __aenter__(self):
+        outer = _transaction.get()
+        if outer is not None:
+            return outer
+        self._ctx = _Connection(_primary_pool())
+        self.conn = await self._ctx.__aenter__()
+        try:
+            await self.conn.begin()
+        except BaseException:
+            await self._ctx.__aexit__(None, None, None)
+            raise
+        _primary_pinned.set(True)
+        self._token = _transaction.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._ctx is None:
+            return False    # 嵌套事务,由最外层事务负责提交
+        _transaction.reset(self._token)
+        try:
+            if exc_type is None:
+                try:
+                    await self.flush()
+                    await self.conn.commit()
+                except BaseException:
+                    await self.conn.rollback()
+                    raise
+            else:
+                logging.info('rollback transaction: %s' % exc)
+                await self.conn.rollback()
+        finally:
+            self._pending = []
+            await self._ctx.__aexit__(None, None, None)
+            self._ctx = None
+        return False
+
+    async def select(self, sql, args, size=None):
+        async with self._lock:
+            start = time.perf_counter()
+            async with self.conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(_driver_sql(sql), args or ())
+                rs = await (cur.fetchmany(size) if size else cur.fetchall())
+            _record(sql, time.perf_counter() - start)
+            return rs
+
+    async def execute(self, sql, args):
+        if self.batch:
+            self._pending.append((sql, args))
+            return None
+        async with self._lock:
+            return await _execute(self.conn, sql, args)
+
+    async def flush(self):
+        '''执行批量模式下排队的写语句,返回影响的总行数'''
+        affected = 0
+        async with self._lock:
+            for sql, group in itertools.groupby(self._pending, key=lambda p: p[0]):
+                L = [args for s, args in group]
+                start = time.perf_counter()
+                async with self.conn.cursor(aiomysql.DictCursor) as cur:
+                    try:
+                        if len(L) == 1:
+                            await cur.execute(_driver_sql(sql), L[0])
+                        else:
+                            await cur.executemany(_driver_sql(sql), L)
+                    except aiomysql.IntegrityError as e:
+                        _check_duplicate_key(e)
+                        raise
+                    affected += cur.rowcount
+                _record(sql, time.perf_counter() - start)
+            self._pending = []
+        return affected
+
+def transaction(batch=False):
+    '''
+    用法:
+        async with orm.transaction():
+            await blog.save()
+            await comment.remove()
+    '''
+    return _Transaction(batch)
+
+# ---------------------------- 语句缓存 ----------------------------
+# Model.findAll/findNumber按查询形状缓存拼接好的SQL,不再每次调用都拼接字符串
+# 缓存的语句对象被反复使用,其哈希值只计算一次,_driver_sql和normalize_sql的lru_cache查找也就很廉价
+_statements = dict()
+_MAX_STATEMENTS = 1024
+
+def _cache_statement(key, sql):
+    if len(_statements) >= _MAX_STATEMENTS:
+        # where中直接拼接了字面量的调用会产生大量不同的形状,缓存满了就整体清空
+        logging.warning('statement cache is full, clear it')
+        _statements.clear()
+    _statements[key] = sql
+    return sql
+
+# SQL语句的占位符是?,MySQL驱动的占位符是%s;同一条语句只转换一次
+# aiomysql(PyMySQL协议实现)不支持服务端预处理语句,参数仍由驱动在客户端转义
+@functools.lru_cache(maxsize=_MAX_STATEMENTS)
+def _driver_sql(sql):
+    return sql.replace('?', '%s')
+
 def create_args_string(num):
     L = []
     for n in range(num):
@@ -102,8 +566,8 @@ class FloatField(Field):
 # 文本域
 class TextField(Field):
 
-    def __init__(self, name=None, default=None):
-        super().__init__(name, 'text', False, default)
+    def __init__(self, name=None, default=None, ddl='text'):
+        super().__init__(name, ddl, False, default)
 
 
 # 元类,它定义了如何来构造一个类,任何定义了__metaclass__属性或指定了metaclass的都会通过元类定义的构造方法构造类
@@ -148,6 +612,12 @@ class ModelMetaclass(type):
         # 从类属性中删除已加入映射字典的键,避免重名
         for k in mappings.keys():
             attrs.pop(k)
+        # 检查__indexes__中声明的索引,索引名 ==> 列名的tuple,列必须是已映射的属性
+        indexes = attrs.get('__indexes__', None) or dict()
+        for index, columns in indexes.items():
+            for c in columns:
+                if c not in mappings:
+                    raise ValueError('Index %s of %s refers to unknown field: %s' % (index, name, c))
         #字符串两边加上``
         escaped_fields = list(map(lambda f: '`%s`' % f, fields))
 
@@ -156,6 +626,7 @@ class ModelMetaclass(type):
         attrs['__table__'] = tableName          # 保存表名
         attrs['__primary_key__'] = primaryKey   # 保存主键
         attrs['__fields__'] = fields            # 保存非主键属性名
+        attrs['__indexes__'] = indexes          # 保存声明的索引,由migrate.py创建
 
         # 构造默认的select, insert, update, delete语句,使用?作为占位符
         attrs['__select__'] = 'select `%s`, %s from `%s`' % (primaryKey, ', '.join(escaped_fields), tableName)
@@ -203,61 +674,105 @@ class Model(dict, metaclass=ModelMetaclass):
 
 
     # 根据主键查找
+    # 查询默认由只读副本执行,primary=True时强制读主库
     @classmethod
-    async def find(cls, pk):
+    async def find(cls, pk, primary=False):
         # 直接调用select()方法查询
-        rs = await select('%s where `%s`=?' % (cls.__select__, cls.__primary_key__), [pk], 1)
+        rs = await select('%s where `%s`=?' % (cls.__select__, cls.__primary_key__), [pk], 1, primary)
         if len(rs) == 0:
             return None
         # 在select函数中,打开的是DictCursor,会以dict的形式返回结果
         return cls(**rs[0])
 
     # findAll---根据Where条件查找；
+    # 同一形状(where, orderBy, limit的形式, fields)的SQL只拼接一次,之后从语句缓存中取出
+    # fields为要查询的属性名列表,不指定时查询全部属性
     @classmethod
     async def findAll(cls, where=None, args=None, **kw):
-        # 添加默认select语句
-        sql = [cls.__select__]
-        # 因此若指定有where,在select语句中追加关键字
-        if where:
-            sql.append('where')
-            sql.append(where)
-        if args is None:
-            args = []
-        # 追加order by
+        args = list(args) if args else []   # 复制一份,避免limit参数追加到调用者的列表中
         orderBy = kw.get('orderBy', None)
-        if orderBy:
-            sql.append('order by')
-            sql.append(orderBy)
-        # 追加limit
         limit = kw.get('limit', None)
-        if limit is not None:
-            sql.append('limit')
-            # 如果limit为一个整数n，那就将查询结果的前n个结果返回
-            if isinstance(limit, int):
-                sql.append('?')
-                args.append(limit)
-            # 如果limit为一个两个值的tuple，则前一个值代表索引，后一个值代表从这个索引开始要取的结果数
-            elif isinstance(limit, tuple) and len(limit) == 2:
-                sql.append('?, ?')
-                args.extend(limit)
-            else:
-                raise ValueError('Invalid limit value: %s' % str(limit))
-        rs = await select(' '.join(sql), args)
+        fields = kw.get('fields', None)
+        if fields is not None:
+            fields = tuple(fields)
+        # limit的形式: None, 一个整数n, 或一个(offset, n)的tuple
+        if limit is None:
+            shape = None
+        elif isinstance(limit, int):
+            shape = 1
+            args.append(limit)
+        elif isinstance(limit, tuple) and len(limit) == 2:
+            shape = 2
+            args.extend(limit)
+        else:
+            raise ValueError('Invalid limit value: %s' % str(limit))
+        key = (cls, where, orderBy, shape, fields)
+        sql = _statements.get(key)
+        if sql is None:
+            # 添加默认select语句,或只查询指定属性的select语句
+            L = [cls.__select__ if fields is None else cls._projection(fields)]
+            # 因此若指定有where,在select语句中追加关键字
+            if where:
+                L.append('where')
+                L.append(where)
+            # 追加order by
+            if orderBy:
+                L.append('order by')
+                L.append(orderBy)
+            # 追加limit: 一个整数n取前n个结果; (offset, n)则从offset开始取n个结果
+            if shape == 1:
+                L.append('limit ?')
+            elif shape == 2:
+                L.append('limit ?, ?')
+            sql = _cache_statement(key, ' '.join(L))
+        rs = await select(sql, args, primary=kw.get('primary', False))
         return [cls(**r) for r in rs]
 
+    # 只查询指定属性的select语句
+    @classmethod
+    def _projection(cls, fields):
+        for f in fields:
+            if f not in cls.__mappings__:
+                raise ValueError('Invalid field for %s: %s' % (cls.__name__, f))
+        return 'select %s from `%s`' % (', '.join(map(lambda f: '`%s`' % f, fields)), cls.__table__)
+
     # 通过where条件查询数量
     @classmethod
     @asyncio.coroutine
-    def findNumber(cls, selectField, where=None, args=None):
-        sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
-        if where:
-            sql.append('where')
-            sql.append(where)
-        rs = yield from select(' '.join(sql), args, 1)
+    def findNumber(cls, selectField, where=None, args=None, primary=False):
+        key = (cls, selectField, where)
+        sql = _statements.get(key)
+        if sql is None:
+            sql = 'select %s _num_ from `%s`' % (selectField, cls.__table__)
+            if where:
+                sql = '%s where %s' % (sql, where)
+            sql = _cache_statement(key, sql)
+        rs = yield from select(sql, args, 1, primary)
         if len(rs) == 0:
             return None
         return rs[0]['_num_']
 
+    # 只判断是否存在满足条件的记录,不读取任何列,找到第一条即停止
+    @classmethod
+    async def exists(cls, where, args=None, primary=False):
+        key = (cls, 'exists', where)
+        sql = _statements.get(key)
+        if sql is None:
+            sql = _cache_statement(key, 'select 1 _exists_ from `%s` where %s limit 1' % (cls.__table__, where))
+        rs = await select(sql, args, 1, primary)
+        return len(rs) > 0
+
+    # 原子地增减主键为pk的记录的数值属性,返回影响的行数
+    @classmethod
+    async def increase(cls, pk, field, delta=1):
+        key = (cls, 'increase', field)
+        sql = _statements.get(key)
+        if sql is None:
+            if field not in cls.__fields__:
+                raise ValueError('Invalid field for %s: %s' % (cls.__name__, field))
+            sql = _cache_statement(key, 'update `%s` set `%s`=`%s`+? where `%s`=?' % (cls.__table__, field, field, cls.__primary_key__))
+        return await execute(sql, [delta, pk])
+
     # save、update、remove这三个方法需要管理员权限才能操作，所以不定义为类方法，需要创建实例之后才能调用
     async def save(self):
         # 添加非主键属性
@@ -267,20 +782,34 @@ class Model(dict, metaclass=ModelMetaclass):
         # 执行sql语句后返回影响的结果行数
         rows = await execute(self.__insert__, args)
         # 影响的行数一定为1
-        if rows != 1:
+        if rows is not None and rows != 1:     # 批量事务中语句尚未执行,rows为None
             logging.warn('failed to insert record: affected rows: %s' % rows)
 
-    async def update(self):
-        args = list(map(self.getValue, self.__fields__))
+    # fields为要更新的属性名列表,不指定时更新全部属性
+    # 由increase()维护的计数等属性不应包含在内,否则会覆盖读取之后其他请求做的修改
+    async def update(self, fields=None):
+        if fields is None:
+            sql, fields = self.__update__, self.__fields__
+        else:
+            key = (self.__class__, 'update', tuple(fields))
+            sql = _statements.get(key)
+            if sql is None:
+                for f in fields:
+                    if f not in self.__fields__:
+                        raise ValueError('Invalid field for %s: %s' % (self.__class__.__name__, f))
+                sql = _cache_statement(key, 'update `%s` set %s where `%s`=?' % (self.__table__, ', '.join(map(lambda f: '`%s`=?' % f, fields)), self.__primary_key__))
+        args = list(map(self.getValue, fields))
         args.append(self.getValue(self.__primary_key__))
-        rows = await execute(self.__update__, args)
-        if rows != 1:
+        rows = await execute(sql, args)
+        if rows is not None and rows != 1:
             logging.warn('failed to update by primary key: affected rows: %s' % rows)
 
+    # 返回删除的行数,记录已被删除时为0;批量事务中语句在提交时才执行,返回None
     async def remove(self):
         args = [self.getValue(self.__primary_key__)]
         rows = await execute(self.__delete__, args)
-        if rows != 1:
+        if rows is not None and rows != 1:
             logging.warn('failed to remove by primary key: affected rows: %s' % rows)
+        return rows
 
 
@@ -0,0 +1,74 @@
+'密码哈希'
+
+# 数据库中保存的密码格式:
+#   pbkdf2_sha256$<迭代次数>$<salt>$<hash>     当前格式,对"uid:passwd"做PBKDF2,每个用户使用随机salt
+#   40位十六进制                                旧格式,sha1("uid:passwd"),登录成功时自动升级为当前格式
+# 其中passwd是浏览器端计算的sha1(email:口令)
+# PBKDF2每次需要几十毫秒的CPU时间,在线程池中执行(hashlib计算期间会释放GIL),不阻塞事件循环
+# 同时计算的数量不超过线程数,排队等待的数量超过max_waiting时直接拒绝,避免登录高峰占满线程池
+
+import asyncio, hashlib, hmac, logging, os, time
+from concurrent.futures import ThreadPoolExecutor
+
+from apis import APIError
+
+ALGORITHM = 'pbkdf2_sha256'
+
+_options = dict(iterations=100000, workers=2, max_waiting=100)
+_executor = None
+_semaphore = None
+_waiting = 0
+
+def init(iterations=100000, workers=2, max_waiting=100):
+    global _executor, _semaphore
+    _options.update(iterations=iterations, workers=workers, max_waiting=max_waiting)
+    _executor = ThreadPoolExecutor(workers, thread_name_prefix='passwords')
+    _semaphore = asyncio.Semaphore(workers)
+
+def close():
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+
+def _pbkdf2(uid, passwd, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', ('%s:%s' % (uid, passwd)).encode('utf-8'), salt, iterations)
+
+async def _run(uid, passwd, salt, iterations):
+    global _waiting
+    if _semaphore is None:
+        init(**_options)
+    if _waiting >= _options['max_waiting']:
+        logging.warning('too many password hashing requests: %s waiting' % _waiting)
+        raise APIError('auth:busy', '', 'Too many requests, please try again later.')
+    _waiting += 1
+    try:
+        async with _semaphore:
+            start = time.time()
+            dk = await asyncio.get_event_loop().run_in_executor(_executor, _pbkdf2, uid, passwd, salt, iterations)
+            logging.debug('pbkdf2 in %.3fs' % (time.time() - start))
+            return dk
+    finally:
+        _waiting -= 1
+
+async def hash_password(uid, passwd):
+    '''返回用于保存到数据库的密码'''
+    salt = os.urandom(16)
+    iterations = _options['iterations']
+    dk = await _run(uid, passwd, salt, iterations)
+    return '%s$%s$%s$%s' % (ALGORITHM, iterations, salt.hex(), dk.hex())
+
+async def verify_password(uid, passwd, stored):
+    '''返回(是否正确, 是否需要重新计算哈希)'''
+    if '$' not in stored:
+        sha1 = hashlib.sha1(('%s:%s' % (uid, passwd)).encode('utf-8')).hexdigest()
+        return hmac.compare_digest(sha1, stored), True
+    try:
+        algorithm, iterations, salt, expected = stored.split('$')
+        iterations = int(iterations)
+        salt, expected = bytes.fromhex(salt), bytes.fromhex(expected)
+    except ValueError:
+        logging.warning('invalid password hash of user %s' % uid)
+        return False, False
+    if algorithm != ALGORITHM:
+        return False, False
+    dk = await _run(uid, passwd, salt, iterations)
+    return hmac.compare_digest(dk, expected), iterations < _options['iterations']
@@ -0,0 +1,114 @@
+'令牌桶限流'
+
+# 按路由配置限流规则,每条规则可以同时按客户端IP与登录用户限流:
+#   "POST /api/authenticate": {"ip": [10, 60]}
+# [n, seconds]表示每seconds秒补充n个令牌,桶的容量也是n,即最多连续n次请求,之后按平均速率放行
+# 每个(规则, IP/用户)对应一个桶,只保存剩余令牌数与上次更新时间,检查时按经过的时间补充令牌,O(1)
+# 令牌已补满的桶与新建的桶没有区别,定期删除,内存只与最近活跃的客户端数有关
+# 超出限制时返回429,Retry-After为得到下一个令牌需要等待的秒数
+# 按IP限流的中间件位于auth_factory之前,被限流的请求不会因为解析cookie而查询数据库;按用户限流的位于其后
+
+import asyncio, json, logging, math, time
+
+from aiohttp import web
+from coroweb import match_route
+
+class TokenBucketLimiter(object):
+
+    def __init__(self, count, seconds):
+        self.capacity = float(count)
+        self.rate = count / seconds     # 每秒补充的令牌数
+        self._buckets = dict()          # key ==> [剩余令牌数, 更新时间]
+
+    def take(self, key, now=None):
+        '''取一个令牌,成功返回0,否则返回需要等待的秒数'''
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [self.capacity - 1, now]
+            return 0
+        tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0
+        bucket[0] = tokens
+        return (1 - tokens) / self.rate
+
+    def gc(self, now=None):
+        '''删除令牌已补满的桶,返回删除的数目'''
+        if now is None:
+            now = time.monotonic()
+        full = [k for k, (tokens, updated) in self._buckets.items() if tokens + (now - updated) * self.rate >= self.capacity]
+        for k in full:
+            del self._buckets[k]
+        return len(full)
+
+    def __len__(self):
+        return len(self._buckets)
+
+_rules = dict()     # "METHOD /path" ==> {'ip': limiter, 'user': limiter}
+_options = dict(trust_proxy=False, gc_interval=60)
+_gc_task = None
+
+def init(loop, routes, trust_proxy=False, gc_interval=60):
+    global _gc_task
+    _options.update(trust_proxy=trust_proxy, gc_interval=gc_interval)
+    _rules.clear()
+    for route, limits in routes.items():
+        _rules[route] = dict((by, TokenBucketLimiter(*limit)) for by, limit in limits.items())
+    if _gc_task is None:
+        _gc_task = asyncio.ensure_future(_gc_periodically(), loop=loop)
+
+async def _gc_periodically():
+    while True:
+        await asyncio.sleep(_options['gc_interval'])
+        removed = 0
+        for limiters in _rules.values():
+            for limiter in limiters.values():
+                removed += limiter.gc()
+        if removed:
+            logging.info('ratelimit: remove %s idle buckets' % removed)
+
+# 路由的模板,如/api/blogs/{id}/comments,与配置中的写法一致
+def _route_key(request):
+    route = match_route(request)
+    return '%s %s' % (route.method, route.path) if route is not None else None
+
+def _client_ip(request):
+    if _options['trust_proxy']:
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote
+
+def check(request, by=('ip', 'user')):
+    '''按by中的规则检查请求是否超出限制,返回需要等待的秒数,未超出时返回0'''
+    limiters = _rules.get(_route_key(request))
+    if not limiters:
+        return 0
+    now = time.monotonic()
+    wait = 0
+    if 'ip' in by and 'ip' in limiters:
+        wait = limiters['ip'].take(_client_ip(request), now)
+    user = getattr(request, '__user__', None)
+    if not wait and 'user' in by and user is not None and 'user' in limiters:
+        wait = limiters['user'].take(user.id, now)
+    return wait
+
+def _ratelimit_factory(by):
+    async def factory(app, handler):
+        async def ratelimit(request):
+            wait = check(request, by)
+            if wait:
+                logging.warning('rate limit exceeded: %s %s from %s' % (request.method, request.path, _client_ip(request)))
+                body = dict(error='ratelimit:exceeded', data='', message='Too many requests, please try again later.')
+                return web.Response(status=429, headers={'Retry-After': str(math.ceil(wait))},
+                    body=json.dumps(body).encode('utf-8'), content_type='application/json')
+            return (await handler(request))
+        return ratelimit
+    return factory
+
+ip_ratelimit_factory = _ratelimit_factory(('ip',))
+user_ratelimit_factory = _ratelimit_factory(('user',))
@@ -9,7 +9,7 @@ grant select, insert, update, delete on awesome.* to 'www-data'@'localhost' iden
 create table users (
     `id` varchar(50) not null,
     `email` varchar(50) not null,
-    `passwd` varchar(50) not null,
+    `passwd` varchar(200) not null,
     `admin` bool not null,
     `name` varchar(50) not null,
     `image` varchar(500) not null,
@@ -27,6 +27,8 @@ create table blogs (
     `name` varchar(50) not null,
     `summary` varchar(200) not null,
     `content` mediumtext not null,
+    `comment_count` bigint not null default 0,
+    `views` bigint not null default 0,
     `created_at` real not null,
     key `idx_created_at` (`created_at`),
     primary key (`id`)
@@ -39,7 +41,9 @@ create table comments (
     `user_name` varchar(50) not null,
     `user_image` varchar(500) not null,
     `content` mediumtext not null,
+    `html_content` mediumtext null,
     `created_at` real not null,
     key `idx_created_at` (`created_at`),
+    key `idx_blog_id_created_at` (`blog_id`, `created_at`),
     primary key (`id`)
 ) engine=innodb default charset=utf8;
\ No newline at end of file
@@ -0,0 +1,389 @@
+'博客全文搜索'
+
+# 倒排索引,建立在博客的name, summary与去掉Markdown标记的content上
+# 中文按相邻两个字切分(bigram),英文与数字按单词切分并转为小写,查询词使用同样的切分方式
+# 索引时中文同时收录单字(unigram),只有一个字的查询(如"书")也能命中;多字查询只使用bigram
+# 排序使用BM25,name与summary中的词分别按NAME_WEIGHT, SUMMARY_WEIGHT倍计入词频
+#
+# 索引分为两部分:
+# 1.磁盘上的基础段,以紧凑的二进制格式保存,启动时通过mmap加载,只解析文档表与词典,倒排表在查询时才解码
+# 2.内存中的增量段,保存启动以后新建与修改的博客
+# 博客被修改或删除后,它原来的文档号失效,查询时跳过;save()时把两部分合并写回磁盘
+
+import asyncio, functools, logging, math, mmap, os, re, struct, time
+
+from models import Blog
+
+NAME_WEIGHT = 3
+SUMMARY_WEIGHT = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# ---------------------------- 分词 ----------------------------
+_RE_MD_CODE_FENCE = re.compile(r'^\s*(```|~~~).*$', re.M)
+_RE_MD_IMAGE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+_RE_MD_LINK = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+_RE_HTML_TAG = re.compile(r'<[^>]+>')
+_RE_MD_SYMBOL = re.compile(r'[#*>`_~|\-=+]+')
+# 连续的中日韩文字,或连续的英文字母与数字
+_RE_TOKEN = re.compile(r'([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]+)|([a-z0-9]+)')
+
+# 去掉Markdown标记,只保留文字
+def strip_markdown(text):
+    text = _RE_MD_CODE_FENCE.sub(' ', text)
+    text = _RE_MD_IMAGE.sub(r'\1', text)
+    text = _RE_MD_LINK.sub(r'\1', text)
+    text = _RE_HTML_TAG.sub(' ', text)
+    return _RE_MD_SYMBOL.sub(' ', text)
+
+def tokenize(text, unigrams=False):
+    '''切分文本,返回词的列表: 中文为相邻两字组成的词(只有一个字时为单字),英文为小写的单词
+    unigrams为True时(建立索引)中文的每个字也作为一个词'''
+    tokens = []
+    for cjk, word in _RE_TOKEN.findall(text.lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i+2] for i in range(len(cjk) - 1))
+            if unigrams:
+                tokens.extend(cjk)
+    return tokens
+
+# 统计一篇博客的词频,返回(词 ==> 加权词频, 文档长度)
+def _term_freqs(name, summary, content):
+    tf = dict()
+    length = 0
+    for text, weight in ((name, NAME_WEIGHT), (summary, SUMMARY_WEIGHT), (strip_markdown(content), 1)):
+        for t in tokenize(text or '', unigrams=True):
+            tf[t] = tf.get(t, 0) + weight
+            length += weight
+    return tf, length
+
+# ---------------------------- 磁盘格式 ----------------------------
+# header: magic, version, 文档数, 词数, 文档总长度
+# 文档表: 每篇 id, 长度, created_at, name, summary (字符串为2字节长度+utf-8)
+# 词典:   每个词 词, df, 倒排表偏移, 倒排表字节数 (按词排序)
+# 倒排表: 每个词的(文档号差值, 词频)序列,以varint编码
+_MAGIC = b'BSIX'
+_VERSION = 2         # 2: 收录中文单字;旧版本的索引文件加载失败,启动时从数据库重建
+_HEADER = struct.Struct('<4sIIIQ')
+_DOC = struct.Struct('<Id')
+_TERM = struct.Struct('<IQI')
+_U16 = struct.Struct('<H')
+
+def _encode_varints(values, out):
+    for v in values:
+        while v >= 0x80:
+            out.append((v & 0x7f) | 0x80)
+            v >>= 7
+        out.append(v)
+
+def _decode_postings(buf):
+    '''解码一个词的倒排表,返回{文档号: 词频}'''
+    postings = dict()
+    values = []
+    v = shift = 0
+    for b in buf:
+        v |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        values.append(v)
+        v = shift = 0
+    docno = 0
+    for i in range(0, len(values), 2):
+        docno += values[i]
+        postings[docno] = values[i + 1]
+    return postings
+
+def _write_str(f, s):
+    b = s.encode('utf-8')
+    f.write(_U16.pack(len(b)))
+    f.write(b)
+
+def _read_str(buf, pos):
+    n, = _U16.unpack_from(buf, pos)
+    pos += _U16.size
+    return bytes(buf[pos:pos+n]).decode('utf-8'), pos + n
+
+# 通过mmap加载的基础段
+class _Segment(object):
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self._mmap
+        magic, version, ndocs, nterms, self.total_len = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError('Invalid search index file: %s' % path)
+        pos = _HEADER.size
+        self.docs = []      # 文档号即列表下标: (id, 长度, created_at, name, summary)
+        for i in range(ndocs):
+            blog_id, pos = _read_str(buf, pos)
+            length, created_at = _DOC.unpack_from(buf, pos)
+            pos += _DOC.size
+            name, pos = _read_str(buf, pos)
+            summary, pos = _read_str(buf, pos)
+            self.docs.append((blog_id, length, created_at, name, summary))
+        self.terms = dict() # 词 ==> (df, 倒排表偏移, 倒排表字节数)
+        for i in range(nterms):
+            term, pos = _read_str(buf, pos)
+            self.terms[term] = _TERM.unpack_from(buf, pos)
+            pos += _TERM.size
+        self._postings_start = pos
+
+    def postings(self, term):
+        entry = self.terms.get(term)
+        if entry is None:
+            return dict()
+        df, offset, nbytes = entry
+        start = self._postings_start + offset
+        return _decode_postings(self._mmap[start:start+nbytes])
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+# 合并基础段与增量段中一个词的倒排表,只保留docs中的文档
+def _merge_postings(base, delta, docs, term):
+    postings = base.postings(term) if base else dict()
+    postings.update(delta.get(term, ()))
+    return dict((docno, tf) for docno, tf in postings.items() if docno in docs)
+
+# 将基础段与增量段合并写入path,文档按原编号的顺序重新编号,返回{原文档号: 新文档号}
+# 在线程池中执行,只读取传入的快照与基础段(只读的mmap)
+def _write_segment(path, base, docs, postings, total_len):
+    start_time = time.time()
+    terms = set(postings)
+    if base:
+        terms.update(base.terms)
+    renumber = dict((docno, i) for i, docno in enumerate(sorted(docs)))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        dictionary = []
+        postings_buf = bytearray()
+        for term in sorted(terms):
+            merged = _merge_postings(base, postings, docs, term)
+            if not merged:
+                continue
+            # 按新的文档号排序,文档号保存与前一个的差值
+            values = []
+            last = 0
+            for docno, tf in sorted((renumber[d], tf) for d, tf in merged.items()):
+                values.append(docno - last)
+                values.append(tf)
+                last = docno
+            start = len(postings_buf)
+            _encode_varints(values, postings_buf)
+            dictionary.append((term, len(merged), start, len(postings_buf) - start))
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(renumber), len(dictionary), total_len))
+        for docno in sorted(docs):
+            blog_id, length, created_at, name, summary = docs[docno]
+            _write_str(f, blog_id)
+            f.write(_DOC.pack(length, created_at))
+            _write_str(f, name)
+            _write_str(f, summary)
+        for term, df, start, nbytes in dictionary:
+            _write_str(f, term)
+            f.write(_TERM.pack(df, start, nbytes))
+        f.write(postings_buf)
+    os.replace(tmp, path)
+    logging.info('save search index %s in %.3fs: %s blogs, %s terms' % (path, time.time() - start_time, len(docs), len(dictionary)))
+    return renumber
+
+# ---------------------------- 索引 ----------------------------
+class SearchIndex(object):
+
+    def __init__(self, path=None):
+        self.path = path
+        self._base = None
+        self._docs = dict()     # 文档号 ==> (id, 长度, created_at, name, summary),只包含有效的文档
+        self._ids = dict()      # 博客id ==> 文档号
+        self._postings = dict() # 增量段: 词 ==> {文档号: 词频}
+        self._next_docno = 0
+        self._total_len = 0
+        self.dirty = False
+        if path and os.path.exists(path):
+            self._base = _Segment(path)
+            for docno, doc in enumerate(self._base.docs):
+                self._docs[docno] = doc
+                self._ids[doc[0]] = docno
+            self._next_docno = len(self._base.docs)
+            self._total_len = self._base.total_len
+            logging.info('load search index %s: %s blogs, %s terms' % (path, len(self._docs), len(self._base.terms)))
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, blog):
+        '''加入或更新一篇博客'''
+        self.remove(blog.id)
+        tf, length = _term_freqs(blog.name, blog.summary, blog.content)
+        docno = self._next_docno
+        self._next_docno += 1
+        self._docs[docno] = (blog.id, length, blog.created_at, blog.name, blog.summary)
+        self._ids[blog.id] = docno
+        self._total_len += length
+        for term, freq in tf.items():
+            self._postings.setdefault(term, dict())[docno] = freq
+        self.dirty = True
+
+    def remove(self, blog_id):
+        '''删除一篇博客,它在倒排表中的记录在查询时跳过,save()时清除'''
+        docno = self._ids.pop(blog_id, None)
+        if docno is None:
+            return
+        self._total_len -= self._docs.pop(docno)[1]
+        self.dirty = True
+
+    # 合并基础段与增量段中一个词的倒排表,只保留有效的文档
+    def _term_postings(self, term):
+        return _merge_postings(self._base, self._postings, self._docs, term)
+
+    def search(self, q, offset=0, limit=10):
+        '''BM25排序,返回(命中总数, [dict(id, name, summary, created_at, score)])'''
+        n = len(self._docs)
+        terms = set(tokenize(q))
+        if n == 0 or not terms:
+            return 0, []
+        avgdl = self._total_len / n
+        scores = dict()
+        for term in terms:
+            postings = self._term_postings(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for docno, tf in postings.items():
+                dl = self._docs[docno][1]
+                s = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl))
+                scores[docno] = scores.get(docno, 0.0) + s
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[offset:offset+limit]
+        results = []
+        for docno, score in ranked:
+            blog_id, length, created_at, name, summary = self._docs[docno]
+            results.append(dict(id=blog_id, name=name, summary=summary, created_at=created_at, score=score))
+        return len(scores), results
+
+    # 保存分为三步:在事件循环中复制文档表与增量段(_snapshot),在线程池中合并写入磁盘(_write_segment),
+    # 再回到事件循环加载新的基础段(_load_saved);写入期间新建、修改与删除的博客在加载后保留
+    def _snapshot(self):
+        self.dirty = False
+        return dict(base=self._base, docs=dict(self._docs), postings=dict((t, dict(p)) for t, p in self._postings.items()),
+                    total_len=self._total_len)
+
+    def _load_saved(self, path, next_docno, renumber):
+        base = _Segment(path)
+        # 快照中的文档按renumber重新编号,快照之后加入的文档顺延在其后
+        shift = len(renumber) - next_docno
+        postings = dict()
+        for term, p in self._postings.items():
+            p = dict((docno + shift, tf) for docno, tf in p.items() if docno >= next_docno)
+            if p:
+                postings[term] = p
+        old = self._base
+        self.path = path
+        self._base = base
+        self._docs = dict((renumber[docno] if docno < next_docno else docno + shift, doc) for docno, doc in self._docs.items())
+        self._ids = dict((doc[0], docno) for docno, doc in self._docs.items())
+        self._postings = postings
+        self._next_docno += shift
+        if old:
+            old.close()
+
+    def save(self, path=None):
+        '''合并两个段,重新编号后写入磁盘,再通过mmap加载为新的基础段'''
+        path = path or self.path
+        next_docno, snapshot = self._next_docno, self._snapshot()
+        try:
+            renumber = _write_segment(path, **snapshot)
+        except Exception:
+            self.dirty = True
+            raise
+        self._load_saved(path, next_docno, renumber)
+
+    async def save_in_executor(self, path=None):
+        '''与save()相同,合并与写入在线程池中执行,不阻塞事件循环'''
+        path = path or self.path
+        next_docno, snapshot = self._next_docno, self._snapshot()
+        try:
+            renumber = await asyncio.get_event_loop().run_in_executor(None, functools.partial(_write_segment, path, **snapshot))
+        except Exception:
+            self.dirty = True
+            raise
+        self._load_saved(path, next_docno, renumber)
+
+    def close(self):
+        if self._base:
+            self._base.close()
+            self._base = None
+
+# ---------------------------- 全局索引 ----------------------------
+_index = None
+_save_task = None
+_save_lock = None
+
+# 加载索引文件;文件不存在,或收录的博客数与数据库不一致时(比如其他进程修改过博客),从数据库重建
+async def init_index(loop, path, save_interval=300):
+    global _index, _save_task
+    try:
+        _index = SearchIndex(path)
+    except Exception as e:
+        logging.warning('failed to load search index %s: %s' % (path, e))
+        _index = SearchIndex()
+        _index.path = path
+    num = await Blog.findNumber('count(id)')
+    if num != len(_index):
+        await rebuild(path)
+    _save_task = asyncio.ensure_future(_save_periodically(save_interval), loop=loop)
+
+async def rebuild(path, batch=200):
+    global _index
+    logging.info('rebuild search index...')
+    start = time.time()
+    index = SearchIndex()
+    offset = 0
+    while True:
+        blogs = await Blog.findAll(orderBy='created_at', limit=(offset, batch), fields=('id', 'name', 'summary', 'content', 'created_at'))
+        for blog in blogs:
+            index.add(blog)
+        if len(blogs) < batch:
+            break
+        offset += batch
+    await index.save_in_executor(path)
+    if _index is not None:
+        _index.close()
+    _index = index
+    logging.info('search index rebuilt in %.1fs: %s blogs' % (time.time() - start, len(index)))
+
+async def _save_periodically(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await save_index()
+        except Exception as e:
+            logging.warning('failed to save search index: %s' % e)
+
+async def save_index():
+    '''将有变化的索引写入磁盘,同时只进行一次保存'''
+    global _save_lock
+    if _save_lock is None:
+        _save_lock = asyncio.Lock()
+    async with _save_lock:
+        if _index is not None and _index.dirty:
+            await _index.save_in_executor()
+
+def index_blog(blog):
+    if _index is not None:
+        _index.add(blog)
+
+def remove_blog(blog_id):
+    if _index is not None:
+        _index.remove(blog_id)
+
+def search(q, offset=0, limit=10):
+    if _index is None:
+        return 0, []
+    return _index.search(q, offset, limit)
@@ -0,0 +1,64 @@
+'请求合并(single-flight)'
+
+# 同一个key同时只执行一次,执行期间到达的相同调用等待同一个结果,不再重复执行:
+#   rows = await group('select').do(key, lambda: _select(...))
+# 只合并同时进行的调用,执行结束后不保留结果(需要缓存时使用cache.py)
+# 每个group统计调用次数、实际执行次数与被合并的次数,由stats()返回
+
+import asyncio
+
+class SingleFlight(object):
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = dict()    # key ==> Future
+        self.calls = 0          # 调用次数
+        self.executions = 0     # 实际执行次数
+        self.coalesced = 0      # 等待其他调用结果的次数
+
+    async def do(self, key, fn):
+        '''返回fn()的结果,key相同的调用正在执行时等待其结果;fn为返回协程的函数'''
+        self.calls += 1
+        while True:
+            fut = self._calls.get(key)
+            if fut is None:
+                break
+            self.coalesced += 1
+            try:
+                return (await asyncio.shield(fut))
+            except asyncio.CancelledError:
+                # 执行的调用被取消(如客户端断开)时,由等待者之一重新执行
+                if not fut.cancelled():
+                    raise
+                self.coalesced -= 1
+        fut = asyncio.get_event_loop().create_future()
+        self._calls[key] = fut
+        self.executions += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()     # 没有其他调用在等待时,避免"exception was never retrieved"警告
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self):
+        return dict(calls=self.calls, executions=self.executions, coalesced=self.coalesced, inflight=len(self._calls))
+
+_groups = dict()
+
+def group(name):
+    g = _groups.get(name)
+    if g is None:
+        g = _groups[name] = SingleFlight(name)
+    return g
+
+def stats():
+    return dict((name, g.stats()) for name, g in _groups.items())